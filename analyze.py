@@ -1,42 +1,168 @@
+import argparse
+import heapq
+import multiprocessing
 import os
+from array import array
+from typing import Iterator, List, Optional, Tuple
+
+from bitcoin.core import CTransaction, b2lx
+
+from analyzer.prevout_cache import PrevoutCache, outpoint_key
 from encoding.decode import decode
+from encoding.dump_index import TRANSACTION_TOPICS, DumpLookupIndex, open_dump, raw_transactions, record_hashes
+from encoding.tx_scanner import scan_transaction, virtual_size
+
+"""
+    Streaming, indexed inspector of a mempool dump, binary or text.
+
+    The dump is never loaded whole: `top` streams it once, keeping the k
+    largest records by the chosen key in a bounded heap, and `show` and
+    `txid` read records through the lookup index (encoding/dump_index.py),
+    built on first use and extended as the dump grows, so they are a seek
+    each whatever the size of the dump. The records selected are decoded by
+    a process pool and printed, or written to `record_<n>_deserialized.txt`
+    files with --out.
+
+    Fees only count inputs whose parents were seen earlier in the dump: the
+    outputs of every rawtx are kept in a bounded prevout cache, and
+    transactions spending outputs it does not hold are left out of the fee
+    rankings.
 
-# Get the directory of the current script
-current_dir = os.path.dirname(os.path.abspath(__file__))
+        python analyze.py data/mempool_dump.bin top --by fee -k 10
+        python analyze.py data/mempool_dump.bin show 42 1337 --out inspected
+        python analyze.py data/mempool_dump.bin txid 662038688ad4727bcbc7d9f5fb3635279435ac83d86d28daa30a4e28aa78e52b
+"""
 
-# Default file name
 DUMP_FILE_PATH = "data/mempool_drop.txt"
-    print("Line {} has length {}".format(line[0], len(line[1])))
-    if input("See line content? (y/n)") == "y":
-        decoded = decode(line[1])
-        deserialized = decoded.deserialize()
-        print("Deserialized: {}".format(deserialized))
+TOP_KEYS = ("size", "inputs", "outputs", "fee", "feerate")
+# records decoded per pool task
+DESCRIBE_CHUNK = 16
+
+
+# (record number, key) of the rawtx records, for the fee keys only the ones
+# whose prevouts are all known
+def record_keys(path: str, by: str, prevout_budget: int) -> Iterator[Tuple[int, float]]:
+    cache = PrevoutCache(memory_budget=prevout_budget) if by in ("fee", "feerate") else None
+    for number, body in raw_transactions(path):
+        if by == "size":
+            yield number, len(body)
+            continue
+        try:
+            tx = scan_transaction(body)
+        except Exception:
+            continue
+        if by == "inputs":
+            yield number, len(tx.vin)
+        elif by == "outputs":
+            yield number, len(tx.vout)
+        else:
+            values = [cache.peek(outpoint_key(*txin.prevout)) for txin in tx.vin]
+            cache.put_outputs(tx.GetTxid(), [output.nValue for output in tx.vout])
+            if None in values:
+                continue
+            fee = sum(values) - sum(output.nValue for output in tx.vout)
+            yield number, fee if by == "fee" else fee / virtual_size(tx)
+
+
+# The k records with the largest keys, largest first, in O(k) memory
+def top_records(path: str, by: str = "size", k: int = 10, prevout_budget: int = 256 * 1024 * 1024) -> List[Tuple[int, float]]:
+    heap = []
+    for number, key in record_keys(path, by, prevout_budget):
+        # ties go to the earlier record
+        if len(heap) < k:
+            heapq.heappush(heap, (key, -number))
+        elif (key, -number) > heap[0]:
+            heapq.heapreplace(heap, (key, -number))
+    return [(-number, key) for key, number in sorted(heap, reverse=True)]
+
+
+def describe(dump, position: int, number: int) -> str:
+    record = dump[position]
+    if record is None:
+        return "Record {}: {}".format(number, dump.line(position))
+    header = "Record {}: {} sequence={} timestamp={}".format(number, record.topic.decode(), record.sequence, record.timestamp)
+    if record.topic in TRANSACTION_TOPICS:
+        tx = CTransaction.deserialize(bytes(record.body))
+        return "{}\ntxid {} size {} inputs {} outputs {}\n{}".format(header, b2lx(tx.GetTxid()), len(record.body), len(tx.vin), len(tx.vout), tx)
+    return "{}\n{}".format(header, decode(record).deserialize())
+
+
+def _describe_chunk(path: str, numbers: List[int], offsets: Optional[array] = None) -> List[str]:
+    with open_dump(path, offsets) as dump:
+        # a text dump is opened on the offsets of these records only
+        positions = range(len(numbers)) if offsets is not None else numbers
+        return [describe(dump, position, number) for position, number in zip(positions, numbers)]
+
+
+# Decoded records in the order of `numbers`, split across `workers` processes
+def describe_records(index: DumpLookupIndex, numbers: List[int], workers: int = 1) -> List[str]:
+    tasks = []
+    for i in range(0, len(numbers), DESCRIBE_CHUNK):
+        chunk = numbers[i:i + DESCRIBE_CHUNK]
+        tasks.append((index.path, chunk, array("Q", [index.offsets[number] for number in chunk]) if index.offsets else None))
+    if workers > 1 and len(tasks) > 1:
+        with multiprocessing.get_context("spawn").Pool(workers) as pool:
+            chunks = pool.starmap(_describe_chunk, tasks)
+    else:
+        chunks = [_describe_chunk(*task) for task in tasks]
+    return [description for chunk in chunks for description in chunk]
+
+
+# Records carrying the hash, checked against the full hash since the index
+# only keys on its first 8 bytes
+def records_for_hash(index: DumpLookupIndex, hash_hex: str) -> List[int]:
+    hash = bytes.fromhex(hash_hex)
+    with index.reader() as dump:
+        return [number for number in index.lookup(hash_hex) if hash in record_hashes(dump[number])]
+
+
+def output(index: DumpLookupIndex, numbers: List[int], workers: int, out: Optional[str]):
+    descriptions = describe_records(index, numbers, workers)
+    if out and not os.path.exists(out):
+        os.makedirs(out)
+    for number, description in zip(numbers, descriptions):
+        if out:
+            with open(os.path.join(out, "record_{}_deserialized.txt".format(number)), "w") as file:
+                print(description, file=file)
+        else:
+            print(description)
+            print()
 
 
 if __name__ == "__main__":
-    print("Analyzing dump file: {}".format(DUMP_FILE_PATH))
-
-    # open file
-    file = open(DUMP_FILE_PATH, "r")
-
-    # read file
-    lines = list(enumerate([line.strip() for line in file.readlines()]))
-    print("Read {} lines".format(len(lines)))
-
-    # sort lines by length
-    lines.sort(key=lambda x: len(x[1]), reverse=True)
-
-    # print longest line lengths
-    print("Longest lines:")
-    for i in range(10):
-        line_number, line = lines[i]
-        print("Line {} has length {}".format(line_number, len(line)))
-        decoded = decode(line)
-        deserialized = decoded.deserialize()
-        print(deserialized, file=open(
-            f"line_{line_number}_deserialized.txt", "w"))
-
-    input("Press any key to see next line...")
-    for line in lines:
-        process_line(line)
-        input("Press any key to see next line...")
+    # accepted after the command
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--workers", type=int, default=os.cpu_count(), help="processes decoding records and building the index")
+    common.add_argument("--out", help="write the decoded records to this directory instead of printing them")
+    parser = argparse.ArgumentParser(description="Inspect a mempool dump without loading it")
+    parser.add_argument("dump", nargs="?", default=DUMP_FILE_PATH, help="binary or text dump")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("index", parents=[common], help="build or extend the lookup index")
+    top = commands.add_parser("top", parents=[common], help="largest transactions")
+    top.add_argument("--by", choices=TOP_KEYS, default="size")
+    top.add_argument("-k", type=int, default=10)
+    top.add_argument("--decode", action="store_true", help="also decode the records found")
+    top.add_argument("--prevout-budget", type=int, default=256 * 1024 * 1024, help="bytes of outputs kept to compute fees")
+    show = commands.add_parser("show", parents=[common], help="decode records by number")
+    show.add_argument("numbers", type=int, nargs="+")
+    txid = commands.add_parser("txid", parents=[common], help="decode every record of a transaction or block hash")
+    txid.add_argument("hashes", nargs="+")
+    args = parser.parse_args()
+
+    print("Analyzing dump file: {}".format(args.dump))
+    index = DumpLookupIndex.open(args.dump, args.workers)
+    if args.command == "index":
+        print("{} hashes indexed over {} bytes".format(len(index), index.dump_size))
+    elif args.command == "top":
+        found = top_records(args.dump, args.by, args.k, args.prevout_budget)
+        for number, key in found:
+            print("Record {} has {} {:g}".format(number, args.by, key))
+        if args.decode or args.out:
+            output(index, [number for number, _ in found], args.workers, args.out)
+    elif args.command == "show":
+        output(index, args.numbers, args.workers, args.out)
+    else:
+        for hash_hex in args.hashes:
+            numbers = records_for_hash(index, hash_hex)
+            print("{}: {} records {}".format(hash_hex, len(numbers), numbers))
+            output(index, numbers, args.workers, args.out)
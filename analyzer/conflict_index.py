@@ -0,0 +1,100 @@
+from typing import Dict, Iterable, List, Set
+
+
+class ConflictIndex():
+    """Maps every spent outpoint (36-byte key, see prevout_cache.outpoint_key)
+    to the conflict group spending it.
+
+    Transactions that share any outpoint conflict, so a replacement that adds
+    or drops an input still lands in the group of the transaction it
+    replaces. When a transaction touches several groups they are merged with
+    union-find; lookups and updates cost O(inputs) dictionary operations.
+
+    Outpoints of transactions that may open a group but are not priced yet
+    can be watched, so the RBF pre-filter keeps their replacements.
+    """
+
+    def __init__(self):
+        self.outpoint_groups: Dict[bytes, int] = {}
+        self.parent: Dict[int, int] = {}
+        self.group_outpoints: Dict[int, Set[bytes]] = {}
+        # ids absorbed by each root, dropped together when the root is pruned
+        self.absorbed: Dict[int, List[int]] = {}
+        self.watched: Set[bytes] = set()
+        self.next_group = 0
+
+    def __contains__(self, key: bytes) -> bool:
+        return key in self.outpoint_groups or key in self.watched
+
+    def __len__(self):
+        return len(self.outpoint_groups) + len(self.watched)
+
+    def find(self, group: int) -> int:
+        parent = self.parent
+        while parent[group] != group:
+            # path halving
+            parent[group] = parent[parent[group]]
+            group = parent[group]
+        return group
+
+    # Distinct groups touched by the outpoints, in first-touched order
+    def groups_of(self, keys: Iterable[bytes]) -> List[int]:
+        roots: List[int] = []
+        for key in keys:
+            group = self.outpoint_groups.get(key)
+            if group is not None:
+                root = self.find(group)
+                if root not in roots:
+                    roots.append(root)
+        return roots
+
+    def add(self, keys: Iterable[bytes]) -> int:
+        group = self.next_group
+        self.next_group += 1
+        self.parent[group] = group
+        self.group_outpoints[group] = set()
+        self.absorbed[group] = []
+        self.extend(group, keys)
+        return group
+
+    def extend(self, group: int, keys: Iterable[bytes]):
+        root = self.find(group)
+        outpoints = self.group_outpoints[root]
+        for key in keys:
+            if key not in self.outpoint_groups:
+                self.outpoint_groups[key] = root
+                outpoints.add(key)
+
+    # Merges into the group holding the most outpoints and returns its root.
+    # Outpoint entries keep pointing at the absorbed ids, find() resolves them.
+    def union(self, groups: List[int]) -> int:
+        roots = [self.find(group) for group in groups]
+        root = max(roots, key=lambda r: len(self.group_outpoints[r]))
+        for other in roots:
+            if other != root:
+                self.parent[other] = root
+                self.group_outpoints[root] |= self.group_outpoints.pop(other)
+                self.absorbed[root].append(other)
+                self.absorbed[root].extend(self.absorbed.pop(other))
+        return root
+
+    def prune(self, group: int):
+        root = self.find(group)
+        for key in self.group_outpoints.pop(root, ()):
+            self.outpoint_groups.pop(key, None)
+        for member in self.absorbed.pop(root, ()):
+            del self.parent[member]
+        del self.parent[root]
+
+    def watch(self, keys: Iterable[bytes]):
+        self.watched.update(keys)
+
+    def clear_watched(self):
+        self.watched.clear()
+
+    def clear(self):
+        self.outpoint_groups.clear()
+        self.parent.clear()
+        self.group_outpoints.clear()
+        self.absorbed.clear()
+        self.watched.clear()
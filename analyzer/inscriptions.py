@@ -0,0 +1,152 @@
+import json
+from typing import List, NamedTuple, Optional, Tuple, Union
+
+from bitcoin.core import CTransaction
+
+from encoding.tx_scanner import ScannedTransaction
+
+"""
+    Ordinal inscriptions in the rawtx stream, classified from the raw bytes.
+
+    An inscription is an envelope in a taproot script-path witness:
+
+        OP_FALSE OP_IF "ord" <tag> <value> ... OP_0 <body push> ... OP_ENDIF
+
+    where tag 1 carries the content type and the pushes after OP_0 the body.
+    The witness section of the transaction is searched for the 6-byte
+    envelope start with bytes.find (a memchr-backed search in C), so the
+    common transaction without one costs a single pass over its witness
+    bytes and nothing is decoded. Only the envelopes found are parsed, and a
+    body is only read as BRC-20 JSON when the content type is text or JSON
+    and it is small enough to be one.
+"""
+
+ENVELOPE = b"\x00\x63\x03ord"
+OP_0 = 0x00
+OP_PUSHDATA1 = 0x4c
+OP_PUSHDATA2 = 0x4d
+OP_PUSHDATA4 = 0x4e
+OP_1NEGATE = 0x4f
+OP_1 = 0x51
+OP_16 = 0x60
+OP_ENDIF = 0x68
+CONTENT_TYPE_TAG = b"\x01"
+# BRC-20 operations are a few dozen bytes of JSON, larger bodies are not read
+MAX_BRC20_BODY = 1024
+MAX_FIELD = 255
+
+
+class Inscription(NamedTuple):
+    content_type: str
+    body_length: int
+    # BRC-20 operation (deploy, mint, transfer) and lowercase ticker, empty otherwise
+    op: str = ""
+    tick: str = ""
+
+    @property
+    def is_brc20(self) -> bool:
+        return bool(self.op)
+
+
+# (pushed bytes, position after the push), None for an opcode that pushes nothing
+def read_push(data: bytes, position: int) -> Tuple[Optional[bytes], int]:
+    opcode = data[position]
+    position += 1
+    if opcode == OP_0:
+        return b"", position
+    if opcode < OP_PUSHDATA1:
+        length = opcode
+    elif opcode == OP_PUSHDATA1:
+        length, position = data[position], position + 1
+    elif opcode == OP_PUSHDATA2:
+        length, position = int.from_bytes(data[position:position + 2], "little"), position + 2
+    elif opcode == OP_PUSHDATA4:
+        length, position = int.from_bytes(data[position:position + 4], "little"), position + 4
+    elif opcode == OP_1NEGATE:
+        return b"\x81", position
+    elif OP_1 <= opcode <= OP_16:
+        return bytes([opcode - OP_1 + 1]), position
+    else:
+        return None, position
+    if position + length > len(data):
+        raise IndexError("push past the end of the witness")
+    return data[position:position + length], position + length
+
+
+# The inscription of the envelope whose marker starts at `position`, None when
+# the bytes there are not a well-formed envelope
+def parse_envelope(data: bytes, position: int) -> Optional[Inscription]:
+    position += len(ENVELOPE)
+    content_type = b""
+    body: List[bytes] = []
+    body_length = 0
+    try:
+        while data[position] != OP_ENDIF:
+            tag, position = read_push(data, position)
+            if tag is None:
+                return None
+            if tag == b"":
+                # every push up to OP_ENDIF is body
+                while data[position] != OP_ENDIF:
+                    chunk, position = read_push(data, position)
+                    if chunk is None:
+                        return None
+                    body_length += len(chunk)
+                    if body_length <= MAX_BRC20_BODY:
+                        body.append(chunk)
+                break
+            value, position = read_push(data, position)
+            if value is None:
+                return None
+            if tag == CONTENT_TYPE_TAG:
+                content_type = value
+    except IndexError:
+        return None
+    op, tick = "", ""
+    media_type = content_type.split(b";")[0].strip().lower()
+    if body_length <= MAX_BRC20_BODY and media_type in (b"text/plain", b"application/json"):
+        op, tick = brc20_operation(b"".join(body))
+    return Inscription(content_type.decode("utf8", "replace")[:MAX_FIELD], body_length, op, tick)
+
+
+# (op, tick) of a BRC-20 body, empty strings for anything else
+def brc20_operation(body: bytes) -> Tuple[str, str]:
+    if not body.lstrip().startswith(b"{"):
+        return "", ""
+    try:
+        content = json.loads(body)
+    except ValueError:
+        return "", ""
+    if not isinstance(content, dict) or str(content.get("p", "")).lower() != "brc-20":
+        return "", ""
+    op, tick = content.get("op"), content.get("tick")
+    if not isinstance(op, str) or not isinstance(tick, str) or not op:
+        return "", ""
+    return op.lower()[:MAX_FIELD], tick.lower()[:MAX_FIELD]
+
+
+# First inscription in `data`, trying every occurrence of the envelope marker
+def find_inscription(data: bytes, start: int = 0) -> Optional[Inscription]:
+    position = data.find(ENVELOPE, start)
+    while position != -1:
+        inscription = parse_envelope(data, position)
+        if inscription is not None:
+            return inscription
+        position = data.find(ENVELOPE, position + 1)
+    return None
+
+
+def classify(tx: Union[CTransaction, ScannedTransaction]) -> Optional[Inscription]:
+    if isinstance(tx, ScannedTransaction):
+        if not tx.has_witness:
+            return None
+        # the witness section only, without the locktime
+        return find_inscription(bytes(tx.raw[tx.witness_start:len(tx.raw) - 4]))
+    if tx.wit.is_null():
+        return None
+    for txin_witness in tx.wit.vtxinwit:
+        for item in txin_witness.scriptWitness.stack:
+            inscription = find_inscription(item)
+            if inscription is not None:
+                return inscription
+    return None
@@ -0,0 +1,129 @@
+import time
+from typing import Dict, List, Set
+
+from analyzer.mempool_state import MempoolState
+from analyzer.prevout_resolver import PrevoutResolver
+from encoding.tx_scanner import ScannedTransaction
+
+"""
+    Backfill of the rawtx messages lost by the ZMQ stream.
+
+    ZMQ numbers the messages of each topic. When the receive task sees a
+    number skipped (see ZMQHandler, DumpRecord.lost), the transactions whose
+    rawtx was lost are looked for in the node's mempool. The mempool index
+    (analyzer/mempool_state.py) knows every txid handled, so one resync of
+    it, a single getrawmempool, leaves the txids never seen in its `missing`
+    set, along with the additions of the sequence topic whose rawtx did not
+    come; they are fetched with one batched getrawtransaction (chunked by the
+    resolver). Gaps within min_interval of the last backfill wait for the
+    first frame after it, so a burst of losses costs one mempool read a
+    second.
+
+    The mempool also holds the transactions received after the gap and still
+    queued: the ones recovered are remembered, and their frames are skipped
+    when they arrive (take_recovered). They are forgotten recovered_blocks
+    blocks later, counted as the analysis handles them, so a replay of the
+    stream forgets them at the same point. A lost transaction already replaced or
+    confirmed is no longer in the mempool and cannot be recovered; it is
+    counted as lost only.
+"""
+
+
+# Parents before their children, so recovered spends find the outputs of
+# recovered parents
+def parents_first(transactions: List[ScannedTransaction]) -> List[ScannedTransaction]:
+    by_txid = {tx.GetTxid(): tx for tx in transactions}
+    ordered: List[ScannedTransaction] = []
+    placed: Set[bytes] = set()
+
+    def place(tx: ScannedTransaction):
+        txid = tx.GetTxid()
+        if txid in placed:
+            return
+        placed.add(txid)
+        for input in tx.vin:
+            parent = by_txid.get(input.prevout.hash)
+            if parent is not None:
+                place(parent)
+        ordered.append(tx)
+
+    for tx in transactions:
+        place(tx)
+    return ordered
+
+
+class MempoolBackfill():
+    # max_transactions caps a backfill, the rest of the diff is left out and
+    # counted as skipped
+    def __init__(self, mempool: MempoolState, resolver: PrevoutResolver, max_transactions: int = 20_000, min_interval: float = 1.0,
+                 recovered_blocks: int = 6):
+        self.mempool = mempool
+        self.resolver = resolver
+        self.max_transactions = max_transactions
+        self.min_interval = min_interval
+        self.last_backfill = float("-inf")
+        # rawtx lost since the last backfill
+        self.pending = 0
+        self.recovered_blocks = recovered_blocks
+        # recovered txids whose frames may still arrive -> blocks handled then
+        self.recovered_txids: Dict[bytes, int] = {}
+        self.blocks = 0
+        self.backfills = 0
+        self.recovered = 0
+        self.skipped = 0
+
+    @property
+    def synced(self) -> bool:
+        return self.mempool.missing is not None
+
+    # The mempool index syncs with the node and starts collecting what is missed
+    def sync(self):
+        self.mempool.missing = set()
+        self.mempool.resync()
+
+    # True, once, when the transaction was recovered before its frame arrived
+    def take_recovered(self, txid: bytes) -> bool:
+        return self.recovered_txids.pop(txid, None) is not None
+
+    def add_recovered(self, txid: bytes):
+        self.recovered_txids[txid] = self.blocks
+
+    def block_connected(self):
+        self.blocks += 1
+        if self.recovered_txids:
+            expired = self.blocks - self.recovered_blocks
+            self.recovered_txids = {txid: blocks for txid, blocks in self.recovered_txids.items() if blocks > expired}
+
+    def due(self) -> bool:
+        return self.pending > 0 and time.monotonic() >= self.last_backfill + self.min_interval
+
+    # The mempool transactions never seen, parents first
+    def backfill(self) -> List[ScannedTransaction]:
+        self.pending = 0
+        self.last_backfill = time.monotonic()
+        if not self.synced:
+            # nothing to diff against, the lost transactions are in the mempool
+            # along with everything received so far
+            self.sync()
+            return []
+        self.mempool.resync()
+        missing = list(self.mempool.missing)
+        self.mempool.missing.clear()
+        self.backfills += 1
+        if len(missing) > self.max_transactions:
+            self.skipped += len(missing) - self.max_transactions
+            missing = missing[:self.max_transactions]
+        fetched = self.resolver.fetch(txid[::-1] for txid in missing)
+        # evicted between the two calls when None
+        recovered = parents_first([tx for tx in fetched.values() if tx is not None])
+        for tx in recovered:
+            self.add_recovered(tx.GetTxid())
+        self.recovered += len(recovered)
+        return recovered
+
+    def stats(self) -> dict:
+        return {
+            "backfills": self.backfills,
+            "recovered": self.recovered,
+            "skipped": self.skipped,
+        }
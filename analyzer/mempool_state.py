@@ -0,0 +1,114 @@
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from bitcoin.rpc import Proxy
+
+
+class MempoolState():
+    """Txid index of the node's mempool, maintained from the ZMQ `sequence`
+    topic instead of re-reading the mempool.
+
+    Txids are 32 bytes in display order, as the sequence topic sends them.
+    Additions (A) and removals (R) carry the node's mempool sequence, which
+    also advances once for every mempool transaction a connected block
+    confirms, without a message of its own. An event with another sequence
+    than the expected one means messages were lost: the index is resynced
+    with a single getrawmempool call and only the difference is applied.
+    The first event syncs the index the same way.
+
+    Once synced, the txids of the rawtx handled are indexed too (seen), so
+    the index also tells which mempool transactions never reached the
+    analysis. With `missing` set, as MempoolBackfill does, those are
+    collected there: an addition whose rawtx was not seen before it, and
+    what a resync adds after the first one.
+    """
+
+    def __init__(self, client: Proxy):
+        self.client = client
+        # txid -> mempool sequence it was added at, 0 when learnt from a resync or its rawtx
+        self.txids: Dict[bytes, int] = {}
+        # mempool txids whose rawtx was not seen, when collected
+        self.missing: Optional[Set[bytes]] = None
+        self.next_sequence: Optional[int] = None
+        self.gaps = 0
+        self.resyncs = 0
+
+    @property
+    def synced(self) -> bool:
+        return self.next_sequence is not None
+
+    def __contains__(self, txid: bytes) -> bool:
+        return txid in self.txids
+
+    def __len__(self):
+        return len(self.txids)
+
+    # A rawtx handled, before its addition when both topics are followed
+    def seen(self, txid: bytes):
+        self.txids.setdefault(txid, 0)
+        if self.missing:
+            self.missing.discard(txid)
+
+    def added(self, txid: bytes, mempool_sequence: int):
+        if self.follows(mempool_sequence):
+            if self.missing is not None and txid not in self.txids:
+                self.missing.add(txid)
+            self.txids[txid] = mempool_sequence
+
+    def removed(self, txid: bytes, mempool_sequence: int):
+        if self.follows(mempool_sequence):
+            self.txids.pop(txid, None)
+            if self.missing:
+                self.missing.discard(txid)
+
+    def block_connected(self, txids: Iterable[bytes]):
+        if not self.synced:
+            return
+        for txid in txids:
+            if self.txids.pop(txid, None) is not None:
+                self.next_sequence += 1
+                if self.missing:
+                    self.missing.discard(txid)
+
+    # True when the event is the next one to apply. After a resync the
+    # snapshot already reflects the event that revealed the gap.
+    def follows(self, mempool_sequence: int) -> bool:
+        if mempool_sequence == self.next_sequence:
+            self.next_sequence += 1
+            return True
+        if self.next_sequence is not None and mempool_sequence < self.next_sequence:
+            # older than the snapshot, already reflected
+            return False
+        if self.synced:
+            self.gaps += 1
+        self.resync()
+        return False
+
+    # Applies the difference with the node's mempool, returns (added, removed)
+    def resync(self) -> Tuple[int, int]:
+        snapshot = self.client.call("getrawmempool", False, True)
+        remote = {bytes.fromhex(txid) for txid in snapshot["txids"]}
+        removed = [txid for txid in self.txids if txid not in remote]
+        for txid in removed:
+            del self.txids[txid]
+        # the first sync learns the mempool, later ones what was lost since
+        missing = self.missing if self.synced else None
+        if self.missing:
+            self.missing.intersection_update(remote)
+        added = 0
+        for txid in remote:
+            if txid not in self.txids:
+                self.txids[txid] = 0
+                added += 1
+                if missing is not None:
+                    missing.add(txid)
+        self.next_sequence = snapshot["mempool_sequence"]
+        self.resyncs += 1
+        return added, len(removed)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self.txids),
+            "next_sequence": self.next_sequence,
+            "gaps": self.gaps,
+            "resyncs": self.resyncs,
+        }
@@ -0,0 +1,200 @@
+import os
+import sqlite3
+import struct
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Set, Tuple
+
+# Rough CPython cost of one entry: 36-byte bytes key, int value and the
+# OrderedDict node linking them
+ENTRY_SIZE = 200
+OUTPOINT_SIZE = 36
+
+
+def outpoint_key(prevout_hash: bytes, prevout_n: int) -> bytes:
+    # 32-byte txid in internal byte order followed by the little-endian vout index
+    return prevout_hash + struct.pack('<I', prevout_n)
+
+
+class PrevoutCache():
+    """Long-lived outpoint -> value (satoshis) cache.
+
+    Entries live across blocks and are evicted once a connected block spends
+    their outpoint, or when their transaction leaves the mempool unconfirmed
+    (evict_outputs). When the in-memory part exceeds `memory_budget` bytes,
+    the least recently used entries are spilled to the key-value file at
+    `spill_path` (or dropped when no file is configured). The file is also
+    checkpointed on every block and on close, so a restart starts warm.
+    Outputs that stay unspent would still pile up in the file, so it is cut
+    back to 90% of `max_spill_entries` rows on checkpoint, from a random
+    outpoint on: a dropped entry only costs an RPC if it is ever needed.
+    """
+
+    def __init__(self, memory_budget: int = 64 * 1024 * 1024, spill_path: Optional[str] = None, max_spill_entries: int = 4_000_000):
+        self.max_entries = max(1, memory_budget // ENTRY_SIZE)
+        self.max_spill_entries = max_spill_entries
+        self.entries: OrderedDict[bytes, int] = OrderedDict()
+        self.dirty: Set[bytes] = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.spills = 0
+        self.disk_hits = 0
+        self.trimmed = 0
+        self.db: Optional[sqlite3.Connection] = None
+        if spill_path is not None:
+            self.db = sqlite3.connect(spill_path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS prevouts (outpoint BLOB PRIMARY KEY, value INTEGER NOT NULL) WITHOUT ROWID")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key: bytes) -> bool:
+        return self._lookup(key) is not None
+
+    # Lookup that does not touch the hit/miss counters
+    def peek(self, key: bytes) -> Optional[int]:
+        return self._lookup(key)
+
+    def get(self, key: bytes) -> Optional[int]:
+        value = self._lookup(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key: bytes, value: int):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+        self.entries[key] = value
+        self.dirty.add(key)
+        if len(self.entries) > self.max_entries:
+            self._spill()
+
+    def put_outputs(self, tx_hash: bytes, values: Iterable[int]):
+        for n, value in enumerate(values):
+            self.put(outpoint_key(tx_hash, n), value)
+
+    # Entries of a snapshot (see analyzer/snapshot.py), least recently used first
+    def restore(self, keys: List[bytes], values: Iterable[int]):
+        self.entries = OrderedDict(zip(keys, values))
+        # the file may not have them all, the snapshot can be newer than the last checkpoint
+        if self.db is not None:
+            self.dirty.update(self.entries)
+        if len(self.entries) > self.max_entries:
+            self._spill()
+
+    # Called with the outpoints spent by a connected block
+    def evict_spent(self, keys: Iterable[bytes]):
+        spent = []
+        for key in keys:
+            if self.entries.pop(key, None) is not None:
+                self.evictions += 1
+            self.dirty.discard(key)
+            spent.append((key,))
+        if self.db is not None and spent:
+            self.db.executemany("DELETE FROM prevouts WHERE outpoint = ?", spent)
+            self.db.commit()
+
+    # Called with the txid (internal byte order) of a transaction removed from
+    # the mempool without confirming, replaced, evicted or expired: nothing
+    # spends its outputs any more. Committed with the next checkpoint
+    def evict_outputs(self, tx_hash: bytes):
+        last_spilled = -1
+        if self.db is not None:
+            bounds = (outpoint_key(tx_hash, 0), outpoint_key(tx_hash, 0xffffffff))
+            spilled = self.db.execute("SELECT outpoint FROM prevouts WHERE outpoint BETWEEN ? AND ?", bounds).fetchall()
+            if spilled:
+                last_spilled = max(struct.unpack_from('<I', key, 32)[0] for key, in spilled)
+                self.db.execute("DELETE FROM prevouts WHERE outpoint BETWEEN ? AND ?", bounds)
+                self.evictions += len(spilled)
+        # outputs spilled ahead of later ones leave gaps in memory
+        n = 0
+        while True:
+            key = outpoint_key(tx_hash, n)
+            if self.entries.pop(key, None) is not None:
+                self.evictions += 1
+                self.dirty.discard(key)
+            elif n > last_spilled:
+                break
+            n += 1
+
+    def checkpoint(self):
+        if self.db is None:
+            return
+        if self.dirty:
+            rows = [(key, self.entries[key]) for key in self.dirty if key in self.entries]
+            self.db.executemany("INSERT OR REPLACE INTO prevouts (outpoint, value) VALUES (?, ?)", rows)
+            self.dirty = set()
+        self._trim()
+        self.db.commit()
+
+    def close(self):
+        if self.db is not None:
+            self.checkpoint()
+            self.db.close()
+            self.db = None
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'spills': self.spills,
+            'disk_hits': self.disk_hits,
+            'trimmed': self.trimmed,
+        }
+
+    def _lookup(self, key: bytes) -> Optional[int]:
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+            return value
+        if self.db is None:
+            return None
+        row = self.db.execute("SELECT value FROM prevouts WHERE outpoint = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self.disk_hits += 1
+        # already persisted, so the promoted entry is not dirty
+        self.entries[key] = row[0]
+        if len(self.entries) > self.max_entries:
+            self._spill()
+        return row[0]
+
+    # Spills down to 90% of the budget so the file is written in chunks rather
+    # than once per insertion
+    def _spill(self):
+        low_water = self.max_entries - self.max_entries // 10
+        spilled: List[Tuple[bytes, int]] = []
+        while len(self.entries) > low_water:
+            key, value = self.entries.popitem(last=False)
+            self.spills += 1
+            if key in self.dirty:
+                self.dirty.discard(key)
+                spilled.append((key, value))
+        if self.db is not None and spilled:
+            self.db.executemany("INSERT OR REPLACE INTO prevouts (outpoint, value) VALUES (?, ?)", spilled)
+            self.db.commit()
+
+    # txids are uniformly distributed, the run of outpoints after a random one
+    # is a random sample of the file
+    def _trim(self):
+        rows = self.db.execute("SELECT COUNT(*) FROM prevouts").fetchone()[0]
+        if rows <= self.max_spill_entries:
+            return
+        excess = rows - (self.max_spill_entries - self.max_spill_entries // 10)
+        start = os.urandom(OUTPOINT_SIZE)
+        for bound, order in ((">=", "ASC"), ("<", "DESC")):
+            cursor = self.db.execute(
+                "DELETE FROM prevouts WHERE outpoint IN (SELECT outpoint FROM prevouts WHERE outpoint {} ? ORDER BY outpoint {} LIMIT ?)".format(bound, order),
+                (start, excess))
+            self.trimmed += cursor.rowcount
+            excess -= cursor.rowcount
+            if excess <= 0:
+                break
@@ -0,0 +1,75 @@
+from typing import Dict, Iterable, List, Optional
+
+from bitcoin.core import b2lx
+from bitcoin.rpc import JSONRPCError, Proxy
+
+from encoding.tx_scanner import ScannedTransaction, scan_transaction
+
+RPC_INVALID_ADDRESS_OR_KEY = -5
+
+
+class PrevoutResolver():
+    """Resolves parent transactions with JSON-RPC batch requests.
+
+    Instead of one blocking `getrawtransaction` round-trip per input, every
+    missing parent of a transaction (or of a window of transactions) is
+    requested in a single HTTP POST, chunked by `max_batch_size`.
+
+    Parents are requested in the compact non-verbose form, the hex of the
+    transaction, and scanned locally: the node neither decodes them to JSON
+    nor sends the decoded inputs, scripts and addresses we never read.
+
+    A lookup failing with another error than an unknown transaction is asked
+    again once, in a batch of the failed ones, and then given up as unknown:
+    only the transactions spending it are dropped, not the whole window.
+    """
+
+    def __init__(self, client: Proxy, max_batch_size: int = 500):
+        self.client = client
+        self.max_batch_size = max(1, max_batch_size)
+        self.rpc_calls = 0
+        self.rpc_round_trips = 0
+        # lookups still failing after their retry
+        self.failures = 0
+
+    # Returns the scanned transaction for every requested hash, or None when
+    # the node does not know the transaction.
+    def fetch(self, tx_hashes: Iterable[bytes]) -> Dict[bytes, Optional[ScannedTransaction]]:
+        unique_hashes: List[bytes] = list(dict.fromkeys(tx_hashes))
+        results: Dict[bytes, Optional[ScannedTransaction]] = {}
+        for start in range(0, len(unique_hashes), self.max_batch_size):
+            chunk = unique_hashes[start:start + self.max_batch_size]
+            results.update(self._fetch_chunk(chunk))
+        return results
+
+    def _fetch_chunk(self, tx_hashes: List[bytes], retry: bool = True) -> Dict[bytes, Optional[ScannedTransaction]]:
+        calls = [
+            {'version': '1.1', 'method': 'getrawtransaction', 'params': [b2lx(tx_hash), 0], 'id': i}
+            for i, tx_hash in enumerate(tx_hashes)
+        ]
+        self.rpc_round_trips += 1
+        self.rpc_calls += len(calls)
+        responses = self.client._batch(calls)
+        if not isinstance(responses, list):
+            # bitcoind answers a rejected batch with a single error object
+            raise JSONRPCError(responses.get('error') or {'code': -344, 'message': str(responses)})
+
+        results: Dict[bytes, Optional[ScannedTransaction]] = {}
+        failed: List[bytes] = []
+        for response in responses:
+            tx_hash = tx_hashes[response['id']]
+            err = response.get('error')
+            if err is not None:
+                if err.get('code') == RPC_INVALID_ADDRESS_OR_KEY:
+                    results[tx_hash] = None
+                elif retry:
+                    failed.append(tx_hash)
+                else:
+                    print(f"could not fetch {b2lx(tx_hash)}: {err.get('message', 'error message not specified')} ({err.get('code', -345)})")
+                    self.failures += 1
+                    results[tx_hash] = None
+                continue
+            results[tx_hash] = scan_transaction(bytes.fromhex(response['result']))
+        if failed:
+            results.update(self._fetch_chunk(failed, retry=False))
+        return results
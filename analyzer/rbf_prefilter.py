@@ -0,0 +1,35 @@
+from typing import Set
+
+from encoding.tx_scanner import has_non_final_or_tracked_input
+
+
+class RbfPrefilter():
+    """Drops rawtx bodies the rebid analysis would ignore, before decoding.
+
+    process_transaction only acts on a transaction that either has a
+    non-final input (it may open a group) or spends the outpoints of a tracked
+    group. Everything else, the common non-RBF transaction, is rejected here
+    from the raw ZMQ bytes, before hex encoding, scanning, hashing or RPC.
+    `tracked_outpoints` is owned by the analyzer and holds the 36-byte
+    outpoint keys of every potential group.
+    """
+
+    def __init__(self, tracked_outpoints: Set[bytes]):
+        self.tracked_outpoints = tracked_outpoints
+        self.seen = 0
+        self.dropped = 0
+
+    def accepts(self, raw_tx) -> bool:
+        self.seen += 1
+        if has_non_final_or_tracked_input(raw_tx, self.tracked_outpoints):
+            return True
+        self.dropped += 1
+        return False
+
+    @property
+    def hit_rate(self) -> float:
+        return self.dropped / self.seen if self.seen else 0.0
+
+    def reset_counters(self):
+        self.seen = 0
+        self.dropped = 0
@@ -0,0 +1,337 @@
+import atexit
+import multiprocessing
+import os
+import queue
+import time
+import traceback
+import zlib
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from bitcoin.rpc import Proxy
+
+from analyzer.prevout_cache import PrevoutCache, outpoint_key
+from analyzer.rbf_prefilter import RbfPrefilter
+from analyzer.rpc_fixtures import ReplayProxy, RpcFixtureStore
+from encoding.tx_scanner import ScannedTransaction, scan_transaction
+from networking.metrics import METRICS
+from networking.rpc_client import PooledProxy
+from rebid_analysis import BLOCK_FLUSH, AnyTransaction, MempoolAnalyzer, TransactionData
+
+"""
+    Sharded rebid analysis.
+
+    ShardedMempoolAnalyzer is a drop-in MempoolAnalyzer that only dispatches:
+    every transaction goes to one of N ShardAnalyzer processes, each owning
+    its own groups, conflict index and prevout cache, so scanning, hashing,
+    RPC and pricing run on N cores.
+
+    A transaction is routed to the shard owning any of its outpoints, else by
+    a hash of its first outpoint. When it spends outpoints owned by several
+    shards, the groups behind them are first moved to one shard, so every
+    conflict group is only ever seen by a single shard, in arrival order.
+
+    On hashblock the dispatcher fetches the block once, every shard flushes
+    and returns the rows of the groups it finalized, and the rows are written
+    in the order the single-process analyzer writes them: groups are ordered
+    by the position of the transaction that last (re)inserted them. Block
+    disconnections are broadcast, each shard restores the groups it retired.
+    Shards send the metrics recorded since the previous block with their
+    rows, the dispatcher merges them into its own.
+"""
+
+# transactions sent to a shard at once
+CHUNK_SIZE = 256
+
+
+def node_client(file_path: str) -> Proxy:
+    return PooledProxy(btc_conf_file=os.path.join(file_path, "networking/.env"))
+
+
+def replay_client(fixtures_path: str) -> ReplayProxy:
+    return ReplayProxy(RpcFixtureStore(fixtures_path))
+
+
+class ShardAnalyzer(MempoolAnalyzer):
+    def __init__(self, file_path, client: Proxy, current_block: int, **kwargs):
+        super().__init__(file_path, client=client, **kwargs)
+        self.current_block = current_block
+        self.positions: Deque[int] = deque()
+        self.position = 0
+        # group -> (position of the transaction that last inserted it in
+        # self.transactions, 0), or (position at the rollback, 1 + previous
+        # position) for a group restored by a block disconnection
+        self.inserted_at: Dict[int, Tuple[int, int]] = {}
+        # inserted_at of the groups in retired_groups
+        self.retired_at: Deque[List[Tuple[int, int]]] = deque(maxlen=self.retired_groups.maxlen)
+
+    # seeds are the (outpoint, value) the dispatcher already knew for its inputs
+    def add_transaction(self, position: int, raw_tx: bytes, timestamp: float, seeds: List[Tuple[bytes, int]]):
+        if self.rbf_filter.accepts(raw_tx):
+            for key, value in seeds:
+                self.prevout_cache.put(key, value)
+            self.positions.append(position)
+            self.queue_transaction(scan_transaction(raw_tx), timestamp)
+
+    def process_transaction(self, transaction: AnyTransaction, timestamp: int):
+        self.position = self.positions.popleft()
+        created = self.conflict_index.next_group
+        super().process_transaction(transaction, timestamp)
+        if self.conflict_index.next_group != created:
+            self.inserted_at[created] = (self.position, 0)
+
+    def merge_groups(self, groups: List[int]) -> int:
+        root = super().merge_groups(groups)
+        for group in groups:
+            self.inserted_at.pop(group, None)
+        self.inserted_at[root] = (self.position, 0)
+        return root
+
+    # Hands over the groups spending any of `keys`, and the watched keys
+    def export_groups(self, keys: List[bytes]) -> Tuple[List[Tuple[Tuple[int, int], TransactionData, List[bytes]]], List[bytes]]:
+        self.flush_pending_transactions()
+        exported = []
+        for group in self.conflict_index.groups_of(keys):
+            outpoints = list(self.conflict_index.group_outpoints[group])
+            exported.append((self.inserted_at.pop(group), self.transactions.pop(group), outpoints))
+            self.conflict_index.prune(group)
+        watched = [key for key in keys if key in self.conflict_index.watched]
+        self.conflict_index.watched.difference_update(watched)
+        return exported, watched
+
+    def import_groups(self, exported: List[Tuple[Tuple[int, int], TransactionData, List[bytes]]], watched: List[bytes]):
+        for inserted_at, tx_data, outpoints in exported:
+            group = self.conflict_index.add(outpoints)
+            self.transactions[group] = tx_data
+            self.inserted_at[group] = inserted_at
+        self.conflict_index.watch(watched)
+
+    # Same steps as connect_block, with the block fetched by the dispatcher.
+    # Returns the rows to write keyed by group order, stats, and the outpoints
+    # still owned after the block
+    def close_block(self, current_block: int, spent: Optional[List[bytes]]) -> Tuple[List[Tuple[Tuple[int, int], List[list]]], dict, Set[bytes]]:
+        self.flush_pending_transactions()
+        self.current_block = current_block
+        finalized = self.finalize_block(spent)
+        if finalized is None:
+            finalized = set(self.transactions)
+        finalized_groups = [group for group in self.transactions if group in finalized]
+        retired_at = [self.inserted_at.pop(group) for group in finalized_groups]
+        rows = [(inserted_at, self.group_rows(self.transactions[group])) for inserted_at, group in zip(retired_at, finalized_groups)]
+        self.retired_at.append(retired_at)
+        stats = {
+            "missed": self.unkown_tx_counter,
+            "inputs_local": self.inputs_local,
+            "inputs_fetched": self.inputs_fetched,
+            "prevout_cache": self.prevout_cache.stats(),
+            "written": len(finalized),
+            "tracked": len(self.transactions) - len(finalized),
+            "ticker_bids": dict(self.ticker_bids),
+            "metrics": METRICS.drain(),
+        }
+        self.reset_cache(finalized)
+        return rows, stats, set(self.conflict_index.outpoint_groups)
+
+    # Same as disconnect_block for the shard, `position` is the dispatcher's
+    # position at the rollback. Returns the outpoints owned afterwards
+    def rollback_block(self, current_block: int, position: int) -> Set[bytes]:
+        self.flush_pending_transactions()
+        self.current_block = current_block
+        retired_at = self.retired_at.pop() if self.retired_at else []
+        for group, previous in zip(self.restore_retired_groups(), retired_at):
+            self.inserted_at[group] = (position, 1 + previous[0])
+        return set(self.conflict_index.outpoint_groups)
+
+
+def run_shard(index: int, commands: multiprocessing.Queue, results: multiprocessing.Queue, file_path: str,
+              client_factory: Callable[[], Proxy], current_block: int, cache_path: Optional[str], batch_window: int, max_idle_blocks: int):
+    try:
+        prevout_cache = PrevoutCache(spill_path="{}.{}".format(cache_path, index) if cache_path else None)
+        shard = ShardAnalyzer(file_path, client_factory(), current_block, prevout_cache=prevout_cache, batch_window=batch_window, max_idle_blocks=max_idle_blocks)
+        for command, *args in iter(commands.get, None):
+            if command == "txs":
+                for position, raw_tx, timestamp, seeds in args[0]:
+                    shard.add_transaction(position, raw_tx, timestamp, seeds)
+            elif command == "import":
+                shard.import_groups(*args)
+            elif command == "export":
+                results.put((index, shard.export_groups(*args)))
+            elif command == "block":
+                results.put((index, shard.close_block(*args)))
+            elif command == "disconnect":
+                results.put((index, shard.rollback_block(*args)))
+        shard.flush_pending_transactions()
+        prevout_cache.close()
+    except Exception:
+        results.put((index, RuntimeError("shard {} failed:\n{}".format(index, traceback.format_exc()))))
+
+
+class ShardedMempoolAnalyzer(MempoolAnalyzer):
+    # client_factory builds each shard's RPC client in its process, it must be
+    # picklable (see node_client and replay_client). Shard prevout caches
+    # spill to <cache_path>.<shard>, or stay in memory when cache_path is None.
+    def __init__(self, file_path, shards: int, client_factory: Callable[[], Proxy], client: Optional[Proxy] = None,
+                 cache_path: Optional[str] = None, batch_window: int = 1, max_idle_blocks: int = 3, backfill: bool = False, dump_handler=None):
+        # the dispatcher never prices transactions, its prevout cache only
+        # holds the outputs seeded from the stream, forwarded with the spends
+        super().__init__(file_path, client=client if client is not None else client_factory(), batch_window=batch_window,
+                         prevout_cache=PrevoutCache(), max_idle_blocks=max_idle_blocks, backfill=backfill,
+                         dump_handler=dump_handler)
+        # outpoint -> shard, a superset of the outpoints the shards track
+        self.owners: Dict[bytes, int] = {}
+        self.rbf_filter = RbfPrefilter(self.owners)
+        self.position = 0
+        self.buffers: List[list] = [[] for _ in range(shards)]
+        self.migrations = 0
+        # stats each shard returned with the last block
+        self.shard_stats: List[dict] = []
+        context = multiprocessing.get_context("spawn")
+        self.results = context.Queue()
+        self.commands = [context.Queue() for _ in range(shards)]
+        self.shards = [
+            context.Process(target=run_shard, args=(index, commands, self.results, file_path, client_factory, self.current_block, cache_path, batch_window, max_idle_blocks), daemon=True)
+            for index, commands in enumerate(self.commands)
+        ]
+        for shard in self.shards:
+            shard.start()
+        atexit.register(self.close)
+
+    # groups and prevout caches live in the shards, as of the last block
+    def register_gauges(self):
+        super().register_gauges()
+        METRICS.gauge("tracked_groups", lambda: sum(stats["tracked"] for stats in self.shard_stats))
+        METRICS.gauge("prevout_cache_hit_ratio", lambda: self.shard_hit_ratio())
+        METRICS.gauge("prevout_cache_entries", lambda: sum(stats["prevout_cache"]["entries"] for stats in self.shard_stats))
+
+    def shard_hit_ratio(self) -> float:
+        hits = sum(stats["prevout_cache"]["hits"] for stats in self.shard_stats)
+        lookups = hits + sum(stats["prevout_cache"]["misses"] for stats in self.shard_stats)
+        return hits / lookups if lookups else 0.0
+
+    def shard_of(self, key: bytes) -> int:
+        return zlib.crc32(key) % len(self.shards)
+
+    def queue_transaction(self, transaction: AnyTransaction, timestamp: float):
+        keys = [outpoint_key(input.prevout.hash, input.prevout.n) for input in transaction.vin]
+        owners: List[int] = []
+        for key in keys:
+            owner = self.owners.get(key)
+            if owner is not None and owner not in owners:
+                owners.append(owner)
+        if owners:
+            shard = owners[0]
+            for other in owners[1:]:
+                self.migrate(other, shard, keys)
+        elif self.can_update_gas_fee(transaction.vin):
+            shard = self.shard_of(keys[0])
+        else:
+            # can neither open nor join a group
+            return
+        for key in keys:
+            self.owners[key] = shard
+        self.position += 1
+        buffer = self.buffers[shard]
+        raw_tx = bytes(transaction.raw) if isinstance(transaction, ScannedTransaction) else transaction.serialize()
+        seeds = []
+        for key in keys:
+            value = self.prevout_cache.peek(key)
+            if value is not None:
+                seeds.append((key, value))
+        buffer.append((self.position, raw_tx, timestamp, seeds))
+        if len(buffer) >= CHUNK_SIZE:
+            self.send(shard)
+
+    def send(self, shard: int):
+        if self.buffers[shard]:
+            self.commands[shard].put(("txs", self.buffers[shard]))
+            self.buffers[shard] = []
+
+    def flush_pending_transactions(self):
+        for shard in range(len(self.shards)):
+            self.send(shard)
+
+    def receive(self):
+        while True:
+            try:
+                index, result = self.results.get(timeout=1)
+                break
+            except queue.Empty:
+                if not all(shard.is_alive() for shard in self.shards):
+                    raise RuntimeError("a shard process exited")
+        if isinstance(result, Exception):
+            raise result
+        return index, result
+
+    # Moves the groups of `source` spending any of `keys` to `target`
+    def migrate(self, source: int, target: int, keys: List[bytes]):
+        self.send(source)
+        self.commands[source].put(("export", keys))
+        _, (exported, watched) = self.receive()
+        for _, _, outpoints in exported:
+            for key in outpoints:
+                self.owners[key] = target
+        for key in watched:
+            self.owners[key] = target
+        self.send(target)
+        self.commands[target].put(("import", exported, watched))
+        self.migrations += 1
+
+    # The dispatcher connects the block (height, reorgs, mempool state), the
+    # shards finalize their groups
+    def finish_block(self, spent: Optional[List[bytes]]):
+        start = time.perf_counter_ns()
+        if spent is not None:
+            self.prevout_cache.evict_spent(spent)
+        for commands in self.commands:
+            commands.put(("block", self.current_block, spent))
+        replies = dict(self.receive() for _ in self.shards)
+
+        group_rows: List[Tuple[Tuple[int, int], List[list]]] = []
+        self.owners.clear()
+        for index in range(len(self.shards)):
+            rows, stats, owned = replies[index]
+            group_rows.extend(rows)
+            self.owners.update(dict.fromkeys(owned, index))
+        group_rows.sort(key=lambda entry: entry[0])
+        self.write_rows([row for _, rows in group_rows for row in rows])
+
+        stats = [replies[index][1] for index in range(len(self.shards))]
+        for shard_stats in stats:
+            METRICS.merge(shard_stats.pop("metrics"))
+        self.shard_stats = stats
+        print(f"flushing block into output{self.current_block}")
+        print(f"amount of missed tx due to lack of memory: {sum(shard_stats['missed'] for shard_stats in stats)}")
+        print(f"prevout cache hit ratio per shard: {[round(shard_stats['prevout_cache']['hit_ratio'], 3) for shard_stats in stats]}")
+        inputs_local = sum(shard_stats['inputs_local'] for shard_stats in stats)
+        inputs_resolved = inputs_local + sum(shard_stats['inputs_fetched'] for shard_stats in stats)
+        print(f"inputs served locally: {inputs_local}/{inputs_resolved} ({inputs_local / inputs_resolved if inputs_resolved else 0.0:.1%})")
+        print(f"rbf pre-filter dropped {self.rbf_filter.dropped}/{self.rbf_filter.seen} rawtx ({self.rbf_filter.hit_rate:.1%})")
+        print(f"groups written: {sum(shard_stats['written'] for shard_stats in stats)}, still tracked: {sum(shard_stats['tracked'] for shard_stats in stats)}, migrations: {self.migrations}")
+        print(f"mempool state: {self.mempool.stats()}")
+        print(f"zmq messages lost: {dict(self.lost_messages)}, rawtx recovered from the mempool: {self.recovered_messages}")
+        for shard_stats in stats:
+            self.ticker_bids.update(shard_stats["ticker_bids"])
+        print(f"hot tickers: {self.hot_tickers()}")
+        self.ticker_bids.clear()
+        self.rbf_filter.reset_counters()
+        self.migrations = 0
+        self.lost_messages.clear()
+        self.recovered_messages = 0
+        BLOCK_FLUSH.record(time.perf_counter_ns() - start)
+
+    def restore_retired_groups(self) -> List[int]:
+        for commands in self.commands:
+            commands.put(("disconnect", self.current_block, self.position))
+        replies = dict(self.receive() for _ in self.shards)
+        for index in range(len(self.shards)):
+            self.owners.update(dict.fromkeys(replies[index], index))
+        return []
+
+    def close(self):
+        if not any(shard.is_alive() for shard in self.shards):
+            return
+        self.flush_pending_transactions()
+        for commands in self.commands:
+            commands.put(None)
+        for shard in self.shards:
+            shard.join()
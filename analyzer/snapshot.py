@@ -0,0 +1,300 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from analyzer.inscriptions import Inscription
+
+"""
+    Warm-restart snapshots of the rebid analyzer.
+
+    A snapshot holds what a restarted analyzer would otherwise lose or have
+    to rebuild from RPC: the tracked groups with their outpoints, the groups
+    retired by the last blocks (for reorgs), the watched outpoints, the
+    prevout cache in LRU order, the mempool index, the current block and the
+    last ZMQ sequence and receive time per topic.
+
+        magic          8 bytes  ORDSNAP1
+        header_length  u32
+        header         JSON: scalars, the inscription dictionary and the
+                       (offset, length) of every section after the header
+        sections       little-endian typed arrays and fixed-size key blobs
+
+    Groups are stored column-wise, like the rebid store: one array per
+    TransactionData field across all groups, the bids of every group
+    concatenated, and the group's outpoints as 36-byte keys. capture()
+    builds the parts in the caller's thread with C-level joins and array
+    copies, SnapshotWriter writes them to a temporary file and renames it
+    over the previous snapshot from a background thread, so a crash leaves
+    either snapshot whole. restore() maps the file and rebuilds the state
+    from slices of the mapping.
+
+    This module does not import rebid_analysis, restore() is given the
+    TransactionData class.
+"""
+
+MAGIC = b"ORDSNAP1"
+LENGTH = struct.Struct("<I")
+OUTPOINT_SIZE = 36
+HASH_SIZE = 32
+
+
+def _little_endian(column: array) -> array:
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column
+
+
+class SnapshotBuilder():
+    def __init__(self):
+        self.sections: Dict[str, Tuple[int, int]] = {}
+        self.parts: List[bytes] = []
+        self.size = 0
+        self.inscriptions: Dict[tuple, int] = {}
+
+    def add(self, name: str, data: bytes):
+        self.sections[name] = (self.size, len(data))
+        self.parts.append(data)
+        self.size += len(data)
+
+    def add_array(self, name: str, column: array):
+        self.add(name, _little_endian(column).tobytes())
+
+    # entries are (group id, TransactionData, outpoint keys)
+    def add_groups(self, prefix: str, entries: list):
+        ids, last_blocks, raw_lengths, bids, inscriptions, outpoint_counts = (array(typecode) for typecode in "IqIIII")
+        gas_fees, timestamps, vsizes = array("q"), array("d"), array("I")
+        for group, tx_data, outpoints in entries:
+            ids.append(group)
+            last_blocks.append(tx_data.last_block)
+            raw_lengths.append(len(tx_data.latest_raw))
+            bids.append(len(tx_data.gas_fees))
+            gas_fees.extend(tx_data.gas_fees)
+            timestamps.extend(tx_data.timestamps)
+            vsizes.extend(tx_data.vsizes)
+            inscription = tx_data.inscription
+            inscriptions.append(0 if inscription is None else self.inscriptions.setdefault(tuple(inscription), len(self.inscriptions) + 1))
+            outpoint_counts.append(len(outpoints))
+        self.add(prefix + ".keys", b"".join(bytes.fromhex(tx_data.key) for _, tx_data, _ in entries))
+        self.add(prefix + ".txids", b"".join(tx_data.latest_txid for _, tx_data, _ in entries))
+        self.add(prefix + ".raws", b"".join(tx_data.latest_raw for _, tx_data, _ in entries))
+        self.add(prefix + ".outpoints", b"".join(b"".join(outpoints) for _, _, outpoints in entries))
+        for name, column in (("ids", ids), ("last_blocks", last_blocks), ("raw_lengths", raw_lengths), ("bids", bids),
+                             ("gas_fees", gas_fees), ("timestamps", timestamps), ("vsizes", vsizes),
+                             ("inscriptions", inscriptions), ("outpoint_counts", outpoint_counts)):
+            self.add_array(prefix + "." + name, column)
+
+    def finish(self, header: dict) -> List[bytes]:
+        header = dict(header, sections=self.sections, inscriptions=[list(inscription) for inscription in self.inscriptions])
+        encoded = json.dumps(header).encode()
+        return [MAGIC, LENGTH.pack(len(encoded)), encoded] + self.parts
+
+
+class Snapshot():
+    """A snapshot file mapped read-only, sections are sliced out of the mapping."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        if bytes(self.view[:len(MAGIC)]) != MAGIC:
+            raise ValueError("Not an analyzer snapshot: {}".format(path))
+        header_length = LENGTH.unpack_from(self.view, len(MAGIC))[0]
+        self.start = len(MAGIC) + LENGTH.size + header_length
+        self.header = json.loads(bytes(self.view[len(MAGIC) + LENGTH.size:self.start]))
+        for offset, length in self.header["sections"].values():
+            if self.start + offset + length > len(self.map):
+                raise ValueError("Truncated analyzer snapshot: {}".format(path))
+
+    def section(self, name: str) -> memoryview:
+        offset, length = self.header["sections"][name]
+        return self.view[self.start + offset:self.start + offset + length]
+
+    def array(self, name: str, typecode: str) -> array:
+        column = array(typecode)
+        column.frombytes(self.section(name))
+        return _little_endian(column)
+
+    def keys(self, name: str, size: int) -> List[bytes]:
+        data = bytes(self.section(name))
+        return [data[i:i + size] for i in range(0, len(data), size)]
+
+    # (group id, TransactionData, outpoint keys), in the order they were added
+    def groups(self, prefix: str, transaction_data_class) -> list:
+        inscriptions = [None] + [Inscription(*inscription) for inscription in self.header["inscriptions"]]
+        keys = self.keys(prefix + ".keys", HASH_SIZE)
+        txids = self.keys(prefix + ".txids", HASH_SIZE)
+        raws = bytes(self.section(prefix + ".raws"))
+        outpoints = self.keys(prefix + ".outpoints", OUTPOINT_SIZE)
+        ids, last_blocks, raw_lengths, bids, inscription_codes, outpoint_counts = (
+            self.array(prefix + "." + name, typecode) for name, typecode in
+            (("ids", "I"), ("last_blocks", "q"), ("raw_lengths", "I"), ("bids", "I"), ("inscriptions", "I"), ("outpoint_counts", "I"))
+        )
+        gas_fees, timestamps, vsizes = self.array(prefix + ".gas_fees", "q"), self.array(prefix + ".timestamps", "d"), self.array(prefix + ".vsizes", "I")
+        entries = []
+        raw_position = bid_position = outpoint_position = 0
+        for i, group in enumerate(ids):
+            tx_data = transaction_data_class(key=keys[i].hex(), last_block=last_blocks[i])
+            tx_data.latest_txid = txids[i]
+            tx_data.latest_raw = raws[raw_position:raw_position + raw_lengths[i]]
+            raw_position += raw_lengths[i]
+            tx_data.gas_fees = gas_fees[bid_position:bid_position + bids[i]]
+            tx_data.timestamps = timestamps[bid_position:bid_position + bids[i]]
+            tx_data.vsizes = vsizes[bid_position:bid_position + bids[i]]
+            bid_position += bids[i]
+            tx_data.inscription = inscriptions[inscription_codes[i]]
+            entries.append((group, tx_data, outpoints[outpoint_position:outpoint_position + outpoint_counts[i]]))
+            outpoint_position += outpoint_counts[i]
+        return entries
+
+    def close(self):
+        try:
+            self.view.release()
+            self.map.close()
+        except BufferError:
+            # a section is still referenced, the mapping goes once it is collected
+            pass
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Parts of a snapshot of `analyzer` (a MempoolAnalyzer with no pending
+# transactions), to hand to SnapshotWriter
+def capture(analyzer) -> List[bytes]:
+    builder = SnapshotBuilder()
+    conflict_index = analyzer.conflict_index
+    builder.add_groups("groups", [(group, tx_data, list(conflict_index.group_outpoints[group])) for group, tx_data in analyzer.transactions.items()])
+    for block, retired in enumerate(analyzer.retired_groups):
+        builder.add_groups("retired.{}".format(block), [(0, tx_data, outpoints) for tx_data, outpoints in retired])
+    builder.add("watched", b"".join(conflict_index.watched))
+    cache = analyzer.prevout_cache
+    builder.add("prevouts.keys", b"".join(cache.entries))
+    builder.add_array("prevouts.values", array("q", cache.entries.values()))
+    mempool = analyzer.mempool
+    builder.add("mempool.txids", b"".join(mempool.txids))
+    builder.add_array("mempool.sequences", array("Q", mempool.txids.values()))
+    return builder.finish({
+        "created_ns": time.time_ns(),
+        "current_block": analyzer.current_block,
+        "next_group": conflict_index.next_group,
+        "retired_blocks": len(analyzer.retired_groups),
+        "recent_blocks": list(analyzer.recent_blocks),
+        "mempool_next_sequence": mempool.next_sequence,
+        "last_sequences": analyzer.last_sequences,
+        "last_wall_ns": analyzer.last_wall_ns,
+    })
+
+
+# Loads the snapshot at `path` into a freshly built analyzer, returns its header
+def restore(analyzer, path: str, transaction_data_class) -> dict:
+    with Snapshot(path) as snapshot:
+        header = snapshot.header
+        conflict_index = analyzer.conflict_index
+        conflict_index.clear()
+        analyzer.transactions.clear()
+        for group, tx_data, outpoints in snapshot.groups("groups", transaction_data_class):
+            conflict_index.parent[group] = group
+            conflict_index.absorbed[group] = []
+            conflict_index.group_outpoints[group] = set(outpoints)
+            conflict_index.outpoint_groups.update(dict.fromkeys(outpoints, group))
+            analyzer.transactions[group] = tx_data
+        conflict_index.next_group = header["next_group"]
+        conflict_index.watch(snapshot.keys("watched", OUTPOINT_SIZE))
+        analyzer.retired_groups.clear()
+        for block in range(header["retired_blocks"]):
+            retired = snapshot.groups("retired.{}".format(block), transaction_data_class)
+            analyzer.retired_groups.append([(tx_data, outpoints) for _, tx_data, outpoints in retired])
+        analyzer.prevout_cache.restore(snapshot.keys("prevouts.keys", OUTPOINT_SIZE), snapshot.array("prevouts.values", "q"))
+        analyzer.mempool.txids = dict(zip(snapshot.keys("mempool.txids", HASH_SIZE), snapshot.array("mempool.sequences", "Q")))
+        analyzer.mempool.next_sequence = header["mempool_next_sequence"]
+        analyzer.recent_blocks.clear()
+        analyzer.recent_blocks.extend(tuple(block) for block in header["recent_blocks"])
+        analyzer.current_block = header["current_block"]
+        analyzer.last_sequences = dict(header["last_sequences"])
+        analyzer.last_wall_ns = header["last_wall_ns"]
+    return header
+
+
+class SnapshotWriter():
+    """Writes snapshots from a background thread. A snapshot submitted while
+    the previous one is still being written replaces any not yet started, only
+    the latest state is worth writing."""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.condition = threading.Condition()
+        self.pending: Optional[List[bytes]] = None
+        self.busy = False
+        self.closed = False
+        self.error: Optional[BaseException] = None
+        self.written = 0
+        self.last_size = 0
+        self.last_seconds = 0.0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, parts: List[bytes]):
+        if self.error is not None:
+            raise self.error
+        with self.condition:
+            self.pending = parts
+            self.condition.notify()
+
+    # Blocks until every snapshot submitted so far is on disk
+    def flush(self):
+        with self.condition:
+            self.condition.wait_for(lambda: self.pending is None and not self.busy)
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending is not None or self.closed)
+                if self.pending is None:
+                    return
+                parts, self.pending, self.busy = self.pending, None, True
+            try:
+                start = time.perf_counter()
+                self._write(parts)
+                self.last_seconds = time.perf_counter() - start
+                self.last_size = sum(map(len, parts))
+                self.written += 1
+            except Exception as err:
+                self.error = err
+            finally:
+                with self.condition:
+                    self.busy = False
+                    self.condition.notify_all()
+
+    # Written aside, synced and renamed over the previous snapshot
+    def _write(self, parts: List[bytes]):
+        temporary = self.path + ".tmp"
+        with open(temporary, "wb") as file:
+            file.writelines(parts)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.path)
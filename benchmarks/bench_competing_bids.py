@@ -0,0 +1,57 @@
+import argparse
+import time
+
+import pandas as pd
+
+from data_analysis.competing_bids import competing_pairs, load_bids
+
+"""
+    competing_pairs against get_block_df from data_analysis/mempool_rebid.ipynb
+    (kept here as the baseline, with the csv's column name) on the rebid
+    analysis output, checking that both find the same pairs in the same
+    order.
+
+        python -m benchmarks.bench_competing_bids data/rebid_output.csv --blocks 20
+"""
+
+
+def get_block_df(df: pd.DataFrame, block, fee_threshold: int = 1) -> pd.DataFrame:
+    competing_transactions = []
+    block_df = df[df['blockId'] == block]
+    for index, row in block_df.iterrows():
+        # Find transactions in the same block with similar fees
+        similar_fees_df = block_df[(block_df['gasFee'] >= row['gasFee'] - fee_threshold) &
+                                   (block_df['gasFee'] <= row['gasFee'] + fee_threshold) &
+                                   (block_df['externalTransactionId'] != row['externalTransactionId'])]
+        for idx, r in similar_fees_df.iterrows():
+            competing_transactions.append((row['externalTransactionId'], r['externalTransactionId'], block))
+    return pd.DataFrame(competing_transactions, columns=['Transaction1', 'Transaction2', 'BlockId'])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", nargs="?", default="data/rebid_output.csv")
+    parser.add_argument("--fee-threshold", type=int, default=1)
+    parser.add_argument("--blocks", type=int, help="only the first N blocks, the baseline takes minutes on all of them")
+    args = parser.parse_args()
+
+    df = load_bids(args.path)
+    blocks = df['blockId'].unique()[:args.blocks]
+    df = df[df['blockId'].isin(blocks)].reset_index(drop=True)
+
+    start = time.perf_counter()
+    baseline = pd.concat([get_block_df(df, block, args.fee_threshold) for block in blocks], ignore_index=True)
+    baseline_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pairs = competing_pairs(df, args.fee_threshold)
+    elapsed = time.perf_counter() - start
+
+    print(f"{len(df)} bids in {len(blocks)} blocks, {len(pairs)} competing pairs")
+    print(f"{'get_block_df (notebook)':<28}{baseline_elapsed:>10.3f} s")
+    print(f"{'competing_pairs':<28}{elapsed:>10.3f} s{baseline_elapsed / elapsed:>10.0f}x")
+    print("same pairs:", baseline.astype(str).equals(pairs.astype(str)))
+
+
+if __name__ == "__main__":
+    main()
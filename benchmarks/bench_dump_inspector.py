@@ -0,0 +1,119 @@
+import argparse
+import gc
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from analyze import describe_records, records_for_hash, top_records
+from benchmarks.synthetic import make_mempool_mix
+from encoding.decode import decode
+from encoding.dump_format import BinaryDumpWriter, DumpRecord, datetime_to_ns
+from encoding.dump_index import DumpLookupIndex, TextDumpReader, record_hashes
+
+"""
+    The previous analyze.py (read every line, sort them all by length,
+    decode the longest) against analyze.py's streaming top-k on the same
+    synthetic dump, text and binary, in time and peak Python allocations;
+    then the lookup index: build time and the latency of finding and
+    decoding every record of a txid, against scanning the dump for it.
+
+        python -m benchmarks.bench_dump_inspector --transactions 20000 --lookups 200
+"""
+
+
+def write_dumps(directory: str, n_transactions: int):
+    rng = random.Random(0)
+    parents, spends = make_mempool_mix(rng, n_transactions, rbf_fraction=0.3)
+    text_path, binary_path = os.path.join(directory, "dump.txt"), os.path.join(directory, "dump.bin")
+    writer = BinaryDumpWriter(binary_path, flush_every_record=False)
+    txids = []
+    with open(text_path, "w") as text:
+        for i, tx in enumerate(parents + spends):
+            # never a whole second, str() would drop the microseconds decode expects
+            ts = datetime.fromtimestamp(1_700_000_000 + i // 100).replace(microsecond=i % 100 * 10_000 + 1)
+            text.write("RawTransaction(sequence={}, raw_tx={}, timestamp={})\n".format(i, tx.serialize().hex(), ts))
+            writer.write(DumpRecord(b"rawtx", i, datetime_to_ns(ts), datetime_to_ns(ts), tx.serialize()))
+            txids.append(tx.GetTxid()[::-1].hex())
+    writer.close()
+    return text_path, binary_path, txids
+
+
+def load_everything(path: str, k: int):
+    with open(path, "r") as file:
+        lines = list(enumerate([line.strip() for line in file.readlines()]))
+    lines.sort(key=lambda x: len(x[1]), reverse=True)
+    return [(number, decode(line).deserialize()) for number, line in lines[:k]]
+
+
+def streaming(path: str, k: int):
+    found = top_records(path, "size", k)
+    index = DumpLookupIndex.open(path)
+    return describe_records(index, [number for number, _ in found])
+
+
+# Timed without tracing, tracemalloc slows down allocation-heavy loops
+def measure(function, *args):
+    gc.collect()
+    start = time.perf_counter()
+    function(*args)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def scan_for(path: str, txid: str):
+    hash = bytes.fromhex(txid)
+    with TextDumpReader(path) as dump:
+        return [number for number, record in enumerate(dump) if hash in record_hashes(record)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--transactions", type=int, default=20000)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--lookups", type=int, default=200)
+    parser.add_argument("--scans", type=int, default=3, help="txid lookups by scanning the text dump, the baseline")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        text_path, binary_path, txids = write_dumps(directory, args.transactions)
+        print(f"{len(txids)} records, text {os.path.getsize(text_path) / 1e6:.1f} MB, binary {os.path.getsize(binary_path) / 1e6:.1f} MB")
+        for name, path in (("text", text_path), ("binary", binary_path)):
+            start = time.perf_counter()
+            index = DumpLookupIndex.open(path, args.workers)
+            print(f"{name} index: built in {time.perf_counter() - start:.2f} s, {os.path.getsize(index.index_path) / 1e6:.2f} MB")
+
+        print(f"\ntop {args.k} by size{'':<18}{'time':>10}{'peak alloc':>14}")
+        for name, function, path in (
+            ("load everything (text)", load_everything, text_path),
+            ("streaming (text)", streaming, text_path),
+            ("streaming (binary)", streaming, binary_path),
+        ):
+            elapsed, peak = measure(function, path, args.k)
+            print(f"{name:<30}{elapsed:>8.2f} s{peak / 1e6:>11.1f} MB")
+
+        rng = random.Random(1)
+        print(f"\nall records of a txid{'':<10}{'per lookup':>12}")
+        start = time.perf_counter()
+        for txid in rng.sample(txids, args.scans):
+            scan_for(text_path, txid)
+        print(f"{'scan (text)':<30}{(time.perf_counter() - start) / args.scans * 1e3:>9.2f} ms")
+        for name, path in (("index (text)", text_path), ("index (binary)", binary_path)):
+            index = DumpLookupIndex.open(path)
+            sample = rng.sample(txids, args.lookups)
+            start = time.perf_counter()
+            for txid in sample:
+                describe_records(index, records_for_hash(index, txid))
+            print(f"{name:<30}{(time.perf_counter() - start) / args.lookups * 1e3:>9.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.synthetic import make_mempool_mix
+from encoding.dump_archive import DumpArchiveWriter, GroupCommitter
+from networking.zmq_handler.zmq_handlers import BinaryDumpHandler, DumpHandler
+from networking.zmq_handler.zmq_objects import BlockHash, RawTransaction
+
+"""
+    Recording the ZMQ stream: the text dump flushed after every message
+    (the previous WriteToFileHandler), the binary dump flushed after every
+    record (BinaryDumpHandler), and the compressed archive committed by a
+    background thread (encoding/dump_archive.py) at a few commit intervals.
+
+    Throughput is the rate the handler thread can hand messages over at,
+    with everything on disk when the writer is closed. The loss window is
+    measured with messages arriving at --rate per second: the longest a
+    record waited before it reached the OS (flushed writers, lost on power
+    loss only) or was synced to disk (archive, lost on a crash too).
+
+        python -m benchmarks.bench_dump_writer --transactions 50000 --rate 3000
+"""
+
+
+def make_messages(n_transactions: int):
+    rng = random.Random(0)
+    parents, spends = make_mempool_mix(rng, n_transactions // 2, rbf_fraction=0.3)
+    messages = []
+    for i, tx in enumerate((parents + spends)[:n_transactions]):
+        messages.append(RawTransaction(i, tx.serialize().hex()))
+        if i % 3000 == 2999:
+            messages.append(BlockHash(i, os.urandom(32).hex()))
+    return messages
+
+
+class TextWriter():
+    def __init__(self, path: str):
+        self.file = open(path, "a")
+
+    def handle(self, message):
+        self.file.write(str(message) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class BinaryWriter(BinaryDumpHandler):
+    def close(self):
+        self.writer.close()
+
+
+class ArchiveWriter(DumpHandler):
+    def __init__(self, directory: str, commit_interval: float):
+        super().__init__()
+        self.writer = DumpArchiveWriter(directory)
+        self.committer = GroupCommitter(self.writer, commit_interval=commit_interval)
+
+    def handle(self, message):
+        record = self.to_record(message)
+        self.committer.write(record, rotate_after=record.topic == b"hashblock")
+
+    def close(self):
+        self.committer.close()
+
+
+def size_of(path: str) -> int:
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+    return os.path.getsize(path)
+
+
+# (seconds to hand every message over, seconds until all are written)
+def run(writer, messages, rate: float = 0.0):
+    start = time.perf_counter()
+    for i, message in enumerate(messages):
+        if rate:
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        writer.handle(message)
+    handed_over = time.perf_counter() - start
+    writer.close()
+    return handed_over, time.perf_counter() - start
+
+
+# write() calls reaching the OS: one per message for the text dump, a record
+# and its index entry for the binary dump, one per frame for the archive
+def writes(writer, messages) -> int:
+    if isinstance(writer, ArchiveWriter):
+        return writer.writer.frames
+    return len(messages) * (2 if isinstance(writer, BinaryWriter) else 1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--transactions", type=int, default=50000)
+    parser.add_argument("--rate", type=float, default=3000, help="messages per second for the loss window")
+    parser.add_argument("--paced", type=int, default=10000, help="messages sent at --rate")
+    parser.add_argument("--intervals", type=float, nargs="+", default=[0.1, 1.0])
+    args = parser.parse_args()
+
+    messages = make_messages(args.transactions)
+    # the bodies are hex in the messages, raw in the records
+    raw_bytes = sum(len(message.raw_tx) // 2 for message in messages if isinstance(message, RawTransaction))
+    print(f"{len(messages)} messages, {raw_bytes / 1e6:.1f} MB of transactions")
+    writers = [
+        ("text, flush per message", lambda directory: (TextWriter(directory + "/dump.txt"), directory + "/dump.txt")),
+        ("binary, flush per record", lambda directory: (BinaryWriter(directory + "/dump.bin"), directory + "/dump.bin")),
+    ] + [
+        (f"archive, commit {interval:g} s", lambda directory, interval=interval: (ArchiveWriter(directory + "/archive", interval), directory + "/archive"))
+        for interval in args.intervals
+    ]
+    print(f"{'':<28}{'msg/s':>10}{'us/msg':>9}{'on disk':>10}{'writes':>9}{'size MB':>9}{'loss window':>13}")
+    for name, make in writers:
+        with tempfile.TemporaryDirectory() as directory:
+            writer, path = make(directory)
+            handed_over, written = run(writer, messages)
+            size = size_of(path)
+            n_writes = writes(writer, messages)
+        with tempfile.TemporaryDirectory() as directory:
+            writer, _ = make(directory)
+            paced = messages[:args.paced]
+            if isinstance(writer, ArchiveWriter):
+                run(writer, paced, args.rate)
+                window = f"{writer.committer.max_window * 1e3:.0f} ms"
+            else:
+                window = "0 ms (OS)"
+                run(writer, paced, args.rate)
+        print(f"{name:<28}{len(messages) / handed_over:>10.0f}{handed_over / len(messages) * 1e6:>9.1f}{written:>8.2f} s"
+              f"{n_writes:>9}{size / 1e6:>9.1f}{window:>13}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+import argparse
+import contextlib
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import threading
+import time
+from array import array
+from typing import Dict
+
+from bitcoin.core import CBlock, CTransaction
+from bitcoin.rpc import Proxy
+
+from analyzer.prevout_cache import PrevoutCache
+from analyzer.rpc_fixtures import ReplayProxy, RpcFixtureStore
+from benchmarks.synthetic import make_rbf_storm
+from networking.fake_rpc_server import FakeBitcoinRpcServer
+from networking.fake_zmq_publisher import FakeZmqPublisher, load_schedule, schedule_offsets
+from networking.metrics import Histogram
+from networking.zmq_handler.frame_queue import OverloadPolicy
+from networking.zmq_handler.zmq_sub import ZMQHandler, frame_message
+from rebid_analysis import MempoolAnalyzer
+
+"""
+    End-to-end throughput of the live pipeline: the real ZMQHandler and
+    MempoolAnalyzer, wired as in main.py, are fed by a fake node in another
+    process, a FakeZmqPublisher (networking/fake_zmq_publisher.py) and a
+    FakeBitcoinRpcServer answering after --rpc-latency seconds. The traffic is
+    a synthetic RBF storm (benchmarks/synthetic.py make_rbf_storm) or the
+    rawtx/hashblock frames of a captured dump (--dump, with the RPC answers
+    recorded by main.py --record-rpc as --fixtures), replayed at each
+    --speed times its pace.
+
+    Per speed: the offered and the handled rate, the publication to handled
+    latency of every frame (from when it was due, so a publisher falling
+    behind counts too), the deepest the queue got, the frames lost between
+    the sockets (sequence gaps, past the publisher's --sndhwm or the
+    subscriber's --queue-size) and dropped from the queue, and the peak RSS
+    of the analyzer process. The analyzer falls behind once the handled rate
+    stays under the offered one.
+
+        python -m benchmarks.bench_end_to_end --groups 1000 --bumps 6 --duration 30 --speed 1 4 16
+        python -m benchmarks.bench_end_to_end --dump data/mempool_drop.bin --fixtures data/rpc_fixtures --speed 1 10
+"""
+
+TOPICS = [b"rawtx", b"hashblock"]
+
+
+# parents and blocks come serialized, python-bitcoinlib's objects do not unpickle
+def run_node(schedule, parents, blocks, endpoint: str, sndhwm: int, speed: float, rpc_latency: float, control):
+    with FakeBitcoinRpcServer(latency=rpc_latency) as server:
+        for parent in parents:
+            server.add_transaction(CTransaction.deserialize(parent))
+        control.send(server.url)
+        publisher = FakeZmqPublisher(endpoint, sndhwm)
+        publisher.wait_subscribed(TOPICS, timeout=120)
+        start_ns = time.monotonic_ns() + 100_000_000
+
+        def before_send(topic: bytes, body: bytes):
+            block = blocks.get(body) if topic == b"hashblock" else None
+            if block is not None:
+                server.add_block(CBlock.deserialize(block))
+
+        publisher.publish(schedule, speed, start_ns, before_send)
+        control.send((start_ns, publisher.published, publisher.max_late_ns))
+        # the analyzer may still be resolving prevouts
+        control.recv()
+        publisher.close()
+
+
+class TimedHandler():
+    """The analyzer behind its pre-decode filter, as main.py wires it, noting
+    when each frame is done with."""
+
+    def __init__(self, analyzer: MempoolAnalyzer, offsets: Dict[bytes, array]):
+        self.analyzer = analyzer
+        self.done_ns = {topic: array("q", bytes(8 * len(topic_offsets))) for topic, topic_offsets in offsets.items()}
+        self.handled = 0
+
+    def handle_gap(self, record):
+        self.analyzer.handle_gap(record)
+
+    def handle_record(self, record):
+        if self.analyzer.accepts_message(record.topic, record.body):
+            self.analyzer.handle(frame_message(record))
+        done_ns = self.done_ns.get(record.topic)
+        if done_ns is not None and record.sequence < len(done_ns):
+            done_ns[record.sequence] = time.monotonic_ns()
+        self.handled += 1
+
+
+# Stops the pipeline once the node is done and every frame received is handled
+def watch(zmq_handler: ZMQHandler, handler: TimedHandler, control, drain_timeout: float):
+    control.poll(None)
+    deadline = time.monotonic() + drain_timeout
+    received = -1
+    while time.monotonic() < deadline:
+        time.sleep(0.25)
+        now_received = sum(counter.value for counter in zmq_handler.received.values())
+        dropped = sum(queue.dropped for queue in zmq_handler.queues)
+        if now_received == received and zmq_handler.queue_depth == 0 and handler.handled + dropped >= now_received:
+            break
+        received = now_received
+    zmq_handler.loop.call_soon_threadsafe(zmq_handler.stop)
+
+
+def run_consumer(root: str, endpoint: str, rpc_url: str, fixtures, queue_size: int, overload: str, offsets: Dict[bytes, array],
+                 drain_timeout: float, control):
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        if fixtures:
+            # a fresh cache keeps the replay to the recorded answers
+            analyzer = MempoolAnalyzer(root, client=ReplayProxy(RpcFixtureStore(fixtures)), prevout_cache=PrevoutCache())
+        else:
+            analyzer = MempoolAnalyzer(root, client=Proxy(service_url=rpc_url), backfill=True)
+        handler = TimedHandler(analyzer, offsets)
+        zmq_handler = ZMQHandler(handler, sub_topic=[topic.decode() for topic in TOPICS], queue_size=queue_size, overload=OverloadPolicy(overload),
+                                 spill_path=os.path.join(root, "data/zmq_spill.bin"), endpoints=[endpoint])
+        threading.Thread(target=watch, args=(zmq_handler, handler, control, drain_timeout), daemon=True).start()
+        zmq_handler.start()
+        analyzer.flush_pending_transactions()
+    start_ns, speed = control.recv()
+    latency = Histogram()
+    last_done = start_ns
+    for topic, done_ns in handler.done_ns.items():
+        for offset, done in zip(offsets[topic], done_ns):
+            if done:
+                latency.record(done - (start_ns + int(offset / speed)))
+                last_done = max(last_done, done)
+    control.send({
+        "received": sum(counter.value for counter in zmq_handler.received.values()),
+        "handled": handler.handled,
+        "elapsed": (last_done - start_ns) / 1e9,
+        "latency": latency,
+        "high_water": max(queue.high_water for queue in zmq_handler.queues),
+        "lost": zmq_handler.continuity.gaps,
+        "dropped": sum(queue.dropped for queue in zmq_handler.queues),
+        "max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    })
+
+
+def run(schedule, parents, blocks, offsets, speed: float, args) -> dict:
+    context = multiprocessing.get_context("spawn")
+    node_control, node_end = context.Pipe()
+    consumer_control, consumer_end = context.Pipe()
+    node = context.Process(target=run_node, args=(schedule, parents, blocks, args.endpoint, args.sndhwm, speed, args.rpc_latency, node_end))
+    node.start()
+    # a child exiting early then fails recv() instead of leaving it waiting
+    node_end.close()
+    rpc_url = node_control.recv()
+    root = tempfile.mkdtemp()
+    os.makedirs(os.path.join(root, "data"))
+    consumer = context.Process(target=run_consumer, args=(root, args.endpoint, rpc_url, args.fixtures, args.queue_size, args.overload, offsets,
+                                                          args.drain_timeout, consumer_end))
+    consumer.start()
+    consumer_end.close()
+    start_ns, published, max_late_ns = node_control.recv()
+    consumer_control.send((start_ns, speed))
+    result = consumer_control.recv()
+    node_control.send(None)
+    consumer.join()
+    node.join()
+    result.update(published=published, max_late=max_late_ns / 1e9)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--groups", type=int, default=1000)
+    parser.add_argument("--bumps", type=int, default=6)
+    parser.add_argument("--duration", type=float, default=30, help="seconds over which groups open and blocks come, bids go on after")
+    parser.add_argument("--bump-interval", type=float, default=3, help="mean seconds between two bids of a group")
+    parser.add_argument("--background-rate", type=float, default=100, help="non-RBF transactions a second")
+    parser.add_argument("--block-interval", type=float, default=10)
+    parser.add_argument("--dump", help="replay the rawtx/hashblock frames of a binary dump or archive instead of a storm")
+    parser.add_argument("--fixtures", help="RPC answers recorded with the dump, see main.py --record-rpc")
+    parser.add_argument("--speed", type=float, nargs="+", default=[1, 4, 16], help="multiples of the real pace")
+    parser.add_argument("--rpc-latency", type=float, default=0.002)
+    parser.add_argument("--queue-size", type=int, default=10000)
+    parser.add_argument("--overload", choices=[policy.value for policy in OverloadPolicy], default=OverloadPolicy.BLOCK.value)
+    parser.add_argument("--sndhwm", type=int, default=1000, help="the publisher's high-water mark, bitcoind's default")
+    parser.add_argument("--endpoint", default="tcp://127.0.0.1:28342")
+    parser.add_argument("--drain-timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    if args.dump:
+        schedule, parents, blocks = load_schedule(args.dump, TOPICS), [], {}
+        print(f"{args.dump}: {len(schedule)} frames over {schedule[-1][0] / 1e9:.0f}s")
+    else:
+        parents, schedule, blocks = make_rbf_storm(random.Random(0), args.groups, args.bumps, args.duration, args.bump_interval,
+                                                   args.background_rate, args.block_interval)
+        parents = [parent.serialize() for parent in parents]
+        blocks = {body: block.serialize() for body, block in blocks.items()}
+        print(f"storm: {args.groups} groups x {args.bumps} bumps, {args.background_rate:g} other tx/s, a block every {args.block_interval:g}s: "
+              f"{len(schedule)} frames over {schedule[-1][0] / 1e9:.0f}s")
+    offsets = schedule_offsets(schedule)
+    # a single frame has no pace of its own
+    duration = max(schedule[-1][0] / 1e9, 1e-3)
+    print(f"{'speed':>6}{'offered/s':>11}{'handled/s':>11}{'p50':>9}{'p99':>9}{'max':>9}{'queue max':>11}{'lost':>7}{'dropped':>9}{'max rss':>10}{'pub late':>10}")
+    for speed in args.speed:
+        result = run(schedule, parents, blocks, offsets, speed, args)
+        latency = result["latency"]
+        offered = len(schedule) / (duration / speed)
+        handled = result["handled"] / result["elapsed"] if result["elapsed"] else 0.0
+        print(f"{speed:>5g}x{offered:>11.0f}{handled:>11.0f}"
+              + "".join(f"{value / 1e6:>7.0f}ms" for value in (latency.percentile(0.5), latency.percentile(0.99), latency.max))
+              + f"{result['high_water']:>11}{result['lost']:>7}{result['dropped']:>9}{result['max_rss'] / 1e6:>8.0f}MB{result['max_late'] * 1e3:>8.0f}ms"
+              + ("  behind" if handled < 0.95 * offered else ""))
+
+
+if __name__ == "__main__":
+    main()
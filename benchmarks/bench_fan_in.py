@@ -0,0 +1,85 @@
+import argparse
+import os
+import random
+import time
+import tracemalloc
+
+from networking.metrics import Histogram
+from networking.zmq_handler.fan_in import FanIn
+
+"""
+    Subscribing to several nodes (networking/zmq_handler/fan_in.py): the
+    first-seen latency of a transaction with 1 to --nodes nodes, each
+    delivering it after its own propagation delay (lognormal around
+    --median-ms, and one node stalling for --stall-ms every --stall-every
+    transactions), the merged arrivals being fed through FanIn.accept in
+    arrival order; then the cost of accept() per frame and the memory of a
+    full dedup table.
+
+        python -m benchmarks.bench_fan_in --transactions 100000 --nodes 3
+"""
+
+
+def arrivals(rng: random.Random, n_transactions: int, n_nodes: int, median_ms: float, stall_every: int, stall_ms: float):
+    events = []
+    for i in range(n_transactions):
+        published = i * 1_000_000
+        for node in range(n_nodes):
+            delay = rng.lognormvariate(0, 0.8) * median_ms
+            if node == 0 and i % stall_every < stall_every // 10:
+                # the first node lags for a tenth of the time
+                delay += stall_ms
+            events.append((published + int(delay * 1e6), node, i))
+    events.sort()
+    return events
+
+
+def first_seen(events, bodies, n_nodes: int, capacity: int) -> Histogram:
+    fan_in = FanIn(["node{}".format(node) for node in range(n_nodes)], capacity)
+    latency = Histogram()
+    sequences = [0] * n_nodes
+    for arrival_ns, node, i in events:
+        if node >= n_nodes:
+            continue
+        sequences[node] += 1
+        if fan_in.accept(node, b"rawtx", sequences[node], bodies[i], arrival_ns):
+            latency.record(arrival_ns - i * 1_000_000)
+    return latency
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--transactions", type=int, default=100_000)
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--median-ms", type=float, default=400)
+    parser.add_argument("--stall-every", type=int, default=10_000)
+    parser.add_argument("--stall-ms", type=float, default=5_000)
+    parser.add_argument("--capacity", type=int, default=100_000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    bodies = [os.urandom(rng.randrange(150, 600)) for _ in range(args.transactions)]
+    events = arrivals(rng, args.transactions, args.nodes, args.median_ms, args.stall_every, args.stall_ms)
+    print(f"first seen after publication (ms){'p50':>8}{'p90':>8}{'p99':>8}{'max':>8}")
+    for n_nodes in range(1, args.nodes + 1):
+        latency = first_seen(events, bodies, n_nodes, args.capacity)
+        print(f"  {n_nodes} node{'s' if n_nodes > 1 else ' '}{'':<23}" + "".join(
+            f"{value / 1e6:>8.0f}" for value in (latency.percentile(0.5), latency.percentile(0.9), latency.percentile(0.99), latency.max)))
+
+    fan_in = FanIn(["a", "b"], args.capacity)
+    start = time.perf_counter()
+    for i, body in enumerate(bodies):
+        fan_in.accept(0, b"rawtx", i, body, i)
+        fan_in.accept(1, b"rawtx", i, body, i + 1)
+    elapsed = time.perf_counter() - start
+    print(f"\naccept: {elapsed / (2 * len(bodies)) * 1e6:.2f} us per frame ({2 * len(bodies) / elapsed:.0f} frames/s)")
+    tracemalloc.start()
+    fan_in = FanIn(["a"], args.capacity)
+    for i, body in enumerate(bodies[:args.capacity]):
+        fan_in.accept(0, b"rawtx", i, body, i)
+    print(f"dedup table of {args.capacity} keys: {tracemalloc.get_traced_memory()[0] / 1e6:.1f} MB")
+    tracemalloc.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.synthetic import make_mempool_mix
+from networking.metrics import Histogram
+from networking.zmq_handler.routes import Route
+from networking.zmq_handler.zmq_handlers import BinaryDumpHandler, MultiHandler
+from networking.zmq_handler.zmq_sub import ZMQHandler
+
+"""
+    Three handlers behind one ZMQ receive path: the binary dump, a handler
+    blocking on RPC (--rpc-ms every --rpc-every transactions) and a cheap one
+    reading the decoded message. MultiHandler runs them one after another on
+    one worker; routes (networking/zmq_handler/routes.py) give each its own
+    queue and thread and share one decoded message. Frames are fed at --rate
+    per second through ZMQHandler's enqueue, without a socket, and the
+    receive to handled lag of each handler is reported.
+
+        python -m benchmarks.bench_fan_out --transactions 20000 --rate 4000 --rpc-ms 20
+"""
+
+
+class Lagged():
+    def __init__(self, handler):
+        self.handler = handler
+        self.lag = Histogram()
+
+    def handle(self, message):
+        self.handler.handle(message)
+        self.lag.record(time.monotonic_ns() - message.monotonic_ns)
+
+
+class LaggedRecords(Lagged):
+    def handle_record(self, record):
+        self.handler.handle_record(record)
+        self.lag.record(time.monotonic_ns() - record.monotonic_ns)
+
+
+class BlockingRpc():
+    def __init__(self, every: int, seconds: float):
+        self.every = every
+        self.seconds = seconds
+        self.seen = 0
+
+    def handle(self, message):
+        self.seen += 1
+        if self.seen % self.every == 0:
+            time.sleep(self.seconds)
+
+
+class Reader():
+    def __init__(self):
+        self.size = 0
+
+    def handle(self, message):
+        self.size += len(message.raw_body)
+
+
+def feed(zmq_handler: ZMQHandler, frames, rate: float) -> Histogram:
+    enqueue = Histogram()
+    for worker in zmq_handler.workers:
+        worker.start()
+    start = time.perf_counter()
+    for i, (topic, body) in enumerate(frames):
+        delay = start + i / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        record = zmq_handler.frame(topic, i, body)
+        for queue in zmq_handler.enqueue(record):
+            queue.put(record)
+        enqueue.record(time.monotonic_ns() - record.monotonic_ns)
+    for queue in zmq_handler.queues:
+        queue.close()
+    for worker in zmq_handler.workers:
+        worker.join()
+    return enqueue
+
+
+def report(name: str, histogram: Histogram):
+    print(f"  {name:<12}{histogram.count:>8}{histogram.percentile(0.5) / 1e6:>10.2f}{histogram.percentile(0.99) / 1e6:>10.2f}{histogram.max / 1e6:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--transactions", type=int, default=20000)
+    parser.add_argument("--rate", type=float, default=4000, help="frames per second")
+    parser.add_argument("--rpc-ms", type=float, default=20)
+    parser.add_argument("--rpc-every", type=int, default=200)
+    args = parser.parse_args()
+
+    _, spends = make_mempool_mix(random.Random(0), args.transactions, rbf_fraction=0.3)
+    frames = [(b"rawtx", tx.serialize()) for tx in spends[:args.transactions]]
+    for mode in ("MultiHandler", "routes"):
+        with tempfile.TemporaryDirectory() as directory:
+            dump = BinaryDumpHandler(os.path.join(directory, "dump.bin"))
+            dump_lag = LaggedRecords(dump) if mode == "routes" else Lagged(dump)
+            rpc, reader = Lagged(BlockingRpc(args.rpc_every, args.rpc_ms / 1e3)), Lagged(Reader())
+            if mode == "routes":
+                zmq_handler = ZMQHandler(routes=[Route("dump", dump_lag), Route("rpc", rpc), Route("reader", reader)])
+            else:
+                zmq_handler = ZMQHandler(message_handler=MultiHandler([dump_lag, rpc, reader]))
+            start = time.perf_counter()
+            enqueue = feed(zmq_handler, frames, args.rate)
+            elapsed = time.perf_counter() - start
+            dump.writer.close()
+            zmq_handler.zmqContext.destroy()
+        print(f"{mode}: {len(frames) / elapsed:.0f} frames/s fed at {args.rate:g}/s, dropped {sum(queue.dropped for queue in zmq_handler.queues)}")
+        print(f"  {'lag (ms)':<12}{'n':>8}{'p50':>10}{'p99':>10}{'max':>10}")
+        report("enqueue", enqueue)
+        for name, handler in (("dump", dump_lag), ("rpc", rpc), ("reader", reader)):
+            report(name, handler.lag)
+
+
+if __name__ == "__main__":
+    main()
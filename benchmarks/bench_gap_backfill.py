@@ -0,0 +1,103 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from bitcoin.core import b2lx
+from bitcoin.rpc import Proxy
+
+from analyzer.prevout_cache import PrevoutCache
+from benchmarks.synthetic import make_parent, make_spend
+from encoding.dump_format import DumpRecord
+from networking.fake_rpc_server import FakeBitcoinRpcServer
+from networking.metrics import Histogram
+from networking.zmq_handler.zmq_sub import handle_frame
+from rebid_analysis import MempoolAnalyzer
+
+"""
+    Backfill of lost rawtx (analyzer/mempool_backfill.py): --groups rebid
+    groups of --bids bids each are streamed through the analyzer as they
+    enter the fake node's mempool, each bid replacing the previous one, over
+    a mempool of --mempool other transactions. Frames are dropped at random
+    at each loss rate, as a lossy tunnel would, and the groups whose latest
+    bid the analysis ends on are compared with a lossless run, without and
+    with a backfill at every gap and with backfills --min-interval apart,
+    along with the backfills run, the HTTP requests and the time a frame
+    running a backfill takes.
+
+        python -m benchmarks.bench_gap_backfill --groups 500 --bids 5 --mempool 50000
+"""
+
+
+def build(rng: random.Random, n_groups: int, n_bids: int):
+    parents = [make_parent(rng, 2) for _ in range(n_groups)]
+    bids = [[make_spend(rng, [(parent.GetTxid(), 0)], 99_000 - 300 * bid) for bid in range(n_bids)] for parent in parents]
+    # the bids of a round interleave across groups
+    stream = [(group, bid, bids[group][bid]) for bid in range(n_bids) for group in range(n_groups)]
+    return parents, bids, stream
+
+
+def run(parents, bids, stream, background, loss: float, backfill: bool, min_interval: float, seed: int):
+    rng = random.Random(seed)
+    directory = tempfile.mkdtemp()
+    os.makedirs(os.path.join(directory, "data"))
+    with FakeBitcoinRpcServer(block_count=5) as server:
+        for parent in parents:
+            server.add_transaction(parent)
+        for tx in background:
+            server.add_transaction(tx, in_mempool=True)
+        analyzer = MempoolAnalyzer(directory, client=Proxy(service_url=server.url), prevout_cache=PrevoutCache(), backfill=backfill)
+        analyzer.mempool_backfill.min_interval = min_interval
+        server.reset_counters()
+        backfill_time = Histogram()
+        lost = 0
+        for sequence, (group, bid, tx) in enumerate(stream):
+            server.add_transaction(tx, in_mempool=True)
+            if bid:
+                server.remove_from_mempool(b2lx(bids[group][bid - 1].GetTxid()))
+            if rng.random() < loss:
+                lost += 1
+                continue
+            record = DumpRecord(b"rawtx", sequence, time.monotonic_ns(), time.time_ns(), tx.serialize(), lost=lost if backfill else 0)
+            lost = 0
+            backfills = analyzer.mempool_backfill.backfills
+            start = time.perf_counter_ns()
+            handle_frame(record, analyzer, analyzer.accepts_message)
+            if analyzer.mempool_backfill.backfills != backfills:
+                backfill_time.record(time.perf_counter_ns() - start)
+        # the next frame, once the interval is over
+        time.sleep(min_interval)
+        analyzer.backfill_pending(time.time_ns())
+        analyzer.flush_pending_transactions()
+        latest = {b2lx(tx_data.latest_txid) for tx_data in analyzer.transactions.values()}
+        return latest, analyzer.mempool_backfill.stats(), server.http_requests, backfill_time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--groups", type=int, default=500)
+    parser.add_argument("--bids", type=int, default=5)
+    parser.add_argument("--mempool", type=int, default=50_000, help="other transactions in the node's mempool")
+    parser.add_argument("--loss", type=float, nargs="+", default=[0.01, 0.05, 0.2])
+    parser.add_argument("--min-interval", type=float, default=1.0)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    parents, bids, stream = build(rng, args.groups, args.bids)
+    background = [make_parent(rng, 1) for _ in range(args.mempool)]
+    expected = {b2lx(group_bids[-1].GetTxid()) for group_bids in bids}
+    print(f"{len(stream)} bids in {args.groups} groups, {args.mempool} other mempool transactions")
+    print(f"{'loss':>6}{'backfill':>14}{'latest bid right':>18}{'recovered':>11}{'backfills':>11}{'requests':>10}{'p50':>9}{'p99':>9}")
+    modes = [("none", False, 0.0), ("every gap", True, 0.0), (f"{args.min_interval:g}s apart", True, args.min_interval)]
+    for loss in args.loss:
+        for label, backfill, min_interval in modes:
+            latest, stats, requests, backfill_time = run(parents, bids, stream, background, loss, backfill, min_interval, seed=1)
+            timing = (f"{backfill_time.percentile(0.5) / 1e6:>7.1f}ms{backfill_time.percentile(0.99) / 1e6:>7.1f}ms"
+                      if backfill_time.count else f"{'-':>9}{'-':>9}")
+            print(f"{loss:>6.0%}{label:>14}{len(latest & expected) / len(expected):>18.1%}"
+                  f"{stats['recovered']:>11}{stats['backfills']:>11}{requests:>10}{timing}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import argparse
+import random
+import time
+
+from bitcoin.core import CTransaction
+
+from analyzer.inscriptions import classify, find_inscription
+from benchmarks.synthetic import make_mempool_mix, make_reveal
+from encoding.tx_scanner import scan_transaction
+
+"""
+    Inscription classifier (analyzer/inscriptions.py) on a synthetic rawtx
+    stream: ordinary segwit spends mixed with reveals (BRC-20 mints, small
+    text and --image-size byte images), against deserializing every
+    transaction and searching each witness item, as inscriptionparsing/main.go
+    does. Rates are compared with --peak-rate, a burst of rawtx per second
+    above what mint storms have delivered.
+
+        python -m benchmarks.bench_inscriptions --transactions 20000 --reveal-fraction 0.3
+"""
+
+BRC20_MINT = b'{"p":"brc-20","op":"mint","tick":"%s","amt":"1000"}'
+TICKERS = [b"ordi", b"sats", b"rats", b"piza", b"meme"]
+
+
+def make_stream(rng: random.Random, n_transactions: int, reveal_fraction: float, image_size: int):
+    n_reveals = int(n_transactions * reveal_fraction)
+    _, stream = make_mempool_mix(rng, n_transactions - n_reveals, rbf_fraction=0.3)
+    for i in range(n_reveals):
+        kind = i % 10
+        if kind < 7:
+            stream.append(make_reveal(rng, b"text/plain;charset=utf-8", BRC20_MINT % rng.choice(TICKERS)))
+        elif kind < 9:
+            stream.append(make_reveal(rng, b"text/plain;charset=utf-8", b"gm " * 20))
+        else:
+            stream.append(make_reveal(rng, b"image/png", bytes(rng.getrandbits(8) for _ in range(image_size))))
+    rng.shuffle(stream)
+    return [tx.serialize() for tx in stream]
+
+
+def deserialize_all(raws):
+    found = 0
+    for raw in raws:
+        tx = CTransaction.deserialize(raw)
+        for txin_witness in tx.wit.vtxinwit:
+            if any(find_inscription(item) is not None for item in txin_witness.scriptWitness.stack):
+                found += 1
+                break
+    return found
+
+
+def scan_and_classify(raws):
+    return sum(classify(scan_transaction(raw)) is not None for raw in raws)
+
+
+def classify_scanned(scanned):
+    return sum(classify(tx) is not None for tx in scanned)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--transactions", type=int, default=20000)
+    parser.add_argument("--reveal-fraction", type=float, default=0.3)
+    parser.add_argument("--image-size", type=int, default=40_000)
+    parser.add_argument("--peak-rate", type=float, default=1000, help="rawtx per second to keep up with")
+    args = parser.parse_args()
+
+    raws = make_stream(random.Random(0), args.transactions, args.reveal_fraction, args.image_size)
+    scanned = [scan_transaction(raw) for raw in raws]
+    print(f"{len(raws)} rawtx, {sum(map(len, raws)) / 1e6:.1f} MB, {args.reveal_fraction:.0%} reveals")
+    print(f"{'':<34}{'found':>8}{'us/tx':>10}{'tx/s':>12}{'x peak':>9}")
+    for name, function, stream in (
+        ("deserialize + witness items", deserialize_all, raws),
+        ("scan + classify", scan_and_classify, raws),
+        ("classify (already scanned)", classify_scanned, scanned),
+    ):
+        start = time.perf_counter()
+        found = function(stream)
+        elapsed = time.perf_counter() - start
+        rate = len(stream) / elapsed
+        print(f"{name:<34}{found:>8}{elapsed / len(stream) * 1e6:>10.1f}{rate:>12.0f}{rate / args.peak_rate:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
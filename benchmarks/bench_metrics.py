@@ -0,0 +1,101 @@
+import argparse
+import random
+import tempfile
+import time
+
+from bitcoin.core import CBlock, CMutableTxIn, CMutableTxOut, CTransaction
+from bitcoin.rpc import Proxy
+
+from analyzer.prevout_cache import PrevoutCache
+from benchmarks.synthetic import make_consolidations, make_mempool_mix
+from encoding.dump_format import DumpRecord
+from networking.fake_rpc_server import FakeBitcoinRpcServer
+from networking.metrics import METRICS, Histogram
+from rebid_analysis import MempoolAnalyzer
+
+"""
+    Overhead of the stage instrumentation (networking/metrics.py) on the
+    analyzer: the cost of one timed observation (two perf_counter_ns calls
+    and a histogram record), times the observations made per record, against
+    the time the analyzer spends per record replaying a synthetic stream
+    (a mint storm within ordinary mempool traffic, a block every
+    --block-every records) against a zero-latency stand-in RPC server, so the
+    handler time is as small as it gets and the overhead as large.
+
+        python -m benchmarks.bench_metrics --groups 300 --mix 3000
+"""
+
+
+def observation_cost(iterations: int) -> float:
+    histogram = Histogram()
+    perf_counter_ns = time.perf_counter_ns
+    start = time.perf_counter()
+    for _ in range(iterations):
+        pass
+    empty = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(iterations):
+        begin = perf_counter_ns()
+        histogram.record(perf_counter_ns() - begin)
+    return (time.perf_counter() - start - empty) / iterations
+
+
+def make_records(args):
+    rng = random.Random(0)
+    parents, spends = make_consolidations(rng, args.groups, args.inputs, args.bumps)
+    mix_parents, mix = make_mempool_mix(rng, args.mix, rbf_fraction=0.3)
+    stream = spends + mix
+    rng.shuffle(stream)
+    records, blocks = [], []
+    for i, tx in enumerate(stream):
+        records.append(DumpRecord(b"rawtx", i, i * 1000, 1_700_000_000_000_000_000 + i * 1000, tx.serialize()))
+        if i % args.block_every == args.block_every - 1:
+            block = CBlock(vtx=[CTransaction([CMutableTxIn()], [CMutableTxOut(i)]), tx])
+            blocks.append(block)
+            records.append(DumpRecord(b"hashblock", i, i * 1000, 1_700_000_000_000_000_000 + i * 1000, block.GetHash()[::-1]))
+    return parents + mix_parents, blocks, records
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--groups", type=int, default=300)
+    parser.add_argument("--inputs", type=int, default=3)
+    parser.add_argument("--bumps", type=int, default=4)
+    parser.add_argument("--mix", type=int, default=3000, help="ordinary mempool transactions around the storm")
+    parser.add_argument("--block-every", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    cost = observation_cost(args.iterations)
+    parents, blocks, records = make_records(args)
+    with FakeBitcoinRpcServer() as server, tempfile.TemporaryDirectory() as tmp_dir:
+        for parent in parents:
+            server.add_transaction(parent)
+        analyzer = MempoolAnalyzer(tmp_dir, client=Proxy(service_url=server.url), prevout_cache=PrevoutCache())
+        analyzer.output_file_path = tmp_dir + "/out.rebid"
+        server.block_count = analyzer.current_block
+        for block in blocks:
+            # served by getblock when its hashblock record is replayed
+            server.add_block(block)
+            server.block_count -= 1
+        METRICS.drain()
+        start = time.perf_counter()
+        for record in records:
+            if record.topic == b"hashblock":
+                server.block_count += 1
+            analyzer.process_line(record)
+        analyzer.flush_pending_transactions()
+        elapsed = time.perf_counter() - start
+        analyzer.output_store.close()
+    drained = METRICS.drain()
+    observations = sum(count for _, count, _, _ in drained["histograms"].values())
+
+    print(f"{len(records)} records, {len(blocks)} blocks")
+    print(f"one observation (2 x perf_counter_ns + record): {cost * 1e9:.0f} ns")
+    print(f"handler time per record:                        {elapsed / len(records) * 1e6:.1f} us")
+    print(f"observations per record:                        {observations / len(records):.2f}")
+    print(f"instrumentation overhead:                       {observations * cost / elapsed:.2%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import argparse
+import random
+import time
+from typing import Dict, List, Optional
+
+from bitcoin.core import CTransaction, b2lx
+from bitcoin.rpc import Proxy, unhexlify_str
+
+from analyzer.prevout_resolver import PrevoutResolver
+from benchmarks.synthetic import make_consolidations
+from networking.fake_rpc_server import FakeBitcoinRpcServer
+
+"""
+    RPC payload and latency per resolved input: parents fetched verbose and
+    deserialized into CTransactions (the previous behaviour) against the
+    compact hex form scanned locally by PrevoutResolver, against the local
+    stand-in RPC server. Its verbose answers decode inputs and outputs like
+    bitcoind, so the byte counts are representative.
+
+        python -m benchmarks.bench_prevout_payload --inputs 50 --latency 0.001
+"""
+
+
+# The previous PrevoutResolver._fetch_chunk, kept here as the baseline
+def fetch_verbose(client: Proxy, tx_hashes: List[bytes]) -> Dict[bytes, Optional[CTransaction]]:
+    calls = [
+        {'version': '1.1', 'method': 'getrawtransaction', 'params': [b2lx(tx_hash), 1], 'id': i}
+        for i, tx_hash in enumerate(tx_hashes)
+    ]
+    results: Dict[bytes, Optional[CTransaction]] = {}
+    for response in client._batch(calls):
+        result = response['result']
+        results[tx_hashes[response['id']]] = CTransaction.deserialize(unhexlify_str(result['hex'])) if result else None
+    return results
+
+
+def run(server: FakeBitcoinRpcServer, spends, verbose: bool):
+    client = Proxy(service_url=server.url)
+    resolver = PrevoutResolver(client)
+    server.reset_counters()
+    resolved = 0
+    start = time.perf_counter()
+    for tx in spends:
+        tx_hashes = [input.prevout.hash for input in tx.vin]
+        parents = fetch_verbose(client, tx_hashes) if verbose else resolver.fetch(tx_hashes)
+        # what the analyzer reads from a parent
+        resolved += sum(parents[input.prevout.hash].vout[input.prevout.n].nValue > 0 for input in tx.vin)
+    elapsed = time.perf_counter() - start
+    client.close()
+    return resolved, server.bytes_sent, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--transactions", type=int, default=40)
+    parser.add_argument("--inputs", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.001, help="seconds added to every HTTP round-trip")
+    args = parser.parse_args()
+
+    parents, spends = make_consolidations(random.Random(0), args.transactions, args.inputs)
+    with FakeBitcoinRpcServer(latency=args.latency) as server:
+        for parent in parents:
+            server.add_transaction(parent)
+
+        print(f"{len(spends)} transactions x {args.inputs} inputs, {args.latency * 1000:.1f} ms per round-trip")
+        print(f"{'mode':<24}{'bytes/input':>14}{'us/input':>12}")
+        for label, verbose in (("verbose (before)", True), ("compact, scanned", False)):
+            resolved, bytes_sent, elapsed = run(server, spends, verbose)
+            print(f"{label:<24}{bytes_sent / resolved:>14.0f}{elapsed / resolved * 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import argparse
+import random
+import tempfile
+import time
+
+from bitcoin.rpc import Proxy
+
+from analyzer.prevout_cache import PrevoutCache
+from analyzer.prevout_resolver import PrevoutResolver
+from benchmarks.synthetic import make_consolidations
+from networking.fake_rpc_server import FakeBitcoinRpcServer
+from rebid_analysis import MempoolAnalyzer
+
+"""
+    Compares serial prevout lookups (one round-trip per parent, the previous
+    behaviour) with batched resolution, per transaction and per micro-batch
+    window, against the local stand-in RPC server.
+
+        python -m benchmarks.bench_prevout_resolution --inputs 50 --latency 0.001
+"""
+
+
+def run(server: FakeBitcoinRpcServer, spends, batch_size: int, batch_window: int):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        client = Proxy(service_url=server.url)
+        analyzer = MempoolAnalyzer(tmp_dir, client=client, batch_window=batch_window, prevout_cache=PrevoutCache())
+        analyzer.resolver = PrevoutResolver(client, max_batch_size=batch_size)
+        server.reset_counters()
+        start = time.perf_counter()
+        for i, tx in enumerate(spends):
+            analyzer.queue_transaction(tx, float(i))
+        analyzer.flush_pending_transactions()
+        elapsed = time.perf_counter() - start
+        client.close()
+    return server.http_requests, server.rpc_calls, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--transactions", type=int, default=40)
+    parser.add_argument("--inputs", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.001, help="seconds added to every HTTP round-trip")
+    parser.add_argument("--window", type=int, default=8)
+    args = parser.parse_args()
+
+    parents, spends = make_consolidations(random.Random(0), args.transactions, args.inputs)
+    with FakeBitcoinRpcServer(latency=args.latency) as server:
+        for parent in parents:
+            server.add_transaction(parent)
+
+        print(f"{len(spends)} transactions x {args.inputs} inputs, {args.latency * 1000:.1f} ms per round-trip")
+        print(f"{'mode':<28}{'round-trips/tx':>16}{'rpc calls/tx':>14}{'ms/tx':>10}")
+        for label, batch_size, window in (
+            ("serial (before)", 1, 1),
+            ("batched per transaction", 500, 1),
+            (f"batched window={args.window}", 500, args.window),
+        ):
+            round_trips, calls, elapsed = run(server, spends, batch_size, window)
+            n = len(spends)
+            print(f"{label:<28}{round_trips / n:>16.2f}{calls / n:>14.2f}{elapsed / n * 1000:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
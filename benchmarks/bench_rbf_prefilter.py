@@ -0,0 +1,58 @@
+import argparse
+import random
+import tempfile
+import time
+
+from bitcoin.rpc import Proxy
+
+from analyzer.prevout_cache import PrevoutCache
+from benchmarks.synthetic import make_mempool_mix
+from networking.fake_rpc_server import FakeBitcoinRpcServer
+from encoding.dump_format import DumpRecord
+from networking.zmq_handler.zmq_sub import handle_frame
+from rebid_analysis import MempoolAnalyzer
+
+"""
+    Per-message cost of the rawtx path with and without the RBF pre-filter,
+    from raw ZMQ frames to MempoolAnalyzer, on a synthetic mempool where most
+    transactions do not signal replaceability.
+
+        python -m benchmarks.bench_rbf_prefilter --rbf-fraction 0.05
+"""
+
+
+def run(server: FakeBitcoinRpcServer, frames, use_filter: bool):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        client = Proxy(service_url=server.url)
+        analyzer = MempoolAnalyzer(tmp_dir, client=client, prevout_cache=PrevoutCache())
+        message_filter = analyzer.accepts_message if use_filter else None
+        start = time.process_time()
+        for record in frames:
+            # same steps as a ZMQHandler worker, minus the socket and queue
+            handle_frame(record, analyzer, message_filter)
+        analyzer.flush_pending_transactions()
+        elapsed = time.process_time() - start
+        client.close()
+    return elapsed, analyzer.rbf_filter
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--transactions", type=int, default=20000)
+    parser.add_argument("--rbf-fraction", type=float, default=0.05)
+    args = parser.parse_args()
+
+    parents, spends = make_mempool_mix(random.Random(0), args.transactions, args.rbf_fraction)
+    frames = [DumpRecord(b"rawtx", i, time.monotonic_ns(), time.time_ns(), tx.serialize()) for i, tx in enumerate(spends)]
+    with FakeBitcoinRpcServer() as server:
+        for parent in parents:
+            server.add_transaction(parent)
+        print(f"{len(frames)} rawtx messages, {args.rbf_fraction:.0%} signal RBF")
+        for label, use_filter in (("without pre-filter", False), ("with pre-filter", True)):
+            elapsed, rbf_filter = run(server, frames, use_filter)
+            hit_rate = f"  filter hit rate {rbf_filter.hit_rate:.1%}" if use_filter else ""
+            print(f"{label:<22}{elapsed / len(frames) * 1e6:>10.2f} us CPU/message{hit_rate}")
+
+
+if __name__ == "__main__":
+    main()
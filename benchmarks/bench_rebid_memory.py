@@ -0,0 +1,90 @@
+import argparse
+import gc
+import random
+import tracemalloc
+from dataclasses import dataclass, field
+from typing import Callable, List
+
+from bitcoin.core import CTransaction
+
+from benchmarks.synthetic import make_consolidations
+from encoding.tx_scanner import scan_transaction
+from rebid_analysis import TransactionData
+
+"""
+    Memory held per tracked rebid by the previous TransactionData (a list of
+    full CTransaction objects plus lists of fees and timestamps) and by the
+    column-wise one (typed arrays, latest replacement only).
+
+        python -m benchmarks.bench_rebid_memory --groups 2000 --bumps 20
+"""
+
+
+@dataclass
+class ListTransactionData:
+    txs: List[CTransaction]
+    gas_fees: List[int] = field(default_factory=list)
+    timestamps: List[float] = field(default_factory=list)
+    key: str = ""
+    last_block: int = 0
+
+    def add_update(self, tx: CTransaction, gas_fee: int, timestamp: float):
+        self.txs.append(tx)
+        self.gas_fees.append(gas_fee)
+        self.timestamps.append(timestamp)
+
+
+def track_lists(histories: List[List[bytes]]) -> list:
+    groups = []
+    for group, bodies in enumerate(histories):
+        tx_data = ListTransactionData(txs=[], key=str(group))
+        for bump, body in enumerate(bodies):
+            tx_data.add_update(CTransaction.deserialize(body), 1_000 * (bump + 1), 1705142899.0 + bump * 0.25)
+        groups.append(tx_data)
+    return groups
+
+
+def track_columns(histories: List[List[bytes]]) -> list:
+    groups = []
+    for group, bodies in enumerate(histories):
+        tx_data = TransactionData(key=str(group))
+        for bump, body in enumerate(bodies):
+            tx_data.add_update(scan_transaction(body), 1_000 * (bump + 1), 1705142899.0 + bump * 0.25)
+        groups.append(tx_data)
+    return groups
+
+
+def measure(track: Callable[[List[List[bytes]]], list], histories: List[List[bytes]]) -> int:
+    gc.collect()
+    tracemalloc.start()
+    groups = track(histories)
+    gc.collect()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del groups
+    return retained
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--groups", type=int, default=2000)
+    parser.add_argument("--bumps", type=int, default=20)
+    parser.add_argument("--inputs", type=int, default=2)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    _, spends = make_consolidations(rng, args.groups, args.inputs, args.bumps)
+    bodies = [tx.serialize() for tx in spends]
+    histories = [bodies[i:i + args.bumps] for i in range(0, len(bodies), args.bumps)]
+    rebids = len(bodies)
+    print(f"{args.groups} groups x {args.bumps} rebids, {args.inputs} inputs, {sum(map(len, bodies)) / rebids:.0f} bytes per transaction")
+
+    results = {}
+    for label, track in (("list of CTransaction", track_lists), ("typed columns", track_columns)):
+        results[label] = measure(track, histories)
+        print(f"{label:<24}{results[label] / rebids:>10.1f} bytes/rebid{results[label] / 2**20:>10.1f} MiB")
+    print(f"reduction {results['list of CTransaction'] / results['typed columns']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import argparse
+import random
+import threading
+import time
+
+from bitcoin.core import b2lx
+from bitcoin.rpc import Proxy
+
+from benchmarks.synthetic import make_consolidations
+from networking.fake_rpc_server import FakeBitcoinRpcServer
+from networking.rpc_client import PooledProxy
+
+"""
+    Parent lookups of concurrent rebids against the local stand-in RPC
+    server: a new Proxy per call (one TCP connection each, like the previous
+    BitcoinRpc), one blocking Proxy per thread, and one PooledProxy shared by
+    all threads, which keeps its connections alive and coalesces identical
+    calls in flight. Every thread looks up the parents of the same bids, as
+    the rebids of one group do.
+
+        python -m benchmarks.bench_rpc_client --threads 8 --latency 0.002
+"""
+
+
+def lookups(spends):
+    return [(b2lx(input.prevout.hash), 0) for tx in spends for input in tx.vin]
+
+
+def run(server: FakeBitcoinRpcServer, calls, threads: int, mode: str):
+    shared = PooledProxy(service_url=server.url) if mode == "pooled" else None
+
+    def worker():
+        client = shared or (Proxy(service_url=server.url) if mode == "per thread" else None)
+        for txid, verbose in calls:
+            proxy = client or Proxy(service_url=server.url)
+            proxy.call("getrawtransaction", txid, verbose)
+            if client is None:
+                proxy.close()
+
+    server.reset_counters()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return time.perf_counter() - start, server.rpc_calls, server.connections
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--transactions", type=int, default=10)
+    parser.add_argument("--inputs", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.002, help="seconds added to every HTTP round-trip")
+    args = parser.parse_args()
+
+    parents, spends = make_consolidations(random.Random(0), args.transactions, args.inputs)
+    calls = lookups(spends)
+    with FakeBitcoinRpcServer(latency=args.latency) as server:
+        for parent in parents:
+            server.add_transaction(parent)
+
+        print(f"{args.threads} threads x {len(calls)} lookups, {args.latency * 1000:.1f} ms per round-trip")
+        print(f"{'mode':<16}{'seconds':>10}{'rpc calls':>12}{'connections':>13}")
+        for mode in ("per call", "per thread", "pooled"):
+            elapsed, rpc_calls, connections = run(server, calls, args.threads, mode)
+            print(f"{mode:<16}{elapsed:>10.2f}{rpc_calls:>12}{connections:>13}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import argparse
+import filecmp
+import os
+import random
+import tempfile
+import time
+from functools import partial
+
+from bitcoin.core import CBlock, CMutableTxIn, CMutableTxOut, CTransaction, b2lx
+from bitcoin.rpc import Proxy
+
+from analyzer.prevout_cache import PrevoutCache
+from analyzer.sharded_analyzer import ShardedMempoolAnalyzer
+from benchmarks.synthetic import make_consolidations
+from networking.fake_rpc_server import FakeBitcoinRpcServer
+from rebid_analysis import MempoolAnalyzer
+
+"""
+    Throughput of the single-process analyzer against the sharded one on a
+    synthetic mint storm (consolidations rebid several times, a block every
+    --block-every transactions), against the local stand-in RPC server. Also
+    checks that every run writes the same csv.
+
+        python -m benchmarks.bench_sharded_analyzer --shards 1 2 4 --latency 0.001
+"""
+
+
+def run(server: FakeBitcoinRpcServer, spends, blocks, shards: int, output_path: str) -> float:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if shards > 1:
+            analyzer = ShardedMempoolAnalyzer(tmp_dir, shards, partial(Proxy, service_url=server.url))
+        else:
+            analyzer = MempoolAnalyzer(tmp_dir, client=Proxy(service_url=server.url), prevout_cache=PrevoutCache())
+        analyzer.output_file_path = output_path
+        server.block_count = analyzer.current_block
+        start = time.perf_counter()
+        for i, tx in enumerate(spends):
+            # scanned, like the rawtx path
+            if analyzer.rbf_filter.accepts(tx.serialize()):
+                analyzer.queue_transaction(tx, float(i))
+            if i in blocks:
+                server.add_block(blocks[i])
+                analyzer.connect_block(b2lx(blocks[i].GetHash()))
+        analyzer.flush_pending_transactions()
+        if shards > 1:
+            analyzer.close()
+        elapsed = time.perf_counter() - start
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--groups", type=int, default=400)
+    parser.add_argument("--inputs", type=int, default=4)
+    parser.add_argument("--bumps", type=int, default=4)
+    parser.add_argument("--block-every", type=int, default=400)
+    parser.add_argument("--latency", type=float, default=0.001, help="seconds added to every HTTP round-trip")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    parents, spends = make_consolidations(rng, args.groups, args.inputs, args.bumps)
+    rng.shuffle(spends)
+    # each block confirms the transaction just before it
+    blocks = {
+        i: CBlock(vtx=[CTransaction([CMutableTxIn()], [CMutableTxOut(i)]), spends[i - 1]])
+        for i in range(args.block_every - 1, len(spends), args.block_every)
+    }
+    print(f"{len(spends)} transactions, {args.groups} groups x {args.bumps} rebids, {len(blocks)} blocks, {args.latency * 1000:.1f} ms per round-trip, {os.cpu_count()} cpus")
+    with tempfile.TemporaryDirectory() as out_dir:
+        outputs = []
+        for shards in args.shards:
+            with FakeBitcoinRpcServer(latency=args.latency) as server:
+                for parent in parents:
+                    server.add_transaction(parent)
+                output_path = os.path.join(out_dir, f"{shards}.csv")
+                elapsed = run(server, spends, blocks, shards, output_path)
+            outputs.append(output_path)
+            print(f"shards={shards:<4}{len(spends) / elapsed:>10.0f} tx/s{elapsed:>10.2f} s")
+        print("same output:", all(filecmp.cmp(outputs[0], output, shallow=False) for output in outputs[1:]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from bitcoin.rpc import Proxy
+
+from analyzer.prevout_cache import PrevoutCache
+from analyzer.snapshot import SnapshotWriter, capture
+from benchmarks.synthetic import make_consolidations
+from encoding.dump_format import BinaryDumpWriter, DumpRecord
+from networking.fake_rpc_server import FakeBitcoinRpcServer
+from rebid_analysis import MempoolAnalyzer
+
+"""
+    Warm restart from a snapshot (analyzer/snapshot.py) against a cold start
+    that replays the whole dump to rebuild the same state: the stall of
+    capturing a snapshot in the handler thread, the background write and its
+    size, the restart-to-ready time of each, and catching up on the
+    --gap records received after the snapshot was taken.
+
+        python -m benchmarks.bench_snapshot --groups 5000 --bumps 5 --gap 2000
+"""
+
+
+def analyzer(directory: str, server: FakeBitcoinRpcServer, **kwargs) -> MempoolAnalyzer:
+    return MempoolAnalyzer(directory, client=Proxy(service_url=server.url), prevout_cache=PrevoutCache(), **kwargs)
+
+
+def replay(target: MempoolAnalyzer, records):
+    for record in records:
+        target.note_message(record.topic.decode(), record.sequence, record.wall_ns)
+        target.process_line(record)
+    target.flush_pending_transactions()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--groups", type=int, default=5000)
+    parser.add_argument("--bumps", type=int, default=5)
+    parser.add_argument("--inputs", type=int, default=2)
+    parser.add_argument("--gap", type=int, default=2000, help="records received after the snapshot")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    parents, spends = make_consolidations(rng, args.groups, args.inputs, args.bumps)
+    rng.shuffle(spends)
+    records = [DumpRecord(b"rawtx", i, i, 1_700_000_000_000_000_000 + i * 1000, tx.serialize()) for i, tx in enumerate(spends)]
+    before, gap = records[:len(records) - args.gap], records[len(records) - args.gap:]
+
+    with tempfile.TemporaryDirectory() as directory, FakeBitcoinRpcServer() as server:
+        for parent in parents:
+            server.add_transaction(parent)
+        dump_path, snapshot_path = os.path.join(directory, "dump.bin"), os.path.join(directory, "analyzer.snapshot")
+        writer = BinaryDumpWriter(dump_path, flush_every_record=False)
+        for record in records:
+            writer.write(record)
+        writer.close()
+
+        running = analyzer(directory, server)
+        start = time.perf_counter()
+        replay(running, before)
+        cold = time.perf_counter() - start
+        print(f"{len(records)} records, {len(before)} before the snapshot: {len(running.transactions)} groups, {len(running.prevout_cache)} cached prevouts")
+
+        start = time.perf_counter()
+        parts = capture(running)
+        stall = time.perf_counter() - start
+        snapshot_writer = SnapshotWriter(snapshot_path)
+        snapshot_writer.submit(parts)
+        snapshot_writer.flush()
+        snapshot_writer.close()
+        print(f"capture (handler thread)     {stall * 1e3:>9.1f} ms")
+        print(f"write (background)           {snapshot_writer.last_seconds * 1e3:>9.1f} ms, {snapshot_writer.last_size / 1e6:.1f} MB")
+
+        start = time.perf_counter()
+        warm = analyzer(directory, server, snapshot_path=snapshot_path, snapshot_interval=0)
+        restored = time.perf_counter() - start
+        start = time.perf_counter()
+        warm.catch_up(dump_path)
+        caught_up = time.perf_counter() - start
+        replay(running, gap)
+        print(f"\n{'ready to handle the stream':<29}{'time':>9}")
+        print(f"{'cold start (replay the dump)':<29}{cold:>9.2f} s")
+        print(f"{'restore snapshot':<29}{restored:>9.2f} s")
+        print(f"{'+ catch up on the gap':<29}{caught_up:>9.2f} s")
+        print(f"same groups after the gap: {warm.transactions.keys() == running.transactions.keys()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import argparse
+import random
+import time
+from typing import List
+
+from bitcoin.core import CTransaction
+
+from benchmarks.synthetic import make_consolidations
+from encoding.decode import RawTransaction, decode
+from encoding.dump_format import BinaryDumpReader, is_binary_dump
+from encoding.tx_scanner import scan_transaction
+
+"""
+    Compares the previous rawtx path (hex body, full CTransaction
+    deserialization) with the zero-copy scanner, extracting the fields the
+    rebid analysis reads: outpoints, nSequence, output values and txid.
+
+        python -m benchmarks.bench_tx_scanner data/mempool_drop.bin
+"""
+
+
+def load_corpus(path: str) -> List[bytes]:
+    bodies = []
+    if is_binary_dump(path):
+        with BinaryDumpReader(path) as reader:
+            bodies = [bytes(record.body) for record in reader if record.topic == b"rawtx"]
+    else:
+        with open(path, "r") as file:
+            for line in file:
+                if line.startswith("RawTransaction"):
+                    bodies.append(bytes.fromhex(decode(line.strip()).raw_tx))
+    return bodies
+
+
+def synthetic_corpus(size: int) -> List[bytes]:
+    rng = random.Random(0)
+    bodies = []
+    while len(bodies) < size:
+        parents, spends = make_consolidations(rng, 20, rng.randrange(1, 6))
+        bodies.extend(tx.serialize() for tx in parents + spends)
+    return bodies[:size]
+
+
+def full_path(bodies: List[bytes]):
+    for body in bodies:
+        tx = RawTransaction(0, body.hex()).deserialize()
+        [(txin.prevout.hash, txin.prevout.n, txin.nSequence) for txin in tx.vin]
+        [txout.nValue for txout in tx.vout]
+        tx.GetTxid()
+
+
+def scan_path(bodies: List[bytes]):
+    for body in bodies:
+        tx = scan_transaction(body)
+        [(txin.prevout.hash, txin.prevout.n, txin.nSequence) for txin in tx.vin]
+        [txout.nValue for txout in tx.vout]
+        tx.GetTxid()
+
+
+def check(bodies: List[bytes]):
+    for body in bodies:
+        full, scanned = CTransaction.deserialize(body), scan_transaction(body)
+        assert [(i.prevout.hash, i.prevout.n, i.nSequence) for i in full.vin] == [(i.prevout.hash, i.prevout.n, i.nSequence) for i in scanned.vin]
+        assert [o.nValue for o in full.vout] == [o.nValue for o in scanned.vout]
+        assert full.GetTxid() == scanned.GetTxid()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dump", nargs="?", help="text or binary dump to use as corpus, synthetic transactions otherwise")
+    parser.add_argument("--size", type=int, default=20000)
+    args = parser.parse_args()
+
+    bodies = load_corpus(args.dump) if args.dump else synthetic_corpus(args.size)
+    check(bodies)
+    print(f"{len(bodies)} transactions, {sum(map(len, bodies)) / len(bodies):.0f} bytes on average")
+    timings = {}
+    for label, run in (("hex + CTransaction.deserialize", full_path), ("scan_transaction", scan_path)):
+        start = time.perf_counter()
+        run(bodies)
+        timings[label] = (time.perf_counter() - start) / len(bodies)
+        print(f"{label:<32}{timings[label] * 1e6:>10.2f} us/tx")
+    print(f"speedup {timings['hex + CTransaction.deserialize'] / timings['scan_transaction']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
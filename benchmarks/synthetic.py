@@ -0,0 +1,134 @@
+import random
+from typing import Dict, List, Tuple
+
+from bitcoin.core import CBlock, COutPoint, CMutableTransaction, CMutableTxIn, CMutableTxOut, CTransaction, CTxInWitness, CTxWitness
+from bitcoin.core.script import OP_0, OP_CHECKSIG, OP_ENDIF, OP_FALSE, OP_IF, CScript, CScriptWitness
+
+from networking.fake_zmq_publisher import Schedule
+
+"""
+    Synthetic transaction builders shared by the benchmarks. Transactions are
+    shaped like segwit v0 spends (empty scriptSig, two-item witness) so their
+    sizes are close to what the rawtx topic delivers.
+"""
+
+RBF_SEQUENCE = 0xfffffffd
+FINAL_SEQUENCE = 0xffffffff
+
+
+def random_bytes(rng: random.Random, size: int) -> bytes:
+    return bytes(rng.getrandbits(8) for _ in range(size))
+
+
+def p2wpkh_script(rng: random.Random) -> CScript:
+    return CScript(b'\x00\x14' + random_bytes(rng, 20))
+
+
+def make_parent(rng: random.Random, n_outputs: int, value: int = 100_000) -> CTransaction:
+    txin = CMutableTxIn(COutPoint(random_bytes(rng, 32), rng.randrange(4)), nSequence=FINAL_SEQUENCE)
+    txouts = [CMutableTxOut(value, p2wpkh_script(rng)) for _ in range(n_outputs)]
+    return CTransaction.from_tx(CMutableTransaction([txin], txouts, nVersion=2))
+
+
+def make_spend(rng: random.Random, prevouts: List[Tuple[bytes, int]], output_value: int, sequence: int = RBF_SEQUENCE, witness: bool = True) -> CTransaction:
+    txins = [CMutableTxIn(COutPoint(prevout_hash, n), nSequence=sequence) for prevout_hash, n in prevouts]
+    txouts = [CMutableTxOut(output_value, p2wpkh_script(rng))]
+    tx_witness = CTxWitness()
+    if witness:
+        tx_witness = CTxWitness([CTxInWitness(CScriptWitness([random_bytes(rng, 71), random_bytes(rng, 33)])) for _ in txins])
+    return CTransaction(txins, txouts, nLockTime=0, nVersion=2, witness=tx_witness)
+
+
+# Tapscript revealing an inscription: <pubkey> OP_CHECKSIG then the envelope,
+# the body in pushes of at most 520 bytes
+def inscription_script(rng: random.Random, content_type: bytes, body: bytes) -> CScript:
+    chunks = [body[i:i + 520] for i in range(0, len(body), 520)]
+    return CScript([random_bytes(rng, 32), OP_CHECKSIG, OP_FALSE, OP_IF, b"ord", 1, content_type, OP_0] + chunks + [OP_ENDIF])
+
+
+def make_reveal(rng: random.Random, content_type: bytes, body: bytes, sequence: int = RBF_SEQUENCE) -> CTransaction:
+    """Builds a one-input taproot script-path spend carrying an inscription."""
+    txin = CMutableTxIn(COutPoint(random_bytes(rng, 32), 0), nSequence=sequence)
+    txout = CMutableTxOut(546, CScript(b'\x51\x20' + random_bytes(rng, 32)))
+    witness = CScriptWitness([random_bytes(rng, 64), inscription_script(rng, content_type, body), b'\xc0' + random_bytes(rng, 32)])
+    return CTransaction([txin], [txout], nLockTime=0, nVersion=2, witness=CTxWitness([CTxInWitness(witness)]))
+
+
+def make_consolidations(rng: random.Random, n_transactions: int, n_inputs: int, bumps: int = 1) -> Tuple[List[CTransaction], List[CTransaction]]:
+    """Builds parents plus `n_transactions` consolidations of `n_inputs` inputs,
+    each rebid `bumps` times with a lower output value (higher fee)."""
+    parents: List[CTransaction] = []
+    spends: List[CTransaction] = []
+    for _ in range(n_transactions):
+        group_parents = [make_parent(rng, 2) for _ in range(n_inputs)]
+        parents.extend(group_parents)
+        prevouts = [(parent.GetTxid(), rng.randrange(2)) for parent in group_parents]
+        total = sum(parent.vout[n].nValue for parent, (_, n) in zip(group_parents, prevouts))
+        for bump in range(bumps):
+            spends.append(make_spend(rng, prevouts, total - 1_000 * (bump + 1)))
+    return parents, spends
+
+
+def make_mempool_mix(rng: random.Random, n_transactions: int, rbf_fraction: float) -> Tuple[List[CTransaction], List[CTransaction]]:
+    """Builds one- to three-input spends of which roughly `rbf_fraction` signal
+    replaceability, like the mempool outside of mint storms."""
+    parents: List[CTransaction] = []
+    spends: List[CTransaction] = []
+    for _ in range(n_transactions):
+        tx_parents = [make_parent(rng, 2) for _ in range(rng.randrange(1, 4))]
+        parents.extend(tx_parents)
+        prevouts = [(parent.GetTxid(), 0) for parent in tx_parents]
+        sequence = RBF_SEQUENCE if rng.random() < rbf_fraction else FINAL_SEQUENCE
+        spends.append(make_spend(rng, prevouts, 100_000 * len(prevouts) - 500, sequence=sequence))
+    return parents, spends
+
+
+def make_rbf_storm(rng: random.Random, n_groups: int, bumps: int, duration: float, bump_interval: float,
+                   background_rate: float, block_interval: float) -> Tuple[List[CTransaction], Schedule, Dict[bytes, CBlock]]:
+    """Builds the rawtx/hashblock traffic of a mint storm lasting `duration`
+    seconds: `n_groups` groups open at random times in its first 80% and are
+    bumped `bumps` times, on average every `bump_interval` seconds, over
+    `background_rate` non-RBF transactions a second. A block every
+    `block_interval` seconds confirms the latest bid of the groups done
+    bumping. Returns the confirmed parents the bids spend, the schedule, and
+    the blocks by their hashblock body."""
+    parents = [make_parent(rng, 2) for _ in range(n_groups)]
+    events: List[Tuple[float, int, int]] = []
+    for group in range(n_groups):
+        at = rng.uniform(0, duration * 0.8)
+        for bump in range(bumps + 1):
+            events.append((at, group, bump))
+            at += rng.expovariate(1 / bump_interval)
+    events.sort()
+    block_times = [block_interval * (i + 1) for i in range(int(duration / block_interval))]
+    schedule: Schedule = []
+    latest: Dict[int, CTransaction] = {}
+    done_at = {group: at for at, group, _ in events}
+    blocks: Dict[bytes, CBlock] = {}
+    previous = b"\0" * 32
+    confirmed = set()
+    event = 0
+    for block_time in block_times + [float("inf")]:
+        while event < len(events) and events[event][0] < block_time:
+            at, group, bump = events[event]
+            event += 1
+            if group in confirmed:
+                continue
+            bid = make_spend(rng, [(parents[group].GetTxid(), 0)], 99_000 - 250 * bump)
+            latest[group] = bid
+            schedule.append((int(at * 1e9), b"rawtx", bid.serialize()))
+        if block_time == float("inf"):
+            break
+        done = [group for group in latest if group not in confirmed and done_at[group] < block_time]
+        coinbase = CTransaction([CMutableTxIn()], [CMutableTxOut(len(blocks))])
+        block = CBlock(hashPrevBlock=previous, vtx=[coinbase] + [latest[group] for group in done])
+        confirmed.update(done)
+        previous = block.GetHash()
+        # hashblock sends the hash in display order
+        blocks[previous[::-1]] = block
+        schedule.append((int(block_time * 1e9), b"hashblock", previous[::-1]))
+    for _ in range(int(background_rate * duration)):
+        spend = make_spend(rng, [(random_bytes(rng, 32), 0)], 50_000, sequence=FINAL_SEQUENCE)
+        schedule.append((int(rng.uniform(0, duration) * 1e9), b"rawtx", spend.serialize()))
+    schedule.sort(key=lambda entry: entry[0])
+    return parents, schedule, blocks
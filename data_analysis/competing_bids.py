@@ -0,0 +1,200 @@
+import argparse
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from encoding.rebid_store import RebidStoreReader, is_rebid_store
+
+"""
+    Competing bids in the rebid analysis output, without per-row loops.
+
+    Two bids compete when they were written for the same block, belong to
+    different transactions and are close: gas fees at most `fee_threshold`
+    sats apart (competing_pairs, what get_block_df in mempool_rebid.ipynb
+    computes), or placed at most `time_window` seconds apart
+    (concurrent_pairs). The bids are sorted once by (block, value) and every
+    bid's window is found with two searchsorted calls, so a block costs
+    O(n log n + pairs) instead of a filter of the whole block per bid.
+
+    competing_clusters chains bids whose fees are within the threshold of
+    the next one in fee order, and keeps the chains with several
+    transactions. bump_stats gives per group (internalTransactionId, block)
+    the number of rebids, the fee increments and the bid velocity.
+
+        python -m data_analysis.competing_bids data/rebid_output.csv --fee-threshold 1 --top 10
+"""
+
+PAIR_COLUMNS = ['Transaction1', 'Transaction2', 'BlockId']
+
+
+# The csv output (current or legacy header) or a rebid store, timestamps as unix seconds
+def load_bids(path: str, canonical: bool = True) -> pd.DataFrame:
+    if is_rebid_store(path):
+        with RebidStoreReader(path) as reader:
+            df = pd.DataFrame(reader.columns(canonical=canonical))
+    else:
+        df = pd.read_csv(path)
+    # csvs written before the rename use externaltransactionId
+    return df.rename(columns={'externaltransactionId': 'externalTransactionId'})
+
+
+# Positions (i, j), i != j, of every pair of rows with the same group code and
+# values at most `width` apart, in the order of the rows of i then of j by value
+def window_pairs(groups: np.ndarray, values: np.ndarray, width: float) -> Tuple[np.ndarray, np.ndarray]:
+    n = len(values)
+    if n == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    order = np.lexsort((values, groups))
+    sorted_groups = groups[order]
+    sorted_values = values[order].astype(np.float64)
+    # one axis for all groups, spaced so that no window reaches the next group
+    low = sorted_values.min()
+    span = sorted_values.max() - low + 2 * width + 1
+    keys = sorted_groups * span + (sorted_values - low)
+    starts = np.searchsorted(keys, keys - width, side='left')
+    ends = np.searchsorted(keys, keys + width, side='right')
+    counts = ends - starts
+    first = np.repeat(np.arange(n), counts)
+    # the k-th pair of row i is (i, starts[i] + k)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    second = np.repeat(starts, counts) + offsets
+    keep = first != second
+    return order[first[keep]], order[second[keep]]
+
+
+def _pairs_frame(df: pd.DataFrame, first: np.ndarray, second: np.ndarray) -> pd.DataFrame:
+    txids = df['externalTransactionId'].to_numpy()
+    different = txids[first] != txids[second]
+    first, second = first[different], second[different]
+    # in row order, like the notebook's nested iterrows
+    order = np.lexsort((second, first))
+    first, second = first[order], second[order]
+    return pd.DataFrame({
+        'Transaction1': txids[first],
+        'Transaction2': txids[second],
+        'BlockId': df['blockId'].to_numpy()[first],
+    }, columns=PAIR_COLUMNS)
+
+
+def _block_codes(df: pd.DataFrame) -> np.ndarray:
+    return pd.factorize(df['blockId'])[0].astype(np.int64)
+
+
+# Every ordered pair of bids of different transactions in the same block with
+# gas fees within fee_threshold, one row per pair of bids, as get_block_df
+def competing_pairs(df: pd.DataFrame, fee_threshold: float = 1) -> pd.DataFrame:
+    df = df.reset_index(drop=True)
+    first, second = window_pairs(_block_codes(df), df['gasFee'].to_numpy(), fee_threshold)
+    return _pairs_frame(df, first, second)
+
+
+# Time-window variant: bids of different transactions in the same block
+# placed at most time_window seconds apart, and with gas fees within
+# fee_threshold when one is given
+def concurrent_pairs(df: pd.DataFrame, time_window: float, fee_threshold: Optional[float] = None) -> pd.DataFrame:
+    df = df.reset_index(drop=True)
+    first, second = window_pairs(_block_codes(df), df['timestamp'].to_numpy(), time_window)
+    if fee_threshold is not None:
+        fees = df['gasFee'].to_numpy()
+        close = np.abs(fees[first] - fees[second]) <= fee_threshold
+        first, second = first[close], second[close]
+    return _pairs_frame(df, first, second)
+
+
+# Bids chained by fee gaps of at most fee_threshold within a block, for the
+# chains spanning at least min_transactions transactions
+def competing_clusters(df: pd.DataFrame, fee_threshold: float = 1, min_transactions: int = 2) -> pd.DataFrame:
+    ordered = df.sort_values(['blockId', 'gasFee'], kind='stable')
+    fees = ordered['gasFee'].to_numpy()
+    blocks = ordered['blockId'].to_numpy()
+    starts = np.ones(len(ordered), dtype=bool)
+    starts[1:] = (blocks[1:] != blocks[:-1]) | (np.diff(fees) > fee_threshold)
+    ordered = ordered.assign(cluster=np.cumsum(starts) - 1)
+    clusters = ordered.groupby('cluster', sort=True).agg(
+        blockId=('blockId', 'first'),
+        bids=('gasFee', 'size'),
+        transactions=('externalTransactionId', 'nunique'),
+        minFee=('gasFee', 'min'),
+        maxFee=('gasFee', 'max'),
+        firstBid=('timestamp', 'min'),
+        lastBid=('timestamp', 'max'),
+    )
+    return clusters[clusters['transactions'] >= min_transactions].reset_index(drop=True)
+
+
+# Per group: rebids, fee increments between consecutive bids and bid velocity
+def bump_stats(df: pd.DataFrame) -> pd.DataFrame:
+    ordered = df.sort_values(['blockId', 'internalTransactionId', 'timestamp'], kind='stable')
+    keys = ordered['internalTransactionId'].to_numpy()
+    blocks = ordered['blockId'].to_numpy()
+    fees = ordered['gasFee'].to_numpy()
+    same_group = np.zeros(len(ordered), dtype=bool)
+    same_group[1:] = (keys[1:] == keys[:-1]) & (blocks[1:] == blocks[:-1])
+    increments = np.zeros(len(ordered), dtype=np.float64)
+    increments[1:] = np.diff(fees)
+    increments[~same_group] = np.nan
+    ordered = ordered.assign(increment=increments, raised=(increments > 0), lowered=(increments < 0))
+    stats = ordered.groupby(['blockId', 'internalTransactionId'], sort=True).agg(
+        externalTransactionId=('externalTransactionId', 'last'),
+        bids=('gasFee', 'size'),
+        firstFee=('gasFee', 'first'),
+        lastFee=('gasFee', 'last'),
+        maxFee=('gasFee', 'max'),
+        meanIncrement=('increment', 'mean'),
+        maxIncrement=('increment', 'max'),
+        raises=('raised', 'sum'),
+        cuts=('lowered', 'sum'),
+        firstBid=('timestamp', 'first'),
+        lastBid=('timestamp', 'last'),
+    )
+    stats['bumps'] = stats['bids'] - 1
+    stats['totalIncrement'] = stats['lastFee'] - stats['firstFee']
+    duration = stats['lastBid'] - stats['firstBid']
+    stats['duration'] = duration
+    # rebids and sats per second over the life of the group, NaN for a single instant
+    stats['bumpsPerSecond'] = (stats['bumps'] / duration).where(duration > 0)
+    stats['feePerSecond'] = (stats['totalIncrement'] / duration).where(duration > 0)
+    if 'feeRate' in ordered.columns:
+        rates = ordered.groupby(['blockId', 'internalTransactionId'], sort=True)['feeRate']
+        stats['firstFeeRate'] = rates.first()
+        stats['lastFeeRate'] = rates.last()
+    return stats.reset_index()
+
+
+# Bids, transactions, competing pairs and clusters of every block
+def block_summary(df: pd.DataFrame, pairs: pd.DataFrame, clusters: pd.DataFrame) -> pd.DataFrame:
+    summary = df.groupby('blockId').agg(bids=('gasFee', 'size'), transactions=('externalTransactionId', 'nunique'))
+    summary['competingPairs'] = pairs.groupby('BlockId').size().reindex(summary.index, fill_value=0)
+    summary['clusters'] = clusters.groupby('blockId').size().reindex(summary.index, fill_value=0)
+    return summary.reset_index()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Competing bids per block in the rebid analysis output")
+    parser.add_argument("path", help="rebid store or csv output")
+    parser.add_argument("--fee-threshold", type=float, default=1, help="sats between the fees of competing bids")
+    parser.add_argument("--time-window", type=float, help="pair bids placed within this many seconds instead of by fee")
+    parser.add_argument("--block", type=int, action="append", help="only these blocks, can be repeated")
+    parser.add_argument("--pairs", metavar="CSV", help="write the competing pairs")
+    parser.add_argument("--clusters", metavar="CSV", help="write the competing clusters")
+    parser.add_argument("--bumps", metavar="CSV", help="write the per-group bump statistics")
+    parser.add_argument("--top", type=int, default=10, help="blocks with the most competing pairs to print")
+    args = parser.parse_args()
+
+    bids = load_bids(args.path)
+    if args.block:
+        bids = bids[bids['blockId'].isin(args.block)]
+    if args.time_window is not None:
+        pairs = concurrent_pairs(bids, args.time_window)
+    else:
+        pairs = competing_pairs(bids, args.fee_threshold)
+    clusters = competing_clusters(bids, args.fee_threshold)
+    bumps = bump_stats(bids)
+    for path, frame in ((args.pairs, pairs), (args.clusters, clusters), (args.bumps, bumps)):
+        if path:
+            frame.to_csv(path, index=False)
+    summary = block_summary(bids, pairs, clusters)
+    print(f"{len(bids)} bids in {len(summary)} blocks, {len(pairs)} competing pairs, {len(clusters)} clusters, {len(bumps)} groups")
+    print(summary.sort_values('competingPairs', ascending=False).head(args.top).to_string(index=False))
+    print(f"median bumps per group {bumps['bumps'].median():g}, median increment {bumps['meanIncrement'].median():.0f} sats")
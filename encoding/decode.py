@@ -1,6 +1,9 @@
+import struct
 from datetime import datetime
-from typing import Optional
+from typing import Optional, Union
 from bitcoin.core import CTransaction
+from encoding.dump_format import DumpRecord
+from encoding.tx_scanner import ScannedTransaction, scan_transaction
 
 # Examples:
 # TransactionHash(sequence=564091, tx_hash=662038688ad4727bcbc7d9f5fb3635279435ac83d86d28daa30a4e28aa78e52b)
@@ -8,7 +11,9 @@ from bitcoin.core import CTransaction
 
 
 class RawTransaction:
-    def __init__(self, sequence: int, raw_tx: str , ts: Optional[datetime] = None):
+    # raw_tx is hex when read from a text dump and raw bytes (possibly a
+    # memoryview into a mapped binary dump) when read from a binary one
+    def __init__(self, sequence: int, raw_tx: Union[str, bytes, memoryview], ts: Optional[datetime] = None):
         self.sequence = sequence
         self.raw_tx = raw_tx
         self.timestamp = ts
@@ -23,7 +28,18 @@ class RawTransaction:
         self.timestamp = datetime.strptime(ts.split("=")[1][:-1], '%Y-%m-%d %H:%M:%S.%f')
 
     def deserialize(self):
-        return CTransaction.deserialize(bytes.fromhex(self.raw_tx))
+        if isinstance(self.raw_tx, str):
+            return CTransaction.deserialize(bytes.fromhex(self.raw_tx))
+        return CTransaction.deserialize(self.raw_tx)
+
+    def raw_bytes(self) -> Union[bytes, memoryview]:
+        if isinstance(self.raw_tx, str):
+            return bytes.fromhex(self.raw_tx)
+        return self.raw_tx
+
+    # Reads only what the rebid analysis needs, see encoding/tx_scanner.py
+    def scan(self) -> ScannedTransaction:
+        return scan_transaction(self.raw_bytes())
 
 
 class TransactionHash:
@@ -38,7 +54,7 @@ class TransactionHash:
     def decode(self, encoded):
         sequence, raw_tx, ts = encoded.split(",")
         self.sequence = int(sequence.split("=")[1])
-        self.tx_hash = raw_tx.split("=")[1][:-1]
+        self.tx_hash = raw_tx.split("=")[1].rstrip(")")
         self.timestamp = datetime.strptime(ts.split("=")[1][:-1], '%Y-%m-%d %H:%M:%S.%f')
 
     def deserialize(self):
@@ -56,7 +72,7 @@ class BlockHash:
     def decode(self, encoded):
         sequence, raw_tx, ts = encoded.split(",")
         self.sequence = int(sequence.split("=")[1])
-        self.block_hash = raw_tx.split("=")[1][:-1]
+        self.block_hash = raw_tx.split("=")[1].rstrip(")")
         self.timestamp = datetime.strptime(ts.split("=")[1][:-1], '%Y-%m-%d %H:%M:%S.%f')
 
     def deserialize(self):
@@ -83,8 +99,27 @@ class SequenceHash:
         return self.tx_hash
 
 
-def decode(encoded: str):
-    if encoded.startswith("RawTransaction"):
+def decode_record(record: DumpRecord):
+    if record.topic == b"rawtx" or record.topic == b"recovered":
+        return RawTransaction(record.sequence, record.body, record.timestamp)
+    elif record.topic == b"hashtx":
+        return TransactionHash(record.sequence, bytes(record.body).hex(), record.timestamp)
+    elif record.topic == b"hashblock":
+        return BlockHash(record.sequence, bytes(record.body).hex(), record.timestamp)
+    elif record.topic == b"sequence":
+        body = bytes(record.body)
+        mempool_sequence = struct.unpack("<Q", body[33:])[0] if len(body) == 32 + 1 + 8 else None
+        return SequenceHash(record.sequence, body[:32].hex(), chr(body[32]), mempool_sequence)
+    elif record.topic == b"rawblock":
+        return ""
+    else:
+        raise Exception("Unknown topic: {}".format(record.topic))
+
+
+def decode(encoded: Union[str, DumpRecord]):
+    if isinstance(encoded, DumpRecord):
+        return decode_record(encoded)
+    elif encoded.startswith("RawTransaction"):
         tx = RawTransaction(0, "")
         tx.decode(encoded)
         return tx
@@ -0,0 +1,344 @@
+import os
+import struct
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_right
+from typing import BinaryIO, Iterator, List, Optional, Union
+
+from encoding.dump_format import RECORD_HEADER, TOPIC_NAMES, BinaryDumpReader, DumpRecord, is_binary_dump, pack_record
+
+"""
+    Rotating, compressed dump archive.
+
+    An archive is a directory of numbered segments, 000001.ordz, 000002.ordz,
+    ... A segment is an 8-byte magic followed by independently compressed
+    frames:
+
+        compressed_length u32
+        raw_length        u32
+        records           u32
+        crc32             u32  of the compressed bytes
+        compressed        zlib stream of `records` records laid out as in
+                          the binary dump (encoding/dump_format.py)
+
+    A frame is a group commit: GroupCommitter buffers records in memory and a
+    background thread compresses and appends everything buffered as one
+    frame, in one write and one fsync, once commit_bytes are buffered or the
+    oldest buffered record is commit_interval seconds old. The handler thread
+    only packs records into a list. Frame headers make a segment seekable: a
+    reader hops from header to header and decompresses only the frame holding
+    the record it wants. A segment is rotated after the frame holding a
+    block, or once it reaches rotate_bytes, and a writer never reopens an
+    existing segment, so a restart starts a new one and the previous capture
+    is left as it was. A frame torn by a crash is the last one of its
+    segment and is ignored by readers.
+
+    zlib is used as it is in the standard library; at level 1 it keeps up
+    with the rawtx stream from one thread.
+"""
+
+ARCHIVE_MAGIC = b"ORDZDMP1"
+FRAME_HEADER = struct.Struct("<IIII")
+SEGMENT_SUFFIX = ".ordz"
+
+
+def segment_paths(path: str) -> List[str]:
+    if os.path.isdir(path):
+        return [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(SEGMENT_SUFFIX)]
+    return [path]
+
+
+def is_archive(path: str) -> bool:
+    if os.path.isdir(path):
+        return True
+    with open(path, "rb") as file:
+        return file.read(len(ARCHIVE_MAGIC)) == ARCHIVE_MAGIC
+
+
+def is_record_dump(path: str) -> bool:
+    return os.path.exists(path) and (is_archive(path) or is_binary_dump(path))
+
+
+# A reader over the records of a binary dump or an archive, both are indexable.
+# With after_wall_ns, an archive reader skips the segments that end before it
+def open_records(path: str, after_wall_ns: Optional[int] = None) -> Union[BinaryDumpReader, "DumpArchiveReader"]:
+    if not is_archive(path):
+        return BinaryDumpReader(path)
+    return DumpArchiveReader(path, segments_after(path, after_wall_ns) if after_wall_ns is not None else None)
+
+
+# The last segments, from the newest back to the first one starting at or
+# before wall_ns (compared to the microsecond, as messages carry it), so
+# catching up reads the end of a long capture only
+def segments_after(path: str, wall_ns: int) -> List[str]:
+    paths = segment_paths(path)
+    start = len(paths)
+    while start > 0:
+        start -= 1
+        with DumpArchiveReader(paths[start]) as reader:
+            if len(reader) and reader[0].wall_ns // 1000 * 1000 <= wall_ns:
+                break
+    return paths[start:]
+
+
+def unpack_records(raw: bytes) -> List[DumpRecord]:
+    view = memoryview(raw)
+    records = []
+    offset = 0
+    while offset < len(raw):
+        body_length, topic_id, sequence, monotonic_ns, wall_ns = RECORD_HEADER.unpack_from(view, offset)
+        start = offset + RECORD_HEADER.size
+        records.append(DumpRecord(TOPIC_NAMES[topic_id], sequence, monotonic_ns, wall_ns, view[start:start + body_length]))
+        offset = start + body_length
+    return records
+
+
+class DumpArchiveWriter():
+    def __init__(self, directory: str, rotate_bytes: int = 256 << 20, level: int = 1, fsync: bool = True):
+        self.directory = directory
+        self.rotate_bytes = rotate_bytes
+        self.level = level
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+        existing = [int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(directory)
+                    if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit()]
+        self.segment = max(existing, default=0)
+        self.file: Optional[BinaryIO] = None
+        self.segment_size = 0
+        self.frames = 0
+        self.records = 0
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+
+    @property
+    def segment_path(self) -> str:
+        return os.path.join(self.directory, "{:06d}{}".format(self.segment, SEGMENT_SUFFIX))
+
+    # Opened on the first frame, a restart without traffic leaves no empty segment
+    def _open_segment(self):
+        self.segment += 1
+        self.file = open(self.segment_path, "xb")
+        self.file.write(ARCHIVE_MAGIC)
+        self.segment_size = len(ARCHIVE_MAGIC)
+
+    def write_frame(self, raw: bytes, records: int):
+        if self.file is None:
+            self._open_segment()
+        compressed = zlib.compress(raw, self.level)
+        self.file.write(FRAME_HEADER.pack(len(compressed), len(raw), records, zlib.crc32(compressed)) + compressed)
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        self.segment_size += FRAME_HEADER.size + len(compressed)
+        self.frames += 1
+        self.records += records
+        self.raw_bytes += len(raw)
+        self.compressed_bytes += len(compressed)
+        if self.segment_size >= self.rotate_bytes:
+            self.rotate()
+
+    def rotate(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def close(self):
+        self.rotate()
+
+
+class GroupCommitter():
+    """Buffers records and commits them to a DumpArchiveWriter from a
+    background thread, see the module docstring. write() blocks once
+    max_buffered_bytes are waiting, rather than growing without bound."""
+
+    def __init__(self, writer: DumpArchiveWriter, commit_bytes: int = 1 << 20, commit_interval: float = 1.0,
+                 max_buffered_bytes: int = 64 << 20):
+        self.writer = writer
+        self.commit_bytes = commit_bytes
+        self.commit_interval = commit_interval
+        self.max_buffered_bytes = max_buffered_bytes
+        self.condition = threading.Condition(threading.Lock())
+        self.chunks: List[bytes] = []
+        # positions in chunks after which the segment is rotated
+        self.boundaries: List[int] = []
+        self.buffered = 0
+        self.oldest = 0.0
+        self.committing = False
+        self.flushing = 0
+        self.closed = False
+        self.error: Optional[BaseException] = None
+        self.commits = 0
+        # longest a record waited in memory before its frame was on disk, the
+        # most a crash can lose
+        self.max_window = 0.0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def write(self, record: DumpRecord, rotate_after: bool = False):
+        if self.error is not None:
+            raise self.error
+        chunk = pack_record(record)
+        with self.condition:
+            if self.buffered >= self.max_buffered_bytes:
+                self.condition.wait_for(lambda: self.buffered < self.max_buffered_bytes or self.error is not None)
+            if not self.chunks:
+                self.oldest = time.monotonic()
+            self.chunks.append(chunk)
+            self.buffered += len(chunk)
+            if rotate_after:
+                self.boundaries.append(len(self.chunks))
+            if rotate_after or self.buffered >= self.commit_bytes or len(self.chunks) == 1:
+                # the first record arms the interval timer
+                self.condition.notify_all()
+
+    # Blocks until every record written so far is committed
+    def flush(self):
+        with self.condition:
+            self.flushing += 1
+            self.condition.notify_all()
+            self.condition.wait_for(lambda: (not self.chunks and not self.committing) or self.error is not None)
+            self.flushing -= 1
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        if self.closed:
+            return
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.writer.close()
+        if self.error is not None:
+            raise self.error
+
+    def _due(self) -> bool:
+        if not self.chunks:
+            return self.closed
+        return (self.closed or self.flushing > 0 or bool(self.boundaries) or self.buffered >= self.commit_bytes
+                or time.monotonic() >= self.oldest + self.commit_interval)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self._due():
+                    self.condition.wait(None if not self.chunks else max(0.0, self.oldest + self.commit_interval - time.monotonic()))
+                if not self.chunks:
+                    return
+                chunks, boundaries, oldest = self.chunks, self.boundaries, self.oldest
+                self.chunks, self.boundaries, self.buffered = [], [], 0
+                self.committing = True
+                self.condition.notify_all()
+            try:
+                self._commit(chunks, boundaries)
+                self.commits += 1
+                self.max_window = max(self.max_window, time.monotonic() - oldest)
+            except Exception as err:
+                self.error = err
+                return
+            finally:
+                with self.condition:
+                    self.committing = False
+                    self.condition.notify_all()
+
+    def _commit(self, chunks: List[bytes], boundaries: List[int]):
+        start = 0
+        for end in boundaries:
+            if end > start:
+                self.writer.write_frame(b"".join(chunks[start:end]), end - start)
+            self.writer.rotate()
+            start = end
+        if start < len(chunks):
+            self.writer.write_frame(b"".join(chunks[start:]), len(chunks) - start)
+
+
+class DumpArchiveReader():
+    """The records of an archive directory, or of a single segment, in order.
+    Segments are opened one at a time, to scan their frame headers and then
+    to read the frames of the segment last used. The decompressed frame last
+    read is kept, so reading forward or backward through a frame decompresses
+    it once. `segments` restricts the reader to those segment paths."""
+
+    def __init__(self, path: str, segments: Optional[List[str]] = None):
+        self.path = path
+        self.paths = segments if segments is not None else segment_paths(path)
+        # per frame: segment, offset of its header, and the number of its first record
+        self.frame_segments = array("I")
+        self.frame_offsets = array("Q")
+        self.first_records = array("Q")
+        self.count = 0
+        for segment, segment_path in enumerate(self.paths):
+            with open(segment_path, "rb") as file:
+                self._scan(segment, file)
+        self.file: Optional[BinaryIO] = None
+        self.file_segment = -1
+        self.cached_frame = -1
+        self.cached_records: List[DumpRecord] = []
+
+    def _scan(self, segment: int, file: BinaryIO):
+        size = os.fstat(file.fileno()).st_size
+        if file.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+            raise ValueError("Not a dump archive segment: {}".format(file.name))
+        offset = len(ARCHIVE_MAGIC)
+        while offset + FRAME_HEADER.size <= size:
+            file.seek(offset)
+            compressed_length, _, records, _ = FRAME_HEADER.unpack(file.read(FRAME_HEADER.size))
+            end = offset + FRAME_HEADER.size + compressed_length
+            if end > size:
+                break
+            self.frame_segments.append(segment)
+            self.frame_offsets.append(offset)
+            self.first_records.append(self.count)
+            self.count += records
+            offset = end
+
+    def _segment_file(self, segment: int) -> BinaryIO:
+        if segment != self.file_segment:
+            self.close()
+            self.file = open(self.paths[segment], "rb")
+            self.file_segment = segment
+        return self.file
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i: int) -> DumpRecord:
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("record {} of {}".format(i, self.count))
+        frame = bisect_right(self.first_records, i) - 1
+        return self.frame(frame)[i - self.first_records[frame]]
+
+    def __iter__(self) -> Iterator[DumpRecord]:
+        for frame in range(len(self.frame_offsets)):
+            yield from self.frame(frame)
+
+    def frame(self, frame: int) -> List[DumpRecord]:
+        if frame != self.cached_frame:
+            file = self._segment_file(self.frame_segments[frame])
+            file.seek(self.frame_offsets[frame])
+            compressed_length, raw_length, records, crc = FRAME_HEADER.unpack(file.read(FRAME_HEADER.size))
+            compressed = file.read(compressed_length)
+            if zlib.crc32(compressed) != crc:
+                raise ValueError("Corrupt frame at {} in {}".format(self.frame_offsets[frame], file.name))
+            raw = zlib.decompress(compressed)
+            self.cached_records = unpack_records(raw)
+            if len(raw) != raw_length or len(self.cached_records) != records:
+                raise ValueError("Corrupt frame at {} in {}".format(self.frame_offsets[frame], file.name))
+            self.cached_frame = frame
+        return self.cached_records
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.file_segment = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
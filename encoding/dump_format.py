@@ -0,0 +1,251 @@
+import argparse
+import mmap
+import os
+import struct
+from array import array
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterator, Optional, Union
+
+"""
+    Binary length-prefixed dump format.
+
+    A dump starts with an 8-byte magic and is followed by records:
+
+        body_length  u32
+        topic        u8   (see TOPICS)
+        sequence     u32  ZMQ sequence number
+        monotonic_ns u64  time.monotonic_ns() at receive time
+        wall_ns      u64  time.time_ns() at receive time
+        body         body_length raw ZMQ body bytes
+
+    All integers are little-endian. A sidecar `<dump>.idx` holds one u64 file
+    offset per record, so a reader can mmap the dump and slice any record
+    without scanning or copying. The index is only a cache: a missing or stale
+    one is rebuilt from the dump.
+
+    Besides the ZMQ topics, `recovered` records hold the rawtx the analysis
+    fetched from the node's mempool after messages were lost, see
+    MempoolAnalyzer.backfill_lost. They are numbered on their own and carry
+    the monotonic_ns of the frame they were handled after, and the wall_ns
+    they were handled with, so a replay handles them at the same point.
+"""
+
+MAGIC = b"ORDDUMP1"
+RECORD_HEADER = struct.Struct("<IBIQQ")
+INDEX_SUFFIX = ".idx"
+
+TOPICS = {
+    b"hashblock": 0,
+    b"hashtx": 1,
+    b"rawblock": 2,
+    b"rawtx": 3,
+    b"sequence": 4,
+    b"recovered": 5,
+}
+TOPIC_NAMES = {topic_id: topic for topic, topic_id in TOPICS.items()}
+
+
+@dataclass
+class DumpRecord:
+    topic: bytes
+    sequence: int
+    monotonic_ns: int
+    wall_ns: int
+    body: Union[bytes, memoryview]
+    # endpoint of ZMQHandler the frame came from, not kept in dumps
+    source: int = 0
+    # messages of the topic the node published right before this one and
+    # that never arrived, set by ZMQHandler; not kept in dumps either
+    lost: int = 0
+
+    @property
+    def timestamp(self) -> datetime:
+        # built from integers so it matches the datetime captured at receive time
+        return datetime.fromtimestamp(self.wall_ns // 1_000_000_000).replace(microsecond=self.wall_ns // 1_000 % 1_000_000)
+
+
+def datetime_to_ns(ts: datetime) -> int:
+    # a double holds today's timestamps to a fraction of a microsecond, rounding
+    # keeps the microseconds exact
+    return round(ts.timestamp() * 1_000_000) * 1_000
+
+
+# Header and body of a record, as they are laid out in a dump
+def pack_record(record: DumpRecord) -> bytes:
+    header = RECORD_HEADER.pack(len(record.body), TOPICS[record.topic], record.sequence & 0xffffffff, record.monotonic_ns, record.wall_ns)
+    return header + bytes(record.body)
+
+
+def is_binary_dump(path: str) -> bool:
+    with open(path, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+class BinaryDumpWriter():
+    def __init__(self, path: str, flush_every_record: bool = True):
+        self.path = path
+        self.flush_every_record = flush_every_record
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        # append, never truncate a previous capture
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            self._recover()
+        self.file = open(path, "ab")
+        self.index = open(path + INDEX_SUFFIX, "ab")
+        self.offset = self.file.tell()
+        if self.offset == 0:
+            self.file.write(MAGIC)
+            self.offset = len(MAGIC)
+            self.index.truncate(0)
+
+    # Drops a record torn by a crash and rewrites a stale index before appending
+    def _recover(self):
+        with BinaryDumpReader(self.path) as reader:
+            offsets = reader.offsets
+            end = len(MAGIC)
+            if offsets:
+                end = offsets[-1] + RECORD_HEADER.size + RECORD_HEADER.unpack_from(reader.view, offsets[-1])[0]
+            size = reader.size
+        if end != size:
+            os.truncate(self.path, end)
+        index_path = self.path + INDEX_SUFFIX
+        if not os.path.exists(index_path) or os.path.getsize(index_path) != len(offsets) * offsets.itemsize:
+            with open(index_path, "wb") as index:
+                offsets.tofile(index)
+
+    def write(self, record: DumpRecord):
+        packed = pack_record(record)
+        self.file.write(packed)
+        self.index.write(struct.pack("<Q", self.offset))
+        self.offset += len(packed)
+        if self.flush_every_record:
+            self.flush()
+
+    def flush(self):
+        self.file.flush()
+        self.index.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        self.index.close()
+
+
+class BinaryDumpReader():
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "rb")
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b""
+        self.view = memoryview(self.map)
+        if bytes(self.view[:len(MAGIC)]) != MAGIC:
+            raise ValueError("Not a binary dump: {}".format(path))
+        self.offsets = self._load_index()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i: int) -> DumpRecord:
+        return self._record_at(self.offsets[i])
+
+    def __iter__(self) -> Iterator[DumpRecord]:
+        for offset in self.offsets:
+            yield self._record_at(offset)
+
+    def close(self):
+        try:
+            self.view.release()
+            if self.size:
+                self.map.close()
+        except BufferError:
+            # record bodies still reference the mapping, it is unmapped once they are collected
+            pass
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _record_at(self, offset: int) -> DumpRecord:
+        body_length, topic_id, sequence, monotonic_ns, wall_ns = RECORD_HEADER.unpack_from(self.view, offset)
+        start = offset + RECORD_HEADER.size
+        return DumpRecord(TOPIC_NAMES[topic_id], sequence, monotonic_ns, wall_ns, self.view[start:start + body_length])
+
+    def _load_index(self) -> array:
+        offsets = array("Q")
+        index_path = self.path + INDEX_SUFFIX
+        if os.path.exists(index_path):
+            with open(index_path, "rb") as index:
+                offsets.frombytes(index.read(os.path.getsize(index_path) // offsets.itemsize * offsets.itemsize))
+            if self._index_is_complete(offsets):
+                return offsets
+        return self._scan()
+
+    def _index_is_complete(self, offsets: array) -> bool:
+        if not offsets:
+            return self.size == len(MAGIC)
+        last = offsets[-1]
+        if last + RECORD_HEADER.size > self.size:
+            return False
+        body_length = RECORD_HEADER.unpack_from(self.view, last)[0]
+        return last + RECORD_HEADER.size + body_length == self.size
+
+    # Rebuilds the offsets, ignoring a truncated record left by a crash
+    def _scan(self) -> array:
+        offsets = array("Q")
+        offset = len(MAGIC)
+        while offset + RECORD_HEADER.size <= self.size:
+            body_length = RECORD_HEADER.unpack_from(self.view, offset)[0]
+            end = offset + RECORD_HEADER.size + body_length
+            if end > self.size:
+                break
+            offsets.append(offset)
+            offset = end
+        return offsets
+
+
+def record_from_text(line: str) -> Optional[DumpRecord]:
+    # imported here so the format itself does not depend on python-bitcoinlib
+    from encoding.decode import BlockHash, RawTransaction, TransactionHash, decode
+
+    decoded = decode(line)
+    if isinstance(decoded, RawTransaction):
+        topic, body = b"rawtx", bytes.fromhex(decoded.raw_tx)
+    elif isinstance(decoded, TransactionHash):
+        topic, body = b"hashtx", bytes.fromhex(decoded.tx_hash)
+    elif isinstance(decoded, BlockHash):
+        topic, body = b"hashblock", bytes.fromhex(decoded.block_hash)
+    else:
+        # sequence and rawblock lines do not carry enough to rebuild the body
+        return None
+    # text dumps have no monotonic clock, the wall clock is the best stand-in
+    wall_ns = datetime_to_ns(decoded.timestamp)
+    return DumpRecord(topic, decoded.sequence, wall_ns, wall_ns, body)
+
+
+def convert_text_dump(text_path: str, binary_path: str) -> int:
+    writer = BinaryDumpWriter(binary_path, flush_every_record=False)
+    converted = 0
+    with open(text_path, "r") as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            record = record_from_text(line)
+            if record is not None:
+                writer.write(record)
+                converted += 1
+    writer.close()
+    return converted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a text mempool dump to the binary dump format")
+    parser.add_argument("text_dump")
+    parser.add_argument("binary_dump")
+    args = parser.parse_args()
+    print("Converted {} records into {}".format(convert_text_dump(args.text_dump, args.binary_dump), args.binary_dump))
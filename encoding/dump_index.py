@@ -0,0 +1,281 @@
+import bisect
+import multiprocessing
+import os
+import struct
+from array import array
+from typing import Iterator, List, Optional, Tuple, Union
+
+from encoding.dump_format import MAGIC as BINARY_MAGIC, RECORD_HEADER, BinaryDumpReader, DumpRecord, is_binary_dump, record_from_text
+from encoding.tx_scanner import scan_transaction
+
+"""
+    Persisted lookup index of a dump, binary or text, kept next to it as
+    `<dump>.lookup`:
+
+        magic        8 bytes  ORDLKP02
+        dump_size    u64      bytes of the dump covered by the index
+        n_offsets    u64      0 for binary dumps, their .idx has the offsets
+        n_entries    u64
+        bucket_bits  u64
+        offsets      n_offsets x u64  byte offset of every line of a text dump
+        directory    (2**bucket_bits + 1) x u32  first entry of every bucket
+        keys         n_entries x u64  first 8 bytes of the hash, as displayed
+        records      n_entries x u32  number of the record carrying the hash
+
+    Every record is indexed under the hashes it carries: the txid of a rawtx
+    or of a recovered one (see dump_format), the hash of hashtx, hashblock
+    and sequence messages. Indexes of the first version left the recovered
+    records out and are rebuilt. Entries are grouped
+    by bucket, the top bucket_bits bits of their key, with about one entry
+    per bucket, so the records of a txid are found by reading two directory
+    slots and comparing a few keys in the mapped file, and each record is
+    then one seek away. Dumps are append-only: an index covering a prefix of
+    the dump is extended with the records after it instead of rebuilt.
+"""
+
+MAGIC = b"ORDLKP02"
+# topics whose body is a raw transaction
+TRANSACTION_TOPICS = (b"rawtx", b"recovered")
+HEADER = struct.Struct("<8sQQQQ")
+LOOKUP_SUFFIX = ".lookup"
+# records hashed per task when the index is built by a process pool
+CHUNK_RECORDS = 20000
+
+
+class TextDumpReader():
+    """Record access to a text dump, one message per line, by line offset."""
+
+    def __init__(self, path: str, offsets: Optional[array] = None):
+        self.path = path
+        self.file = open(path, "rb")
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.offsets = offsets if offsets is not None else self.scan_offsets(path)
+
+    # Offsets of the non-empty lines from byte `start`
+    @staticmethod
+    def scan_offsets(path: str, start: int = 0) -> array:
+        offsets = array("Q")
+        with open(path, "rb") as file:
+            file.seek(start)
+            offset = start
+            for line in file:
+                if line.strip() and line.endswith(b"\n"):
+                    offsets.append(offset)
+                elif line.strip():
+                    # a line still being written is not a record yet
+                    break
+                offset += len(line)
+        return offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def line(self, i: int) -> str:
+        self.file.seek(self.offsets[i])
+        return self.file.readline().decode("utf8", "replace").strip()
+
+    # None for the lines that do not convert to a record (sequence, rawblock)
+    def __getitem__(self, i: int) -> Optional[DumpRecord]:
+        try:
+            return record_from_text(self.line(i))
+        except Exception:
+            return None
+
+    def __iter__(self) -> Iterator[Optional[DumpRecord]]:
+        for i in range(len(self.offsets)):
+            yield self[i]
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_dump(path: str, offsets: Optional[array] = None) -> Union[BinaryDumpReader, TextDumpReader]:
+    return BinaryDumpReader(path) if is_binary_dump(path) else TextDumpReader(path, offsets)
+
+
+# (record number, body) of the rawtx and recovered records in one sequential read, text
+# lines are cut at the hex without parsing the rest of the message
+def raw_transactions(path: str) -> Iterator[Tuple[int, Union[bytes, memoryview]]]:
+    if is_binary_dump(path):
+        with BinaryDumpReader(path) as dump:
+            for number, record in enumerate(dump):
+                if record.topic in TRANSACTION_TOPICS:
+                    yield number, record.body
+        return
+    with open(path, "rb") as file:
+        number = 0
+        for line in file:
+            if not line.strip():
+                continue
+            if not line.endswith(b"\n"):
+                break
+            if line.startswith(b"RawTransaction("):
+                start = line.index(b"raw_tx=") + 7
+                yield number, bytes.fromhex(line[start:line.index(b",", start)].decode())
+            number += 1
+
+
+# 32-byte hashes, as displayed, that a record is indexed under
+def record_hashes(record: Optional[DumpRecord]) -> List[bytes]:
+    if record is None:
+        return []
+    if record.topic in TRANSACTION_TOPICS:
+        try:
+            return [scan_transaction(record.body).GetTxid()[::-1]]
+        except Exception:
+            return []
+    if record.topic in (b"hashtx", b"hashblock", b"sequence") and len(record.body) >= 32:
+        return [bytes(record.body[:32])]
+    return []
+
+
+def hash_key(hash: bytes) -> int:
+    return int.from_bytes(hash[:8], "big")
+
+
+def _hash_chunk(path: str, start: int, stop: int, offsets: Optional[array]) -> Tuple[bytes, bytes]:
+    keys, records = array("Q"), array("I")
+    with open_dump(path, offsets) as dump:
+        for i in range(start, stop):
+            # text offsets are passed for the chunk only
+            for hash in record_hashes(dump[i - start if offsets is not None else i]):
+                keys.append(hash_key(hash))
+                records.append(i)
+    return keys.tobytes(), records.tobytes()
+
+
+class DumpLookupIndex():
+    def __init__(self, path: str, dump_size: int, offsets: array, keys: array, records: array, bucket_bits: int, directory: array):
+        self.path = path
+        self.dump_size = dump_size
+        self.offsets = offsets
+        self.keys = keys
+        self.records = records
+        self.bucket_bits = bucket_bits
+        self.directory = directory
+
+    @property
+    def index_path(self) -> str:
+        return self.path + LOOKUP_SUFFIX
+
+    # Loads the index of `path`, extending or building it when it does not
+    # cover the whole dump
+    @classmethod
+    def open(cls, path: str, workers: int = 1) -> "DumpLookupIndex":
+        index = cls.load(path)
+        size = os.path.getsize(path)
+        if index is None or index.dump_size > size:
+            index = cls(path, len(BINARY_MAGIC) if is_binary_dump(path) else 0, array("Q"), array("Q"), array("I"), 0, array("I", [0, 0]))
+        if index.dump_size != size and index.extend(workers):
+            index.save()
+        return index
+
+    @classmethod
+    def load(cls, path: str) -> Optional["DumpLookupIndex"]:
+        index_path = path + LOOKUP_SUFFIX
+        if not os.path.exists(index_path):
+            return None
+        with open(index_path, "rb") as file:
+            data = file.read()
+        if len(data) < HEADER.size:
+            return None
+        magic, dump_size, n_offsets, n_entries, bucket_bits = HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            return None
+        sections = []
+        position = HEADER.size
+        for typecode, count in (("Q", n_offsets), ("I", (1 << bucket_bits) + 1), ("Q", n_entries), ("I", n_entries)):
+            section = array(typecode)
+            section.frombytes(data[position:position + count * section.itemsize])
+            if len(section) != count:
+                return None
+            sections.append(section)
+            position += count * section.itemsize
+        offsets, directory, keys, records = sections
+        return cls(path, dump_size, offsets, keys, records, bucket_bits, directory)
+
+    # Indexes the records written after dump_size, False when there are none
+    def extend(self, workers: int = 1) -> bool:
+        if is_binary_dump(self.path):
+            with BinaryDumpReader(self.path) as dump:
+                offsets = dump.offsets
+                first = bisect.bisect_left(offsets, self.dump_size)
+                tasks = [(self.path, start, min(start + CHUNK_RECORDS, len(offsets)), None) for start in range(first, len(offsets), CHUNK_RECORDS)]
+                end = self.dump_size
+                if len(offsets) > first:
+                    end = offsets[-1] + RECORD_HEADER.size + RECORD_HEADER.unpack_from(dump.view, offsets[-1])[0]
+        else:
+            new_offsets = TextDumpReader.scan_offsets(self.path, self.dump_size)
+            first = len(self.offsets)
+            self.offsets.extend(new_offsets)
+            tasks = [
+                (self.path, start, min(start + CHUNK_RECORDS, len(self.offsets)), self.offsets[start:start + CHUNK_RECORDS])
+                for start in range(first, len(self.offsets), CHUNK_RECORDS)
+            ]
+            end = self.dump_size
+            if new_offsets:
+                with open(self.path, "rb") as file:
+                    file.seek(new_offsets[-1])
+                    end = new_offsets[-1] + len(file.readline())
+        if not tasks:
+            return False
+        if workers > 1 and len(tasks) > 1:
+            with multiprocessing.get_context("spawn").Pool(workers) as pool:
+                chunks = pool.starmap(_hash_chunk, tasks)
+        else:
+            chunks = [_hash_chunk(*task) for task in tasks]
+        keys, records = array("Q", self.keys), array("I", self.records)
+        for chunk_keys, chunk_records in chunks:
+            keys.frombytes(chunk_keys)
+            records.frombytes(chunk_records)
+        self._build_buckets(keys, records)
+        self.dump_size = end
+        return True
+
+    # Counting sort of the entries by bucket
+    def _build_buckets(self, keys: array, records: array):
+        bucket_bits = max(1, len(keys).bit_length())
+        shift = 64 - bucket_bits
+        counts = array("I", bytes(4 * ((1 << bucket_bits) + 1)))
+        for key in keys:
+            counts[(key >> shift) + 1] += 1
+        for bucket in range(1, len(counts)):
+            counts[bucket] += counts[bucket - 1]
+        directory = array("I", counts)
+        sorted_keys, sorted_records = array("Q", bytes(8 * len(keys))), array("I", bytes(4 * len(keys)))
+        for key, record in zip(keys, records):
+            slot = counts[key >> shift]
+            counts[key >> shift] += 1
+            sorted_keys[slot] = key
+            sorted_records[slot] = record
+        self.keys, self.records, self.bucket_bits, self.directory = sorted_keys, sorted_records, bucket_bits, directory
+
+    # Written aside and renamed, a crash never leaves a torn index
+    def save(self):
+        temporary = self.index_path + ".tmp"
+        with open(temporary, "wb") as file:
+            file.write(HEADER.pack(MAGIC, self.dump_size, len(self.offsets), len(self.keys), self.bucket_bits))
+            for section in (self.offsets, self.directory, self.keys, self.records):
+                section.tofile(file)
+        os.replace(temporary, self.index_path)
+
+    def __len__(self):
+        return len(self.keys)
+
+    # Numbers of the records indexed under the hash (hex as displayed), in
+    # dump order. Keys are 8-byte prefixes, callers needing certainty check
+    # record_hashes of the records
+    def lookup(self, hash_hex: str) -> List[int]:
+        key = hash_key(bytes.fromhex(hash_hex))
+        bucket = key >> (64 - self.bucket_bits)
+        start, stop = self.directory[bucket], self.directory[bucket + 1]
+        return sorted(self.records[i] for i in range(start, stop) if self.keys[i] == key)
+
+    def reader(self) -> Union[BinaryDumpReader, TextDumpReader]:
+        return open_dump(self.path, self.offsets if self.offsets else None)
@@ -0,0 +1,325 @@
+import argparse
+import csv
+import mmap
+import os
+import queue
+import struct
+import sys
+import threading
+from array import array
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+"""
+    Append-only columnar store for the rebid analysis output.
+
+    A store starts with an 8-byte magic and is followed by one row group per
+    block:
+
+        body_length  u32
+        block_id     i64
+        n_rows       u32
+        n_txids      u32  entries in the row group's txid dictionary
+        n_keys       u32  entries in the row group's key dictionary
+        body:
+            txid dictionary   n_txids x 32 bytes, as displayed (b2lx order)
+            key dictionary    n_keys x 32 bytes
+            txid codes        n_rows x u32
+            key codes         n_rows x u32
+            gas fees          n_rows x i64
+            timestamps        n_rows x f64
+            vsizes            n_rows x u32  virtual size of the bid, in vbytes
+            n_tags            u32  entries in the row group's inscription dictionary
+            inscriptions      n_tags x (content type, BRC-20 op, BRC-20 ticker),
+                              each a u8 length and that many utf8 bytes
+            inscription codes n_rows x u32  1 + dictionary entry, 0 without
+                              an inscription
+
+    All integers and floats are little-endian. Dictionaries are local to the
+    row group, so any block can be decoded on its own and readers skip the
+    blocks outside a blockId range from the headers alone. A row group torn
+    by a crash is dropped when the store is reopened for writing.
+
+    After a reorg the replacing block is appended with the same blockId, the
+    rows written for the disconnected block are kept. Reading with
+    canonical=True only keeps the last row group of every blockId.
+"""
+
+MAGIC = b"ORDREB03"
+ROW_GROUP_HEADER = struct.Struct("<IqIII")
+ID_SIZE = 32
+# bytes per row in the body, besides the dictionaries
+ROW_SIZE = 4 + 4 + 8 + 8 + 4 + 4
+CSV_HEADER = ['externalTransactionId', 'internalTransactionId', 'gasFee', 'timestamp', 'blockId', 'vsize', 'feeRate', 'contentType', 'brc20Op', 'brc20Tick']
+NO_INSCRIPTION = ("", "", "")
+
+
+# sat/vB, None when the size is unknown
+def fee_rate(gas_fee: int, vsize: int) -> Optional[float]:
+    return round(gas_fee / vsize, 3) if vsize else None
+
+
+def _little_endian(column: array) -> array:
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column
+
+
+def is_rebid_store(path: str) -> bool:
+    with open(path, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+@dataclass
+class RowGroup:
+    block_id: int
+    txids: List[bytes]
+    keys: List[bytes]
+    txid_codes: array
+    key_codes: array
+    gas_fees: array
+    timestamps: array
+    vsizes: array
+    # (content type, BRC-20 op, ticker) entries, and 1 + entry per row, 0 for none
+    inscriptions: List[Tuple[str, str, str]]
+    inscription_codes: array
+
+    def __len__(self):
+        return len(self.gas_fees)
+
+    def inscription_columns(self) -> List[Tuple[str, str, str]]:
+        entries = [NO_INSCRIPTION] + self.inscriptions
+        return [entries[code] for code in self.inscription_codes]
+
+    # Rows as the csv output has them
+    def rows(self) -> Iterator[list]:
+        txids = [txid.hex() for txid in self.txids]
+        keys = [key.hex() for key in self.keys]
+        for txid_code, key_code, gas_fee, timestamp, vsize, inscription in zip(self.txid_codes, self.key_codes, self.gas_fees, self.timestamps, self.vsizes, self.inscription_columns()):
+            yield [txids[txid_code], keys[key_code], gas_fee, timestamp, self.block_id, vsize, fee_rate(gas_fee, vsize), *inscription]
+
+
+def _encode_field(value: str) -> bytes:
+    encoded = value.encode("utf8")[:255]
+    return bytes([len(encoded)]) + encoded
+
+
+# rows are [txid, key, gas_fee, timestamp, block_id, vsize, content_type, op, tick],
+# as MempoolAnalyzer.group_rows builds them
+def encode_row_group(block_id: int, rows: List[list]) -> bytes:
+    txid_codes: Dict[str, int] = {}
+    key_codes: Dict[str, int] = {}
+    inscription_codes: Dict[Tuple[str, str, str], int] = {NO_INSCRIPTION: 0}
+    txid_column, key_column, gas_fees, timestamps, vsizes, inscription_column = array("I"), array("I"), array("q"), array("d"), array("I"), array("I")
+    for txid, key, gas_fee, timestamp, _, vsize, *inscription in rows:
+        txid_column.append(txid_codes.setdefault(txid, len(txid_codes)))
+        key_column.append(key_codes.setdefault(key, len(key_codes)))
+        gas_fees.append(gas_fee)
+        timestamps.append(timestamp)
+        vsizes.append(vsize)
+        inscription_column.append(inscription_codes.setdefault(tuple(inscription) or NO_INSCRIPTION, len(inscription_codes)))
+    try:
+        dictionaries = b"".join(bytes.fromhex(txid) for txid in txid_codes) + b"".join(bytes.fromhex(key) for key in key_codes)
+    except ValueError:
+        raise ValueError("txids and keys must be 64 hex characters")
+    if len(dictionaries) != ID_SIZE * (len(txid_codes) + len(key_codes)):
+        raise ValueError("txids and keys must be 64 hex characters")
+    body = dictionaries + b"".join(_little_endian(column).tobytes() for column in (txid_column, key_column, gas_fees, timestamps, vsizes))
+    body += struct.pack("<I", len(inscription_codes) - 1)
+    body += b"".join(_encode_field(field) for inscription in list(inscription_codes)[1:] for field in inscription)
+    body += _little_endian(inscription_column).tobytes()
+    return ROW_GROUP_HEADER.pack(len(body), block_id, len(rows), len(txid_codes), len(key_codes)) + body
+
+
+class RebidStoreReader():
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "rb")
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b""
+        self.view = memoryview(self.map)
+        if bytes(self.view[:len(MAGIC)]) != MAGIC:
+            raise ValueError("Not a rebid store: {}".format(path))
+        # (block_id, offset) of every complete row group
+        self.row_groups: List[Tuple[int, int]] = self._scan()
+
+    def __len__(self):
+        return len(self.row_groups)
+
+    @property
+    def end(self) -> int:
+        if not self.row_groups:
+            return len(MAGIC)
+        offset = self.row_groups[-1][1]
+        return offset + ROW_GROUP_HEADER.size + ROW_GROUP_HEADER.unpack_from(self.view, offset)[0]
+
+    def block_ids(self) -> List[int]:
+        return [block_id for block_id, _ in self.row_groups]
+
+    # Only the row groups within [min_block, max_block] are decoded
+    def read(self, min_block: Optional[int] = None, max_block: Optional[int] = None, canonical: bool = False) -> Iterator[RowGroup]:
+        latest = {block_id: offset for block_id, offset in self.row_groups} if canonical else None
+        for block_id, offset in self.row_groups:
+            if latest is not None and latest[block_id] != offset:
+                continue
+            if (min_block is None or block_id >= min_block) and (max_block is None or block_id <= max_block):
+                yield self._row_group_at(offset)
+
+    def rows(self, min_block: Optional[int] = None, max_block: Optional[int] = None, canonical: bool = False) -> Iterator[list]:
+        for row_group in self.read(min_block, max_block, canonical):
+            yield from row_group.rows()
+
+    # Columns named like the csv, for pandas.DataFrame(...)
+    def columns(self, min_block: Optional[int] = None, max_block: Optional[int] = None, canonical: bool = False) -> Dict[str, list]:
+        columns: Dict[str, list] = {name: [] for name in CSV_HEADER}
+        for row_group in self.read(min_block, max_block, canonical):
+            txids = [txid.hex() for txid in row_group.txids]
+            keys = [key.hex() for key in row_group.keys]
+            columns['externalTransactionId'].extend(txids[code] for code in row_group.txid_codes)
+            columns['internalTransactionId'].extend(keys[code] for code in row_group.key_codes)
+            columns['gasFee'].extend(row_group.gas_fees)
+            columns['timestamp'].extend(row_group.timestamps)
+            columns['blockId'].extend([row_group.block_id] * len(row_group))
+            columns['vsize'].extend(row_group.vsizes)
+            columns['feeRate'].extend(fee_rate(gas_fee, vsize) for gas_fee, vsize in zip(row_group.gas_fees, row_group.vsizes))
+            inscriptions = row_group.inscription_columns()
+            for field, name in enumerate(('contentType', 'brc20Op', 'brc20Tick')):
+                columns[name].extend(inscription[field] for inscription in inscriptions)
+        return columns
+
+    def close(self):
+        self.view.release()
+        if self.size:
+            self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _row_group_at(self, offset: int) -> RowGroup:
+        _, block_id, n_rows, n_txids, n_keys = ROW_GROUP_HEADER.unpack_from(self.view, offset)
+        position = offset + ROW_GROUP_HEADER.size
+        txids = [bytes(self.view[position + i * ID_SIZE:position + (i + 1) * ID_SIZE]) for i in range(n_txids)]
+        position += n_txids * ID_SIZE
+        keys = [bytes(self.view[position + i * ID_SIZE:position + (i + 1) * ID_SIZE]) for i in range(n_keys)]
+        position += n_keys * ID_SIZE
+        columns = []
+        for typecode in ("I", "I", "q", "d", "I"):
+            column = array(typecode)
+            column.frombytes(self.view[position:position + n_rows * column.itemsize])
+            columns.append(_little_endian(column))
+            position += n_rows * column.itemsize
+        n_inscriptions = struct.unpack_from("<I", self.view, position)[0]
+        position += 4
+        inscriptions: List[Tuple[str, str, str]] = []
+        for _ in range(n_inscriptions):
+            fields = []
+            for _ in range(3):
+                length = self.view[position]
+                fields.append(bytes(self.view[position + 1:position + 1 + length]).decode("utf8", "replace"))
+                position += 1 + length
+            inscriptions.append(tuple(fields))
+        inscription_codes = array("I")
+        inscription_codes.frombytes(self.view[position:position + n_rows * 4])
+        _little_endian(inscription_codes)
+        return RowGroup(block_id, txids, keys, *columns, inscriptions, inscription_codes)
+
+    # Ignores a row group truncated by a crash
+    def _scan(self) -> List[Tuple[int, int]]:
+        row_groups = []
+        offset = len(MAGIC)
+        while offset + ROW_GROUP_HEADER.size <= self.size:
+            body_length, block_id = ROW_GROUP_HEADER.unpack_from(self.view, offset)[:2]
+            end = offset + ROW_GROUP_HEADER.size + body_length
+            if end > self.size:
+                break
+            row_groups.append((block_id, offset))
+            offset = end
+        return row_groups
+
+
+class RebidStoreWriter():
+    """Appends one row group per block from a background thread, so the block
+    handler only hands the rows over and never waits on the disk."""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            self._recover()
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        self.blocks: queue.Queue = queue.Queue()
+        self.error: Optional[BaseException] = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def append_block(self, block_id: int, rows: List[list]):
+        if self.error is not None:
+            raise self.error
+        self.blocks.put((block_id, rows))
+
+    # Blocks until every row group handed over so far is written
+    def flush(self):
+        self.blocks.join()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.blocks.put(None)
+        self.thread.join()
+        self.file.close()
+        if self.error is not None:
+            raise self.error
+
+    def _run(self):
+        while True:
+            item = self.blocks.get()
+            try:
+                if item is None:
+                    return
+                if self.error is None:
+                    self.file.write(encode_row_group(*item))
+                    self.file.flush()
+            except Exception as err:
+                self.error = err
+            finally:
+                self.blocks.task_done()
+
+    # Drops a row group torn by a crash before appending
+    def _recover(self):
+        with RebidStoreReader(self.path) as reader:
+            end, size = reader.end, reader.size
+        if end != size:
+            os.truncate(self.path, end)
+
+
+def export_csv(store_path: str, csv_path: str, min_block: Optional[int] = None, max_block: Optional[int] = None, canonical: bool = False) -> int:
+    written = 0
+    with RebidStoreReader(store_path) as reader, open(csv_path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(CSV_HEADER)
+        for row_group in reader.read(min_block, max_block, canonical):
+            writer.writerows(row_group.rows())
+            written += len(row_group)
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a rebid store to the csv layout")
+    parser.add_argument("store")
+    parser.add_argument("csv")
+    parser.add_argument("--min-block", type=int)
+    parser.add_argument("--max-block", type=int)
+    parser.add_argument("--canonical", action="store_true", help="drop the rows of blocks disconnected by a reorg")
+    args = parser.parse_args()
+    written = export_csv(args.store, args.csv, args.min_block, args.max_block, args.canonical)
+    print("exported {} rows to {}".format(written, args.csv))
@@ -0,0 +1,171 @@
+import hashlib
+import struct
+from typing import List, NamedTuple, Optional, Tuple, Union
+
+from bitcoin.core import CTransaction
+
+"""
+    Zero-copy transaction scanner.
+
+    The rebid analysis only needs a transaction's input outpoints, their
+    nSequence values, the output values, the txid and the weight.
+    scan_transaction walks the serialized transaction once over a memoryview
+    and extracts just those, without building scripts, witnesses or
+    python-bitcoinlib objects. The result duck-types the parts of CTransaction
+    the analyzer reads (vin[i].prevout, vin[i].nSequence, vin[i].is_final(),
+    vout[i].nValue, GetTxid(), calc_weight()), and deserialize() falls back to
+    a full CTransaction when one is really needed.
+"""
+
+_U32 = struct.Struct("<I")
+_I64 = struct.Struct("<q")
+FINAL_SEQUENCE = 0xffffffff
+
+
+class ScannedOutPoint(NamedTuple):
+    hash: bytes
+    n: int
+
+
+class ScannedTxIn(NamedTuple):
+    prevout: ScannedOutPoint
+    nSequence: int
+
+    def is_final(self) -> bool:
+        return self.nSequence == FINAL_SEQUENCE
+
+
+class ScannedTxOut(NamedTuple):
+    nValue: int
+
+
+def read_varint(view: memoryview, offset: int):
+    prefix = view[offset]
+    if prefix < 0xfd:
+        return prefix, offset + 1
+    elif prefix == 0xfd:
+        return view[offset + 1] | view[offset + 2] << 8, offset + 3
+    elif prefix == 0xfe:
+        return _U32.unpack_from(view, offset + 1)[0], offset + 5
+    return struct.unpack_from("<Q", view, offset + 1)[0], offset + 9
+
+
+class ScannedTransaction():
+    __slots__ = ("raw", "vin", "vout", "has_witness", "witness_start", "_txid")
+
+    def __init__(self, raw: memoryview, vin: List[ScannedTxIn], vout: List[ScannedTxOut], has_witness: bool, witness_start: int):
+        self.raw = raw
+        self.vin = vin
+        self.vout = vout
+        self.has_witness = has_witness
+        # offset of the witness section (equals len(raw) - 4 without witness)
+        self.witness_start = witness_start
+        self._txid: Optional[bytes] = None
+
+    def GetTxid(self) -> bytes:
+        if self._txid is None:
+            self._txid = txid_of(self.raw, self.has_witness, self.witness_start)
+        return self._txid
+
+    # Serialized size without marker, flag and witnesses
+    def stripped_size(self) -> int:
+        if self.has_witness:
+            return self.witness_start + 2
+        return len(self.raw)
+
+    # BIP141 weight: witness bytes count once, the rest four times
+    def calc_weight(self) -> int:
+        return self.stripped_size() * 3 + len(self.raw)
+
+    def deserialize(self) -> CTransaction:
+        return CTransaction.deserialize(bytes(self.raw))
+
+
+# The txid commits to the serialization without marker, flag and witnesses
+def txid_of(view: memoryview, has_witness: bool, witness_start: int) -> bytes:
+    h = hashlib.sha256()
+    if has_witness:
+        h.update(view[0:4])
+        h.update(view[6:witness_start])
+        h.update(view[-4:])
+    else:
+        h.update(view)
+    return hashlib.sha256(h.digest()).digest()
+
+
+def scan_transaction(raw: Union[bytes, bytearray, memoryview]) -> ScannedTransaction:
+    view = raw if isinstance(raw, memoryview) else memoryview(raw)
+    offset = 4
+    has_witness = view[4] == 0 and view[5] != 0
+    if has_witness:
+        offset = 6
+
+    n_inputs, offset = read_varint(view, offset)
+    vin: List[ScannedTxIn] = []
+    for _ in range(n_inputs):
+        prevout = ScannedOutPoint(bytes(view[offset:offset + 32]), _U32.unpack_from(view, offset + 32)[0])
+        script_length, offset = read_varint(view, offset + 36)
+        offset += script_length
+        vin.append(ScannedTxIn(prevout, _U32.unpack_from(view, offset)[0]))
+        offset += 4
+
+    n_outputs, offset = read_varint(view, offset)
+    vout: List[ScannedTxOut] = []
+    for _ in range(n_outputs):
+        vout.append(ScannedTxOut(_I64.unpack_from(view, offset)[0]))
+        script_length, offset = read_varint(view, offset + 8)
+        offset += script_length
+
+    return ScannedTransaction(view, vin, vout, has_witness, offset)
+
+
+def virtual_size(tx: Union[CTransaction, ScannedTransaction]) -> int:
+    return (tx.calc_weight() + 3) // 4
+
+
+# Single pass over the inputs for the RBF pre-filter: True as soon as an input
+# is non-final or spends one of `tracked` (36-byte outpoint keys), without
+# building any per-input object
+def has_non_final_or_tracked_input(raw: Union[bytes, bytearray, memoryview], tracked) -> bool:
+    view = raw if isinstance(raw, memoryview) else memoryview(raw)
+    offset = 6 if view[4] == 0 and view[5] != 0 else 4
+    n_inputs, offset = read_varint(view, offset)
+    for _ in range(n_inputs):
+        outpoint_start = offset
+        script_length, offset = read_varint(view, offset + 36)
+        offset += script_length
+        if _U32.unpack_from(view, offset)[0] != FINAL_SEQUENCE:
+            return True
+        if tracked and view[outpoint_start:outpoint_start + 36].tobytes() in tracked:
+            return True
+        offset += 4
+    return False
+
+
+# Txid and output values only, for the prevout cache: the inputs are stepped
+# over without building any per-input or per-output object, and one-byte
+# varints, nearly all of them, are read inline
+def scan_outputs(raw: Union[bytes, bytearray, memoryview]) -> Tuple[bytes, List[int]]:
+    view = raw if isinstance(raw, memoryview) else memoryview(raw)
+    has_witness = view[4] == 0 and view[5] != 0
+    n_inputs, offset = read_varint(view, 6 if has_witness else 4)
+    for _ in range(n_inputs):
+        offset += 36
+        script_length = view[offset]
+        if script_length < 0xfd:
+            offset += 1
+        else:
+            script_length, offset = read_varint(view, offset)
+        offset += script_length + 4
+    n_outputs, offset = read_varint(view, offset)
+    values: List[int] = []
+    for _ in range(n_outputs):
+        values.append(_I64.unpack_from(view, offset)[0])
+        offset += 8
+        script_length = view[offset]
+        if script_length < 0xfd:
+            offset += 1
+        else:
+            script_length, offset = read_varint(view, offset)
+        offset += script_length
+    return txid_of(view, has_witness, offset), values
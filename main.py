@@ -1,31 +1,126 @@
+import argparse
 import os
-import sys
+import time
+from networking.zmq_handler.frame_queue import OverloadPolicy
+from networking.zmq_handler.routes import Route
 from networking.zmq_handler.zmq_sub import ZMQHandler
-from networking.zmq_handler.zmq_handlers import PrintHandler, WriteToFileHandler, MultiHandler, RebidHandler
+from networking.zmq_handler.zmq_handlers import ArchiveDumpHandler, BinaryDumpHandler, PrintHandler, WriteToFileHandler, RebidHandler
+from analyzer.prevout_cache import PrevoutCache
+from analyzer.rpc_fixtures import RecordingProxy, RpcFixtureStore
+from networking.metrics import METRICS, MetricsReporter, MetricsServer
 
 # Get the directory of the current script
 current_dir = os.path.dirname(os.path.abspath(__file__))
 
 # Default file name
 default_file_name = "data/mempool_drop.txt"
+default_binary_file_name = "data/mempool_drop.bin"
 
-# Check if a different path was provided as an argument
-if len(sys.argv) > 1:
-    dump_file_path = sys.argv[1]
-else:
-    dump_file_path = os.path.join(current_dir, default_file_name)
+parser = argparse.ArgumentParser()
+parser.add_argument("dump_file_path", nargs="?", default=os.path.join(current_dir, default_file_name))
+# Records every RPC answer next to a binary dump of the stream, so the session
+# can be replayed offline with: python rebid_analysis.py <dump> --replay <fixtures>
+parser.add_argument("--record-rpc", metavar="FIXTURES")
+# Records the stream to a binary dump, on its own or with --record-rpc, which
+# defaults it to data/mempool_drop.bin
+parser.add_argument("--record-dump", metavar="DUMP")
+# Records the whole stream to a rotating, compressed archive directory instead
+# of --record-dump, committed every interval seconds, see encoding/dump_archive.py
+parser.add_argument("--archive", metavar="DIRECTORY")
+parser.add_argument("--archive-commit-interval", type=float, default=1.0)
+# bitcoind ZMQ endpoints, repeated to subscribe to several nodes: the first
+# copy of each message is kept, see networking/zmq_handler/fan_in.py. The
+# sequence topic is followed on the first one only
+parser.add_argument("--zmq", action="append", metavar="ENDPOINT", help="defaults to tcp://127.0.0.1:28332")
+# Frames waiting to be handled, and what to do when that many are queued. When
+# recording (--record-dump, --record-rpc or --archive) the recorder and the analysis have a
+# queue each, see networking/zmq_handler/routes.py, and --dump-overload
+# applies to the recorder's
+parser.add_argument("--queue-size", type=int, default=10000)
+parser.add_argument("--overload", choices=[policy.value for policy in OverloadPolicy], default=OverloadPolicy.BLOCK.value)
+parser.add_argument("--dump-overload", choices=[policy.value for policy in OverloadPolicy], default=OverloadPolicy.BLOCK.value)
+parser.add_argument("--spill-path", default=os.path.join(current_dir, "data/zmq_spill.bin"))
+# Rebid analysis worker processes, see analyzer/sharded_analyzer.py. Sessions
+# recorded with --record-rpc always run in a single process
+parser.add_argument("--shards", type=int, default=1)
+# Stage latencies and counters on http://127.0.0.1:<port>/metrics, and a
+# summary line every interval seconds; 0 disables either
+parser.add_argument("--metrics-port", type=int, default=9464)
+parser.add_argument("--metrics-interval", type=float, default=60)
+# Analyzer state snapshotted every interval seconds and restored on startup,
+# then the --record-dump (or --archive) records received since are replayed; single process
+# only, never with --record-rpc and only while recording, 0 disables
+parser.add_argument("--snapshot", default=os.path.join(current_dir, "data/analyzer.snapshot"))
+parser.add_argument("--snapshot-interval", type=float, default=60)
 
 if __name__ == '__main__':
+    started = time.perf_counter()
+    args = parser.parse_args()
+    snapshot_path = args.snapshot if args.snapshot_interval else None
+    dump_file_path = args.dump_file_path
     #message_handler = MultiHandler([
     #    PrintHandler(),
     #    WriteToFileHandler(dump_file_path)
     #])
-    message_handler = RebidHandler(current_dir)
-    print("Starting ZMQHandler")
+    if args.archive and args.record_dump:
+        parser.error("--archive records instead of --record-dump, give one of them")
+    record_dump = args.record_dump
+    if args.record_rpc and not args.archive and record_dump is None:
+        record_dump = os.path.join(current_dir, default_binary_file_name)
+    # only a dump this session writes, never a leftover one
+    record_path = args.archive or record_dump
+    routes = None
+    if record_path is not None:
+        client = prevout_cache = None
+        if args.record_rpc:
+            fixture_store = RpcFixtureStore(args.record_rpc)
+            client = RecordingProxy(fixture_store, btc_conf_file=os.path.join(current_dir, "networking/.env"))
+            # as on replay: parents the warm on-disk cache would serve are never requested, so never recorded
+            prevout_cache = PrevoutCache()
+            # the replay starts empty too, a restored state and its catch-up records would change the output
+            snapshot_path = None
+        dump_handler = ArchiveDumpHandler(args.archive, args.archive_commit_interval) if args.archive else BinaryDumpHandler(record_dump)
+        # the rawtx recovered after a gap are recorded too, so a replay handles them
+        rebid_handler = RebidHandler(current_dir, client=client, shards=1 if args.record_rpc else args.shards, snapshot_path=snapshot_path,
+                                     snapshot_interval=args.snapshot_interval, catch_up_path=record_path, prevout_cache=prevout_cache,
+                                     dump_handler=dump_handler)
+        routes = [
+            # everything is recorded, the analysis drops non-RBF transactions before they are decoded
+            Route("dump", dump_handler,
+                  queue_size=args.queue_size, overload=OverloadPolicy(args.dump_overload), spill_path=args.spill_path + ".dump"),
+            Route("rebid", rebid_handler, message_filter=rebid_handler.accepts, topics=frozenset([b"rawtx", b"hashblock", b"sequence"]),
+                  queue_size=args.queue_size, overload=OverloadPolicy(args.overload), spill_path=args.spill_path),
+        ]
+        message_handler = message_filter = None
+    else:
+        if snapshot_path is not None:
+            # nothing would fill the gap between the snapshot and the restart
+            print("Snapshots need --record-dump or --archive, starting without")
+        message_handler = RebidHandler(current_dir, shards=args.shards, catch_up_path=None)
+        # drop non-RBF transactions before they are decoded
+        message_filter = message_handler.accepts
+    if args.metrics_port:
+        # a second instance, or anything else on the port, must not stop the capture
+        try:
+            print("Serving metrics on {}".format(MetricsServer(METRICS, port=args.metrics_port).start().url))
+        except OSError as err:
+            print("Could not serve metrics on port {}: {}".format(args.metrics_port, err))
+    if args.metrics_interval:
+        MetricsReporter(METRICS, interval=args.metrics_interval).start()
+    print("Ready in {:.2f}s, starting ZMQHandler".format(time.perf_counter() - started))
     
     zmqHandler = ZMQHandler(
         message_handler=message_handler,
-        sub_topic=["rawtx","hashblock"] 
+        # sequence keeps the mempool state and reports reorgs, hashblock
+        # stays as a fallback and is deduplicated against it
+        sub_topic=["rawtx","hashblock","sequence"],
+        message_filter=message_filter,
+        queue_size=args.queue_size,
+        overload=OverloadPolicy(args.overload),
+        spill_path=args.spill_path,
+        routes=routes,
+        endpoints=args.zmq,
     )
     zmqHandler.start()
-
+    if args.record_rpc:
+        fixture_store.close()
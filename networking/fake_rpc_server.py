@@ -0,0 +1,247 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+from bitcoin.core import CBlock, CTransaction, b2lx, b2x
+
+"""
+    Local stand-in for the subset of the bitcoind JSON-RPC interface used by
+    the analyzer. It serves transactions and blocks from memory, understands
+    JSON-RPC batches, and counts HTTP round-trips and individual RPC calls so
+    benchmarks can compare access patterns without a node.
+
+        server = FakeBitcoinRpcServer(latency=0.002)
+        server.add_transaction(parent_tx)
+        server.start()
+        client = Proxy(service_url=server.url)
+"""
+
+RPC_MISC_ERROR = -1
+RPC_INVALID_ADDRESS_OR_KEY = -5
+RPC_METHOD_NOT_FOUND = -32601
+
+
+def _script_asm(script) -> str:
+    return " ".join(element.hex() if isinstance(element, bytes) else str(element) for element in script)
+
+
+def _decode_input(input, witness) -> dict:
+    decoded = {
+        "txid": b2lx(input.prevout.hash),
+        "vout": input.prevout.n,
+        "scriptSig": {"asm": _script_asm(input.scriptSig), "hex": b2x(input.scriptSig)},
+    }
+    if witness is not None and witness.scriptWitness.stack:
+        decoded["txinwitness"] = [b2x(item) for item in witness.scriptWitness.stack]
+    decoded["sequence"] = input.nSequence
+    return decoded
+
+
+class FakeRpcError(Exception):
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class FakeBitcoinRpcServer():
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, block_count: int = 0):
+        self.latency = latency
+        self.block_count = block_count
+        self.transactions: Dict[str, CTransaction] = {}
+        self.mempool: Dict[str, CTransaction] = {}
+        self.blocks: Dict[str, CBlock] = {}
+        # advances on every mempool addition and removal, like bitcoind's
+        self.mempool_sequence = 1
+        self.http_requests = 0
+        self.rpc_calls = 0
+        self.bytes_sent = 0
+        # TCP connections accepted, keep-alive clients reuse theirs
+        self.connections = 0
+        # the next `overloaded` requests are turned away as a busy bitcoind
+        # does, with a 503 "Work queue depth exceeded"
+        self.overloaded = 0
+        self.rejected = 0
+        # txid -> getrawtransaction calls still answered with RPC_MISC_ERROR,
+        # as a node fails a lookup it should serve
+        self.failing: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_request_handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://user:pass@{host}:{port}"
+
+    def add_transaction(self, tx: CTransaction, in_mempool: bool = False):
+        txid = b2lx(tx.GetTxid())
+        self.transactions[txid] = tx
+        if in_mempool and txid not in self.mempool:
+            self.mempool[txid] = tx
+            self.mempool_sequence += 1
+
+    # Registers the block at the next height and confirms its transactions
+    def add_block(self, block: CBlock):
+        self.blocks[b2lx(block.GetHash())] = block
+        for tx in block.vtx:
+            self.add_transaction(tx)
+            self.remove_from_mempool(b2lx(tx.GetTxid()))
+        self.block_count += 1
+
+    # Disconnects the tip, its transactions go back to the mempool
+    def disconnect_block(self, block: CBlock):
+        self.blocks.pop(b2lx(block.GetHash()), None)
+        for tx in block.vtx[1:]:
+            self.add_transaction(tx, in_mempool=True)
+        self.block_count -= 1
+
+    def remove_from_mempool(self, txid: str):
+        if self.mempool.pop(txid, None) is not None:
+            self.mempool_sequence += 1
+
+    def reset_counters(self):
+        with self._lock:
+            self.http_requests = 0
+            self.rpc_calls = 0
+            self.bytes_sent = 0
+            self.connections = 0
+            self.rejected = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def dispatch(self, method: str, params: list):
+        if method == "getblockcount":
+            return self.block_count
+        elif method == "getrawtransaction":
+            return self.getrawtransaction(*params)
+        elif method == "getblock":
+            return self.getblock(*params)
+        elif method == "getrawmempool":
+            return self.getrawmempool(*params)
+        raise FakeRpcError(RPC_METHOD_NOT_FOUND, "Method not found")
+
+    def getrawmempool(self, verbose=False, mempool_sequence=False):
+        if mempool_sequence:
+            return {"txids": list(self.mempool.keys()), "mempool_sequence": self.mempool_sequence}
+        return list(self.mempool.keys())
+
+    def getrawtransaction(self, txid: str, verbose=0, block_hash: Optional[str] = None):
+        if self.failing.get(txid):
+            self.failing[txid] -= 1
+            raise FakeRpcError(RPC_MISC_ERROR, "getrawtransaction failed")
+        tx = self.transactions.get(txid)
+        if tx is None:
+            raise FakeRpcError(RPC_INVALID_ADDRESS_OR_KEY, "No such mempool or blockchain transaction. Use gettransaction for wallet transactions.")
+        raw = tx.serialize()
+        if not verbose:
+            return b2x(raw)
+        weight = tx.calc_weight()
+        return {
+            "txid": txid,
+            "hash": b2lx(tx.GetHash()),
+            "version": tx.nVersion,
+            "size": len(raw),
+            "vsize": (weight + 3) // 4,
+            "weight": weight,
+            "locktime": tx.nLockTime,
+            # decoded like bitcoind does, so verbose answers weigh what a node's do
+            "vin": [_decode_input(input, tx.wit.vtxinwit[i] if tx.wit.vtxinwit else None) for i, input in enumerate(tx.vin)],
+            "vout": [
+                {
+                    "value": output.nValue / 100_000_000,
+                    "n": n,
+                    "scriptPubKey": {"asm": _script_asm(output.scriptPubKey), "desc": "raw({})#00000000".format(b2x(output.scriptPubKey)), "hex": b2x(output.scriptPubKey), "type": "witness_v0_keyhash"},
+                }
+                for n, output in enumerate(tx.vout)
+            ],
+            "hex": b2x(raw),
+        }
+
+    def getblock(self, block_hash: str, verbosity=1):
+        block = self.blocks.get(block_hash)
+        if block is None:
+            raise FakeRpcError(RPC_INVALID_ADDRESS_OR_KEY, "Block not found")
+        if verbosity == 0 or verbosity is False:
+            return b2x(block.serialize())
+        return {
+            "hash": block_hash,
+            "height": list(self.blocks).index(block_hash),
+            "tx": [b2lx(tx.GetTxid()) for tx in block.vtx],
+        }
+
+    def _handle_one(self, request: dict) -> dict:
+        with self._lock:
+            self.rpc_calls += 1
+        response = {"id": request.get("id"), "result": None, "error": None}
+        try:
+            response["result"] = self.dispatch(request.get("method"), list(request.get("params", [])))
+        except FakeRpcError as err:
+            response["error"] = {"code": err.code, "message": err.message}
+        return response
+
+    def handle_payload(self, payload):
+        if isinstance(payload, list):
+            return [self._handle_one(request) for request in payload]
+        return self._handle_one(payload)
+
+    def _make_request_handler(self):
+        server = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length))
+                if server.latency:
+                    time.sleep(server.latency)
+                with server._lock:
+                    overloaded = server.overloaded > 0
+                    if overloaded:
+                        server.overloaded -= 1
+                        server.rejected += 1
+                if overloaded:
+                    body = b"Work queue depth exceeded"
+                    self.send_response(503)
+                    self.send_header("Content-Type", "text/html; charset=ISO-8859-1")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                body = json.dumps(server.handle_payload(payload)).encode()
+                with server._lock:
+                    server.http_requests += 1
+                    server.bytes_sent += len(body)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return RequestHandler
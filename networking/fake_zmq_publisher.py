@@ -0,0 +1,109 @@
+import struct
+import time
+from array import array
+from typing import Callable, Collection, Dict, Iterable, List, Optional, Tuple
+
+import zmq
+
+from encoding.dump_archive import open_records
+
+"""
+    Local stand-in for the ZMQ publisher of bitcoind. It sends a schedule of
+    (offset ns, topic, body) frames as bitcoind would, [topic, body, sequence]
+    with a sequence per topic, at `speed` times the schedule's pace (0 sends
+    as fast as possible). Schedules come from a captured dump (load_schedule)
+    or are built, see benchmarks/synthetic.py make_rbf_storm.
+
+        publisher = FakeZmqPublisher("tcp://127.0.0.1:28332")
+        publisher.wait_subscribed([b"rawtx", b"hashblock"])
+        publisher.publish(schedule, speed=10)
+
+    The socket is an XPUB, which sees subscriptions arrive, so nothing is sent
+    before the subscriber is listening. Like bitcoind's (-zmqpub*hwm), it
+    drops frames beyond sndhwm queued for a slow subscriber.
+"""
+
+# (offset from the start in ns, ZMQ topic, body), in offset order
+Schedule = List[Tuple[int, bytes, bytes]]
+
+
+# Frames of the given topics of a binary dump or an archive, at the pace they
+# were received
+def load_schedule(path: str, topics: Iterable[bytes] = (b"rawtx", b"hashblock")) -> Schedule:
+    topics = frozenset(topics)
+    schedule: Schedule = []
+    first: Optional[int] = None
+    with open_records(path) as reader:
+        for record in reader:
+            if record.topic not in topics:
+                continue
+            if first is None:
+                first = record.monotonic_ns
+            schedule.append((record.monotonic_ns - first, record.topic, bytes(record.body)))
+    return schedule
+
+
+# Offsets by topic and sequence, as publish() numbers the frames
+def schedule_offsets(schedule: Schedule) -> Dict[bytes, array]:
+    offsets: Dict[bytes, array] = {}
+    for offset, topic, _ in schedule:
+        topic_offsets = offsets.get(topic)
+        if topic_offsets is None:
+            topic_offsets = offsets[topic] = array("q")
+        topic_offsets.append(offset)
+    return offsets
+
+
+class FakeZmqPublisher():
+    # "tcp://127.0.0.1:*" binds a free port, endpoint is then the one bound
+    def __init__(self, endpoint: str = "tcp://127.0.0.1:28332", sndhwm: int = 1000):
+        self.context = zmq.Context()
+        self.socket = self.context.socket(zmq.XPUB)
+        self.socket.setsockopt(zmq.SNDHWM, sndhwm)
+        self.socket.bind(endpoint)
+        self.endpoint = self.socket.getsockopt_string(zmq.LAST_ENDPOINT)
+        self.published = 0
+        # furthest behind the schedule a frame was sent
+        self.max_late_ns = 0
+
+    # Waits until a subscriber subscribed to every topic
+    def wait_subscribed(self, topics: Iterable[bytes], timeout: float = 10.0):
+        missing = set(topics)
+        deadline = time.monotonic() + timeout
+        while missing:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.socket.poll(remaining * 1000):
+                raise TimeoutError("no subscriber for {}".format(sorted(missing)))
+            event = self.socket.recv()
+            if event[:1] == b"\x01":
+                missing.discard(event[1:])
+
+    # Sends the schedule starting at start_ns (time.monotonic_ns, now when
+    # None); before_send(topic, body) runs before each frame, e.g. to register
+    # a block with the fake RPC server. The frames at the positions in `lose`
+    # are numbered but not sent, as if lost on the way. Returns the start used
+    def publish(self, schedule: Schedule, speed: float = 1.0, start_ns: Optional[int] = None,
+                before_send: Optional[Callable[[bytes, bytes], None]] = None, lose: Collection[int] = ()) -> int:
+        start_ns = time.monotonic_ns() if start_ns is None else start_ns
+        sequences: Dict[bytes, int] = {}
+        for position, (offset, topic, body) in enumerate(schedule):
+            if speed:
+                due = start_ns + int(offset / speed)
+                wait = due - time.monotonic_ns()
+                if wait > 1_000_000:
+                    time.sleep(wait / 1e9)
+                else:
+                    self.max_late_ns = max(self.max_late_ns, -wait)
+            if before_send is not None:
+                before_send(topic, body)
+            sequence = sequences.get(topic, 0)
+            sequences[topic] = sequence + 1
+            if position in lose:
+                continue
+            self.socket.send_multipart([topic, body, struct.pack("<I", sequence & 0xffffffff)])
+            self.published += 1
+        return start_ns
+
+    def close(self):
+        self.socket.close(linger=1000)
+        self.context.term()
@@ -0,0 +1,443 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+"""
+    Stage latencies and counters of the pipeline, exposed in the Prometheus
+    text format and summarized in a periodic log line.
+
+    Latencies go to log-linear histograms in the style of HdrHistogram: 32
+    sub-buckets per power of two, so any recorded value is known within ~3%,
+    in a fixed list of about 1300 counters covering 1 ns to 9 hours. Recording
+    is a bit_length, a shift and an increment, without a lock: a histogram is
+    written by the thread running its stage. A stage run by several threads,
+    like the queue wait and frame decode of every FrameWorker, takes a
+    SharedHistogram, which keeps a histogram per thread and merges them when
+    read. Histograms of other processes (the shards) are merged by adding
+    their counters.
+
+    Instrumented code takes its histogram or counter once and records on it:
+
+        DESERIALIZE = METRICS.histogram("stage_seconds", stage="deserialize")
+        start = time.perf_counter_ns()
+        ...
+        DESERIALIZE.record(time.perf_counter_ns() - start)
+
+    and objects owning a state register a gauge reading it on scrape:
+
+        METRICS.gauge("tracked_groups", lambda: len(self.transactions))
+
+        MetricsServer(METRICS, port=9464).start()   # GET /metrics
+        MetricsReporter(METRICS, interval=60).start()
+"""
+
+PREFIX = "ordinarb_"
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+# values past 2**45 ns are clamped to the last bucket
+MAX_SHIFT = 45 - SUB_BUCKET_BITS
+BUCKETS = (MAX_SHIFT + 2) * SUB_BUCKETS
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+# stages summarized by the log line, in pipeline order
+LOG_STAGES = ("receive", "queue_wait", "decode", "replay_decode", "deserialize", "resolve_prevouts", "process_transaction", "block_flush")
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def bucket_index(value: int) -> int:
+    if value < 2 * SUB_BUCKETS:
+        return value if value > 0 else 0
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    return shift * SUB_BUCKETS + (value >> shift) if shift <= MAX_SHIFT else BUCKETS - 1
+
+
+# Highest value recorded into bucket `index`
+def bucket_upper(index: int) -> int:
+    if index < 2 * SUB_BUCKETS:
+        return index
+    shift = index // SUB_BUCKETS - 1
+    return ((index - shift * SUB_BUCKETS + 1) << shift) - 1
+
+
+class Histogram():
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts: List[int] = [0] * BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    # value in nanoseconds, bucket_index inlined
+    def record(self, value: int):
+        if value >= 2 * SUB_BUCKETS:
+            shift = value.bit_length() - SUB_BUCKET_BITS - 1
+            self.counts[shift * SUB_BUCKETS + (value >> shift) if shift <= MAX_SHIFT else BUCKETS - 1] += 1
+            if value > self.max:
+                self.max = value
+        else:
+            self.counts[value if value > 0 else 0] += 1
+        self.count += 1
+        self.total += value
+
+    def percentile(self, quantile: float) -> int:
+        if not self.count:
+            return 0
+        rank = max(1, int(quantile * self.count + 0.5))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bucket_upper(index), max(self.max, 2 * SUB_BUCKETS - 1))
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def copy(self) -> "Histogram":
+        copied = Histogram()
+        copied.merge(self)
+        return copied
+
+    def merge(self, other: "Histogram"):
+        counts = self.counts
+        for index, count in enumerate(other.counts):
+            if count:
+                counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    # The recorded state, reset in place (the instrumented code keeps its reference)
+    def take(self) -> Tuple[List[int], int, int, int]:
+        taken = (self.counts, self.count, self.total, self.max)
+        self.counts, self.count, self.total, self.max = [0] * BUCKETS, 0, 0, 0
+        return taken
+
+    # What was recorded since `previous`, a copy taken earlier; max is the overall one
+    def since(self, previous: "Histogram") -> "Histogram":
+        delta = Histogram()
+        delta.counts = [count - before for count, before in zip(self.counts, previous.counts)]
+        delta.count = self.count - previous.count
+        delta.total = self.total - previous.total
+        delta.max = self.max
+        return delta
+
+
+class SharedHistogram():
+    """A histogram recorded by several threads: each thread records, without
+    a lock, into a Histogram of its own, merged when read."""
+
+    def __init__(self):
+        self.parts: List[Histogram] = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    # The histogram of the calling thread
+    def part(self) -> Histogram:
+        try:
+            return self.local.histogram
+        except AttributeError:
+            histogram = self.local.histogram = Histogram()
+            with self.lock:
+                self.parts.append(histogram)
+            return histogram
+
+    def record(self, value: int):
+        self.part().record(value)
+
+    def merge(self, other: Histogram):
+        self.part().merge(other)
+
+    def copy(self) -> Histogram:
+        merged = Histogram()
+        with self.lock:
+            parts = list(self.parts)
+        for part in parts:
+            merged.merge(part)
+        return merged
+
+    def take(self) -> Tuple[List[int], int, int, int]:
+        taken = Histogram()
+        with self.lock:
+            parts = list(self.parts)
+        for part in parts:
+            counts, taken_count, total, maximum = part.take()
+            other = Histogram()
+            other.counts, other.count, other.total, other.max = counts, taken_count, total, maximum
+            taken.merge(other)
+        return taken.counts, taken.count, taken.total, taken.max
+
+    def percentile(self, quantile: float) -> int:
+        return self.copy().percentile(quantile)
+
+    def since(self, previous: Histogram) -> Histogram:
+        return self.copy().since(previous)
+
+    @property
+    def count(self) -> int:
+        return sum(part.count for part in self.parts)
+
+    @property
+    def total(self) -> int:
+        return sum(part.total for part in self.parts)
+
+    @property
+    def max(self) -> int:
+        return max((part.max for part in self.parts), default=0)
+
+    @property
+    def mean(self) -> float:
+        count = self.count
+        return self.total / count if count else 0.0
+
+
+class Counter():
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        self.value += amount
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, value.replace("\\", "\\\\").replace('"', '\\"')) for name, value in pairs) + "}"
+
+
+class Metrics():
+    """Registry of the histograms, counters and gauges of a process."""
+
+    def __init__(self):
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self.counters: Dict[Tuple[str, Labels], Counter] = {}
+        self.gauges: Dict[Tuple[str, Labels], Callable[[], float]] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, **labels) -> Histogram:
+        return self._histogram(Histogram, name, labels)
+
+    # For a stage recorded by several threads
+    def shared_histogram(self, name: str, **labels) -> SharedHistogram:
+        return self._histogram(SharedHistogram, name, labels)
+
+    def _histogram(self, kind: type, name: str, labels: Dict[str, str]) -> Histogram:
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = kind()
+            return histogram
+
+    def counter(self, name: str, **labels) -> Counter:
+        key = (name, _labels(labels))
+        with self._lock:
+            counter = self.counters.get(key)
+            if counter is None:
+                counter = self.counters[key] = Counter()
+            return counter
+
+    # Replaces the gauge of the same name and labels, e.g. from a newer analyzer
+    def gauge(self, name: str, read: Callable[[], float], **labels):
+        with self._lock:
+            self.gauges[(name, _labels(labels))] = read
+
+    def read_gauges(self) -> Dict[Tuple[str, Labels], float]:
+        with self._lock:
+            gauges = list(self.gauges.items())
+        values = {}
+        for key, read in gauges:
+            try:
+                values[key] = float(read())
+            except Exception:
+                # a gauge of an object being torn down must not break the scrape
+                continue
+        return values
+
+    # Everything recorded since the last drain, and resets it in place (the
+    # instrumented code keeps its references). Shard processes send this to
+    # the dispatcher, which merges it
+    def drain(self) -> dict:
+        drained: dict = {"histograms": {}, "counters": {}}
+        with self._lock:
+            for key, histogram in self.histograms.items():
+                if histogram.count:
+                    drained["histograms"][key] = histogram.take()
+            for key, counter in self.counters.items():
+                if counter.value:
+                    drained["counters"][key] = counter.value
+                    counter.value = 0
+        return drained
+
+    def merge(self, drained: dict):
+        for (name, labels), (counts, count, total, maximum) in drained["histograms"].items():
+            other = Histogram()
+            other.counts, other.count, other.total, other.max = counts, count, total, maximum
+            self.histogram(name, **dict(labels)).merge(other)
+        for (name, labels), value in drained["counters"].items():
+            self.counter(name, **dict(labels)).inc(value)
+
+    # Prometheus text exposition format, version 0.0.4. Histograms are
+    # exported as summaries, in seconds
+    def exposition(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+        typed = set()
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                lines.append("# TYPE {}{} summary".format(PREFIX, name))
+                typed.add(name)
+            # one consistent view, and the threads of a SharedHistogram merged once
+            histogram = histogram.copy()
+            for quantile in QUANTILES:
+                lines.append("{}{}{} {}".format(PREFIX, name, _format_labels(labels, (("quantile", str(quantile)),)), histogram.percentile(quantile) / 1e9))
+            lines.append("{}{}_sum{} {}".format(PREFIX, name, _format_labels(labels), histogram.total / 1e9))
+            lines.append("{}{}_count{} {}".format(PREFIX, name, _format_labels(labels), histogram.count))
+        for (name, labels), counter in counters:
+            if name not in typed:
+                lines.append("# TYPE {}{} counter".format(PREFIX, name))
+                typed.add(name)
+            lines.append("{}{}{} {}".format(PREFIX, name, _format_labels(labels), counter.value))
+        for (name, labels), value in sorted(self.read_gauges().items()):
+            if name not in typed:
+                lines.append("# TYPE {}{} gauge".format(PREFIX, name))
+                typed.add(name)
+            lines.append("{}{}{} {}".format(PREFIX, name, _format_labels(labels), value))
+        return "\n".join(lines) + "\n"
+
+
+# The registry of this process
+METRICS = Metrics()
+
+
+class MetricsServer():
+    """Serves GET /metrics on a daemon thread."""
+
+    def __init__(self, metrics: Metrics = METRICS, port: int = 9464, host: str = "127.0.0.1"):
+        self.metrics = metrics
+        self._server = ThreadingHTTPServer((host, port), self._make_request_handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _make_request_handler(self):
+        metrics = self.metrics
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.exposition().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return RequestHandler
+
+
+def _duration(nanoseconds: float) -> str:
+    if nanoseconds >= 1e9:
+        return "{:.2f}s".format(nanoseconds / 1e9)
+    if nanoseconds >= 1e6:
+        return "{:.1f}ms".format(nanoseconds / 1e6)
+    return "{:.0f}us".format(nanoseconds / 1e3)
+
+
+# pipeline stages first, then the other histograms by name
+def _log_order(name: str, labels: Labels):
+    stage = dict(labels).get("stage")
+    return (stage is None, LOG_STAGES.index(stage) if stage in LOG_STAGES else len(LOG_STAGES), name, labels)
+
+
+class MetricsReporter():
+    """Prints one line every `interval` seconds: message rates per topic, p50
+    and p99 of every stage over the interval, RPC calls, and the gauges."""
+
+    def __init__(self, metrics: Metrics = METRICS, interval: float = 60.0):
+        self.metrics = metrics
+        self.interval = interval
+        self.previous_histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self.previous_counters: Dict[Tuple[str, Labels], int] = {}
+        self.last = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-reporter", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            print(self.line())
+
+    def line(self) -> str:
+        now = time.monotonic()
+        elapsed, self.last = max(now - self.last, 1e-9), now
+        with self.metrics._lock:
+            histograms = dict(self.metrics.histograms)
+            counters = dict(self.metrics.counters)
+        parts = []
+        rates = []
+        for (name, labels), counter in sorted(counters.items()):
+            delta = counter.value - self.previous_counters.get((name, labels), 0)
+            self.previous_counters[(name, labels)] = counter.value
+            if name == "zmq_messages_total":
+                rates.append("{}={:.1f}/s".format(dict(labels).get("topic"), delta / elapsed))
+        if rates:
+            parts.append(" ".join(rates))
+        for (name, labels), histogram in sorted(histograms.items(), key=lambda item: _log_order(*item[0])):
+            current = histogram.copy()
+            previous = self.previous_histograms.get((name, labels))
+            self.previous_histograms[(name, labels)] = current
+            interval = current.since(previous) if previous is not None else current
+            if not interval.count:
+                continue
+            label = dict(labels).get("stage", name.removesuffix("_seconds"))
+            if "handler" in dict(labels):
+                label = "{}[{}]".format(label, dict(labels)["handler"])
+            parts.append("{} n={} p50={} p99={}".format(label, interval.count, _duration(interval.percentile(0.5)), _duration(interval.percentile(0.99))))
+        gauges = self.metrics.read_gauges()
+        if gauges:
+            parts.append(" ".join("{}{}={:g}".format(name, "[{}]".format(",".join(value for _, value in labels)) if labels else "", round(value, 3))
+                                  for (name, labels), value in sorted(gauges.items())))
+        return "metrics {:.0f}s: {}".format(elapsed, " | ".join(parts) if parts else "idle")
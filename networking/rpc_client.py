@@ -0,0 +1,345 @@
+import asyncio
+import base64
+import concurrent.futures
+import decimal
+import json
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import ParseResult, urlparse
+
+from bitcoin.rpc import DEFAULT_HTTP_TIMEOUT, DEFAULT_USER_AGENT, JSONRPCError, Proxy
+
+from networking.metrics import METRICS
+
+"""
+    Async, keep-alive, pooled JSON-RPC client for bitcoind.
+
+    AsyncRpcClient keeps up to `pool_size` persistent HTTP/1.1 connections
+    and sends single calls or batches over them, with a per-call timeout and
+    retries on connection errors, timeouts and overloaded (5xx) answers.
+    Identical requests already in flight are coalesced: the second caller
+    awaits the first one's answer instead of sending its own, so rebids of one
+    group asking for the same parent at the same moment cost one call.
+
+    Every client runs on one background event loop per process and
+    shared_client() hands out one client per node, so the whole process goes
+    through the same connection pool. Synchronous code uses PooledProxy, a
+    drop-in bitcoin.rpc.Proxy, async code on another loop awaits
+    asyncio.wrap_future(client.submit(...)).
+
+        proxy = PooledProxy(btc_conf_file="networking/.env")
+        proxy.getblockcount()
+"""
+
+# Raised by the transport when the attempt may succeed on a retry
+RETRYABLE = (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, OSError)
+RPC_HTTP_ERROR = -342
+
+# one observation per HTTP request, a batch included
+RPC_REQUEST = METRICS.histogram("rpc_request_seconds")
+RPC_COALESCED = METRICS.counter("rpc_coalesced_total")
+RPC_RETRIES = METRICS.counter("rpc_retries_total")
+
+
+class RetryableHttpError(ConnectionError):
+    pass
+
+
+def basic_auth(user: str, password: str) -> bytes:
+    return b"Basic " + base64.b64encode("{}:{}".format(user, password).encode())
+
+
+def _call_key(method: str, params) -> str:
+    return json.dumps([method, list(params)], separators=(',', ':'), default=str)
+
+
+class _Connection():
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncRpcClient():
+    def __init__(self, url: str, auth_header: Optional[bytes] = None, pool_size: int = 4, timeout: float = DEFAULT_HTTP_TIMEOUT,
+                 retries: int = 2, backoff: float = 0.05, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.url: ParseResult = urlparse(url)
+        if self.url.scheme != "http":
+            raise ValueError("Unsupported URL scheme {!r}".format(self.url.scheme))
+        if auth_header is None and self.url.username is not None:
+            auth_header = basic_auth(self.url.username, self.url.password)
+        self.auth_header = auth_header
+        self.pool_size = max(1, pool_size)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.loop = loop if loop is not None else background_loop()
+        self.idle: List[_Connection] = []
+        self.slots: Optional[asyncio.Semaphore] = None
+        # call key -> future of the JSON-RPC response of the request in flight
+        self.in_flight: Dict[str, asyncio.Future] = {}
+        self.next_id = 0
+        self.calls = 0
+        self.coalesced = 0
+        self.http_requests = 0
+        self.retried = 0
+        self.connections_opened = 0
+
+    # Runs a coroutine of this client on its loop, from any thread
+    def submit(self, coroutine) -> concurrent.futures.Future:
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    # The JSON-RPC response object ({'result', 'error', 'id'}) of one call
+    async def request(self, method: str, params: list, timeout: Optional[float] = None) -> dict:
+        return (await self.batch([(method, params)], timeout))[0]
+
+    async def call(self, method: str, *params, timeout: Optional[float] = None):
+        response = await self.request(method, list(params), timeout)
+        err = response.get('error')
+        if err is not None:
+            raise JSONRPCError({'code': err.get('code', -345), 'message': err.get('message', 'error message not specified')})
+        return response['result']
+
+    # Sends the calls not already in flight in one POST and returns the
+    # response of every call, in order. Errors of single calls are returned
+    # in their response, transport failures raise.
+    async def batch(self, calls: List[Tuple[str, list]], timeout: Optional[float] = None) -> List[dict]:
+        futures: List[asyncio.Future] = []
+        to_send: List[Tuple[str, str, list, asyncio.Future]] = []
+        for method, params in calls:
+            self.calls += 1
+            METRICS.counter("rpc_calls_total", method=method).inc()
+            key = _call_key(method, params)
+            future = self.in_flight.get(key)
+            if future is None:
+                future = self.loop.create_future()
+                self.in_flight[key] = future
+                to_send.append((key, method, list(params), future))
+            else:
+                self.coalesced += 1
+                RPC_COALESCED.inc()
+            futures.append(future)
+        if to_send:
+            # a task, so the callers coalesced on it get their answer even if this one is cancelled
+            self.loop.create_task(self._send(to_send, timeout if timeout is not None else self.timeout))
+        responses = await asyncio.gather(*(asyncio.shield(future) for future in futures))
+        return [dict(response) for response in responses]
+
+    async def close(self):
+        for connection in self.idle:
+            connection.close()
+        self.idle = []
+
+    def stats(self) -> dict:
+        return {
+            'calls': self.calls,
+            'coalesced': self.coalesced,
+            'http_requests': self.http_requests,
+            'retries': self.retried,
+            'connections_opened': self.connections_opened,
+            'idle_connections': len(self.idle),
+        }
+
+    async def _send(self, entries: List[Tuple[str, str, list, asyncio.Future]], timeout: float):
+        try:
+            ids = {}
+            payload = []
+            for key, method, params, future in entries:
+                self.next_id += 1
+                ids[self.next_id] = future
+                payload.append({'version': '1.1', 'method': method, 'params': params, 'id': self.next_id})
+            answer = await self._post(json.dumps(payload[0] if len(payload) == 1 else payload).encode(), timeout)
+            if isinstance(answer, dict) and len(payload) == 1:
+                answer = [answer]
+            if not isinstance(answer, list):
+                # bitcoind answers a rejected batch with a single error object
+                raise JSONRPCError(answer.get('error') or {'code': -344, 'message': str(answer)})
+            for response in answer:
+                future = ids.pop(response.get('id'), None)
+                if future is not None and not future.done():
+                    future.set_result({'result': response.get('result'), 'error': response.get('error'), 'id': response.get('id')})
+            for future in ids.values():
+                if not future.done():
+                    future.set_exception(JSONRPCError({'code': -343, 'message': 'missing JSON-RPC result'}))
+        except BaseException as err:
+            for _, _, _, future in entries:
+                if not future.done():
+                    future.set_exception(err)
+            if not isinstance(err, Exception):
+                raise
+        finally:
+            for key, _, _, future in entries:
+                if self.in_flight.get(key) is future:
+                    del self.in_flight[key]
+
+    async def _post(self, body: bytes, timeout: float):
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.pool_size)
+        attempt = 0
+        while True:
+            async with self.slots:
+                connection = self.idle.pop() if self.idle else None
+                try:
+                    start = time.perf_counter_ns()
+                    if connection is None:
+                        connection = await asyncio.wait_for(self._connect(), timeout)
+                    status, keep_alive, data = await asyncio.wait_for(self._exchange(connection, body), timeout)
+                    RPC_REQUEST.record(time.perf_counter_ns() - start)
+                    self.http_requests += 1
+                    if keep_alive:
+                        self.idle.append(connection)
+                    else:
+                        connection.close()
+                    # back in the pool, an error answer must not close it
+                    connection = None
+                    return self._decode(status, data)
+                except RETRYABLE as err:
+                    if connection is not None:
+                        connection.close()
+                    if attempt >= self.retries:
+                        if isinstance(err, asyncio.TimeoutError):
+                            raise JSONRPCError({'code': RPC_HTTP_ERROR, 'message': 'timed out after {}s'.format(timeout)})
+                        raise JSONRPCError({'code': RPC_HTTP_ERROR, 'message': '{}: {}'.format(type(err).__name__, err)})
+                except BaseException:
+                    if connection is not None:
+                        connection.close()
+                    raise
+            attempt += 1
+            self.retried += 1
+            RPC_RETRIES.inc()
+            await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+
+    async def _connect(self) -> _Connection:
+        reader, writer = await asyncio.open_connection(self.url.hostname, self.url.port or 80)
+        self.connections_opened += 1
+        return _Connection(reader, writer)
+
+    async def _exchange(self, connection: _Connection, body: bytes) -> Tuple[int, bool, bytes]:
+        headers = [
+            "POST {} HTTP/1.1".format(self.url.path or "/"),
+            "Host: {}".format(self.url.hostname),
+            "User-Agent: {}".format(DEFAULT_USER_AGENT),
+            "Content-Type: application/json",
+            "Content-Length: {}".format(len(body)),
+            "Connection: keep-alive",
+        ]
+        if self.auth_header is not None:
+            headers.append("Authorization: {}".format(self.auth_header.decode()))
+        connection.writer.write(("\r\n".join(headers) + "\r\n\r\n").encode() + body)
+        await connection.writer.drain()
+
+        status_line = await connection.reader.readline()
+        if not status_line:
+            # an idle connection the server closed
+            raise ConnectionResetError("connection closed by the server")
+        version, status = status_line.split(b" ", 2)[:2]
+        response_headers: Dict[bytes, bytes] = {}
+        while True:
+            line = await connection.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.partition(b":")
+            response_headers[name.strip().lower()] = value.strip()
+        keep_alive = version == b"HTTP/1.1" and response_headers.get(b"connection", b"").lower() != b"close"
+        if response_headers.get(b"transfer-encoding", b"").lower() == b"chunked":
+            data = await self._read_chunked(connection.reader)
+        elif b"content-length" in response_headers:
+            data = await connection.reader.readexactly(int(response_headers[b"content-length"]))
+        else:
+            data = await connection.reader.read()
+            keep_alive = False
+        return int(status), keep_alive, data
+
+    @staticmethod
+    async def _read_chunked(reader: asyncio.StreamReader) -> bytes:
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                await reader.readline()
+                return b"".join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+
+    # bitcoind answers RPC errors with a JSON body and a 4xx/5xx status
+    @staticmethod
+    def _decode(status: int, data: bytes):
+        try:
+            return json.loads(data.decode("utf8"), parse_float=decimal.Decimal)
+        except ValueError:
+            pass
+        if status == 401:
+            raise JSONRPCError({'code': RPC_HTTP_ERROR, 'message': 'authorization failed'})
+        if status >= 500:
+            # e.g. 503 "Work queue depth exceeded"
+            raise RetryableHttpError("HTTP {}: {}".format(status, data[:200].decode("utf8", "replace")))
+        raise JSONRPCError({'code': RPC_HTTP_ERROR, 'message': 'HTTP {}: {}'.format(status, data[:200].decode("utf8", "replace"))})
+
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_clients: Dict[Tuple[str, Optional[bytes]], AsyncRpcClient] = {}
+_lock = threading.Lock()
+
+
+# The process-wide loop the clients run on, started on first use
+def background_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="rpc-client", daemon=True).start()
+        return _loop
+
+
+def shared_client(url: str, auth_header: Optional[bytes] = None, **kwargs) -> AsyncRpcClient:
+    parsed = urlparse(url)
+    if auth_header is None and parsed.username is not None:
+        auth_header = basic_auth(parsed.username, parsed.password)
+    url = "http://{}:{}{}".format(parsed.hostname, parsed.port or 80, parsed.path or "/")
+    key = (url, auth_header)
+    loop = background_loop()
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = AsyncRpcClient(url, auth_header, loop=loop, **kwargs)
+        return client
+
+
+class PooledProxy(Proxy):
+    """bitcoin.rpc.Proxy sending its calls through the process-wide
+    AsyncRpcClient of the node, instead of its own blocking connection.
+    Safe to share between threads."""
+
+    def __init__(self, service_url=None, service_port=None, btc_conf_file=None, timeout=DEFAULT_HTTP_TIMEOUT, **client_options):
+        # parses the url, the conf file and the cookie like Proxy does
+        super().__init__(service_url=service_url, service_port=service_port, btc_conf_file=btc_conf_file, timeout=timeout)
+        url = self._BaseProxy__url
+        self.timeout = timeout
+        self.rpc = shared_client("http://{}:{}{}".format(url.hostname, url.port or 80, url.path), self._BaseProxy__auth_header, **client_options)
+
+    def _run(self, coroutine):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.rpc.loop:
+            coroutine.close()
+            raise RuntimeError("PooledProxy blocks, await the AsyncRpcClient from its own loop")
+        return self.rpc.submit(coroutine).result()
+
+    def _call(self, service_name, *args):
+        return self._run(self.rpc.call(service_name, *args, timeout=self.timeout))
+
+    def _batch(self, rpc_call_list):
+        calls = list(rpc_call_list)
+        responses = self._run(self.rpc.batch([(call['method'], call['params']) for call in calls], self.timeout))
+        for call, response in zip(calls, responses):
+            response['id'] = call['id']
+        return responses
+
+    # the connections belong to the shared client
+    def close(self):
+        pass
@@ -1,8 +1,7 @@
-import requests
-import json
 import os
 from os.path import dirname, join
 import atexit
+from networking.rpc_client import basic_auth, shared_client
 from networking.ssh_tunnel_handler import sshHandler
 
 
@@ -12,7 +11,7 @@ class BitcoinRpc:
         self.host = host
         self.port = port
         self.url = f'http://{host}:{port}/'
-        self.headers = {'content-type': 'application/json'}
+        self.client = shared_client(self.url, basic_auth(self.rpc_user, self.rpc_pass))
         self.ssh_tunnel = sshHandler()
         self.ssh_tunnel.create_tunnel()
         atexit.register(self.ssh_tunnel.kill_tunnel)
@@ -32,39 +31,11 @@ class BitcoinRpc:
         self.rpc_pass = os.getenv('RPCPASSWORD')
 
     def call(self, method: str, params: list = []):
-        payload = json.dumps({
-            "jsonrpc": "1.0",
-            "id": "python-bitcoinrpc",
-            "method": method,
-            "params": params
-        })
-
-        # Set the headers to 'text/plain'
-        headers = {'content-type': 'text/plain'}
-
-        # Prepare the request to send, this does not actually send the request
-        request = requests.Request('POST', self.url, data=payload, auth=(
-            self.rpc_user, self.rpc_pass), headers=headers)
-        prepared = request.prepare()
-
-        # Print the prepared request details
-        print("Prepared request details:")
-        print(f"Method: {prepared.method}")
-        print(f"URL: {prepared.url}")
-        print(f"Headers: {prepared.headers}")
-        print(f"Body: {prepared.body}")
-
+        # through the process-wide keep-alive pool, see networking/rpc_client.py
         try:
-            # Send the request
-            with requests.Session() as session:
-                response = session.send(prepared)
-                # Raises an HTTPError if the HTTP request returned an unsuccessful status code
-                response.raise_for_status()
-                return response.json()
-        except requests.exceptions.HTTPError as http_err:
-            print(f"HTTP error occurred: {http_err}")
+            return self.client.submit(self.client.request(method, list(params))).result()
         except Exception as err:
-            print(f"An error occurred: {err}")
+            print(f"An error occurred calling {method}: {err}")
 
     def get_block_count(self):
         return self.call("getblockcount")
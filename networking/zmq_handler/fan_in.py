@@ -0,0 +1,140 @@
+import hashlib
+from collections import deque
+from typing import Deque, Dict, FrozenSet, List, Optional
+
+from encoding.tx_scanner import scan_outputs
+from networking.metrics import METRICS
+
+"""
+    First-seen deduplication of the ZMQ streams of several nodes.
+
+    ZMQHandler subscribes to every endpoint with a socket of its own and asks
+    FanIn whether a frame is new. The first node to deliver a message wins:
+    its frame goes on with its receive time and the node's index as
+    `source`, and the copies the other nodes deliver later are dropped and
+    timed against it (source_delay_seconds). Messages are keyed per topic:
+
+        rawtx      the first 8 bytes of the txid: a copy whose witness was
+                   changed on the way is the same transaction, and not a
+                   bump of it. A body that does not parse is keyed on its
+                   8-byte blake2b digest
+        hashtx,    the first 8 bytes of the hash
+        hashblock
+        rawblock   the first 8 bytes of the header's digest
+
+    Keys are kept in a table per topic bounded to `capacity` entries, the
+    oldest forgotten first; a copy arriving after its key was forgotten goes
+    through again, so capacity covers how far behind a slow node can be.
+
+    Topics in primary_only are passed from the first endpoint only and never
+    deduplicated: the mempool sequence numbers of the sequence topic count
+    one node's mempool events, they cannot be interleaved with another's.
+
+    Every node numbers its messages per topic. Those sequences are followed
+    per source, and the messages a source skipped are counted as its gaps.
+"""
+
+
+class SourceStats():
+    __slots__ = ("endpoint", "received", "first", "duplicates", "gaps", "last_sequences", "delay")
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.received = 0
+        self.first = 0
+        self.duplicates = 0
+        self.gaps = 0
+        # ZMQ sequence of the last message per topic
+        self.last_sequences: Dict[bytes, int] = {}
+        self.delay = METRICS.histogram("source_delay_seconds", source=endpoint)
+
+    # Returns the number of messages skipped before this one
+    def note(self, topic: bytes, sequence: int) -> int:
+        self.received += 1
+        last = self.last_sequences.get(topic)
+        self.last_sequences[topic] = sequence
+        # a smaller sequence is a restarted node, nothing is counted
+        if last is not None and sequence > last + 1:
+            self.gaps += sequence - last - 1
+            return sequence - last - 1
+        return 0
+
+    def stats(self) -> dict:
+        return {
+            "endpoint": self.endpoint,
+            "received": self.received,
+            "first": self.first,
+            "duplicates": self.duplicates,
+            "gaps": self.gaps,
+        }
+
+
+class SeenTable():
+    """Receive time of the last `capacity` keys, forgotten in insertion order."""
+
+    __slots__ = ("capacity", "times", "order")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.times: Dict[int, int] = {}
+        self.order: Deque[int] = deque()
+
+    def first_seen(self, key: int) -> Optional[int]:
+        return self.times.get(key)
+
+    def add(self, key: int, monotonic_ns: int):
+        self.times[key] = monotonic_ns
+        self.order.append(key)
+        if len(self.order) > self.capacity:
+            del self.times[self.order.popleft()]
+
+    def __len__(self):
+        return len(self.times)
+
+
+def message_key(topic: bytes, body: bytes) -> int:
+    if topic == b"rawtx":
+        try:
+            # txid only, the inputs and outputs are stepped over
+            return int.from_bytes(scan_outputs(body)[0][:8], "little")
+        except Exception:
+            return int.from_bytes(hashlib.blake2b(body, digest_size=8).digest(), "little")
+    if topic == b"rawblock":
+        return int.from_bytes(hashlib.sha256(body[:80]).digest()[:8], "little")
+    return int.from_bytes(body[:8], "little")
+
+
+class FanIn():
+    def __init__(self, endpoints: List[str], capacity: int = 100_000, primary_only: FrozenSet[bytes] = frozenset([b"sequence"])):
+        self.endpoints = endpoints
+        self.capacity = capacity
+        self.primary_only = primary_only
+        self.sources = [SourceStats(endpoint) for endpoint in endpoints]
+        self.seen: Dict[bytes, SeenTable] = {}
+        for source in self.sources:
+            METRICS.gauge("zmq_source_first_seen", lambda source=source: source.first, source=source.endpoint)
+            METRICS.gauge("zmq_source_duplicates", lambda source=source: source.duplicates, source=source.endpoint)
+            METRICS.gauge("zmq_source_gaps", lambda source=source: source.gaps, source=source.endpoint)
+
+    # True when the frame is the first copy of its message and goes on,
+    # called from the event loop only
+    def accept(self, source: int, topic: bytes, sequence: int, body: bytes, monotonic_ns: int) -> bool:
+        stats = self.sources[source]
+        stats.note(topic, sequence)
+        if topic in self.primary_only:
+            return source == 0
+        table = self.seen.get(topic)
+        if table is None:
+            table = self.seen[topic] = SeenTable(self.capacity)
+        key = message_key(topic, body)
+        first_seen = table.first_seen(key)
+        if first_seen is not None:
+            stats.duplicates += 1
+            stats.delay.record(monotonic_ns - first_seen)
+            return False
+        table.add(key, monotonic_ns)
+        stats.first += 1
+        return True
+
+    def stats(self) -> List[dict]:
+        return [source.stats() for source in self.sources]
@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+from collections import deque
+from enum import Enum
+from typing import Deque, Dict, Optional, Tuple
+
+from encoding.dump_format import RECORD_HEADER, TOPICS, TOPIC_NAMES, DumpRecord
+
+"""
+    Bounded queue between the ZMQ receive task and the workers decoding and
+    handling messages.
+
+    The receive task only timestamps raw frames and puts them here as
+    DumpRecords, so a slow handler no longer delays the timestamps. When the
+    queue is full the overload policy decides what happens:
+
+        block        the receive task waits for room; libzmq buffers up to
+                     RCVHWM and drops beyond it
+        drop-oldest  the oldest queued frame is discarded
+        spill        frames overflow to a file in the binary dump record
+                     layout and are read back in order once the queue drains
+"""
+
+
+class OverloadPolicy(Enum):
+    BLOCK = "block"
+    DROP_OLDEST = "drop-oldest"
+    SPILL = "spill"
+
+
+class SpillFile():
+    """FIFO of records on disk, emptied and reused once drained."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "w+b")
+        self.read_offset = 0
+        self.write_offset = 0
+        self.count = 0
+        # DumpRecord.source and lost are not in the record layout, kept here
+        # by offset when either is set
+        self.extra: Dict[int, Tuple[int, int]] = {}
+
+    def append(self, record: DumpRecord):
+        self.file.seek(self.write_offset)
+        if record.source or record.lost:
+            self.extra[self.write_offset] = (record.source, record.lost)
+        self.file.write(RECORD_HEADER.pack(len(record.body), TOPICS[record.topic], record.sequence & 0xffffffff, record.monotonic_ns, record.wall_ns))
+        self.file.write(record.body)
+        self.write_offset = self.file.tell()
+        self.count += 1
+
+    def pop(self) -> DumpRecord:
+        self.file.seek(self.read_offset)
+        body_length, topic_id, sequence, monotonic_ns, wall_ns = RECORD_HEADER.unpack(self.file.read(RECORD_HEADER.size))
+        body = self.file.read(body_length)
+        source, lost = self.extra.pop(self.read_offset, (0, 0))
+        self.read_offset += RECORD_HEADER.size + body_length
+        self.count -= 1
+        if self.count == 0:
+            self.file.seek(0)
+            self.file.truncate()
+            self.read_offset = self.write_offset = 0
+        return DumpRecord(TOPIC_NAMES[topic_id], sequence, monotonic_ns, wall_ns, body, source=source, lost=lost)
+
+    def close(self):
+        self.file.close()
+        os.remove(self.path)
+
+
+class FrameQueue():
+    def __init__(self, maxsize: int = 10000, policy: OverloadPolicy = OverloadPolicy.BLOCK, spill_path: Optional[str] = None):
+        if policy is OverloadPolicy.SPILL and spill_path is None:
+            raise ValueError("the spill policy needs a spill_path")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.frames: Deque[DumpRecord] = deque()
+        self.spill = SpillFile(spill_path) if policy is OverloadPolicy.SPILL else None
+        self.condition = threading.Condition()
+        self.closed = False
+        self.received = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.high_water = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self.frames) + (self.spill.count if self.spill is not None else 0)
+
+    # Age of the oldest frame queued in memory, 0 when there is none
+    def backlog_ns(self) -> int:
+        frames = self.frames
+        try:
+            return time.monotonic_ns() - frames[0].monotonic_ns
+        except IndexError:
+            return 0
+
+    # Returns False instead of waiting when the queue is full under the block
+    # policy and block is False
+    def put(self, record: DumpRecord, block: bool = True) -> bool:
+        with self.condition:
+            if self.spill is not None and (self.spill.count or len(self.frames) >= self.maxsize):
+                # once spilling, later frames follow on disk to keep the order
+                self.spill.append(record)
+                self.spilled += 1
+            else:
+                if len(self.frames) >= self.maxsize:
+                    if self.policy is OverloadPolicy.DROP_OLDEST:
+                        self.frames.popleft()
+                        self.dropped += 1
+                    elif not block:
+                        return False
+                    else:
+                        while len(self.frames) >= self.maxsize and not self.closed:
+                            self.condition.wait()
+                self.frames.append(record)
+            self.received += 1
+            self.high_water = max(self.high_water, self.depth)
+            self.condition.notify_all()
+            return True
+
+    # Blocks until a frame is available, None once the queue is closed and drained
+    def get(self, timeout: Optional[float] = None) -> Optional[DumpRecord]:
+        with self.condition:
+            while not self.depth:
+                if self.closed or not self.condition.wait(timeout):
+                    return None
+            record = self.frames.popleft() if self.frames else self.spill.pop()
+            self.condition.notify_all()
+            return record
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth,
+            "high_water": self.high_water,
+            "received": self.received,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+        }
+
+    def release(self):
+        if self.spill is not None:
+            self.spill.close()
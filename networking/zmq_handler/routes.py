@@ -0,0 +1,49 @@
+from dataclasses import dataclass, field
+from typing import Callable, FrozenSet, Optional
+
+from encoding.dump_format import DumpRecord
+from networking.zmq_handler.frame_queue import OverloadPolicy
+
+"""
+    Handler routes of the ZMQ pipeline, see ZMQHandler(routes=...).
+
+    Each route has its own bounded FrameQueue, overload policy and worker, so
+    a handler blocked on RPC or on disk only delays itself: the receive task
+    puts every frame into the queue of each route subscribed to its topic and
+    moves on. A route's worker is a thread, a child process (the handler is
+    built there by handler_factory), or an asyncio loop on a thread awaiting
+    up to `concurrency` handle() coroutines at a time (1 keeps the order).
+
+    The routes share one SharedFrame per received frame: the body is the
+    bytes object received from the socket, never copied between queues, and
+    the message is decoded by the first thread worker reaching the frame and
+    reused by the others (two reaching it at once may both decode it, no lock
+    is taken for that). Shared messages are read-only for handlers.
+    Handlers with a handle_record(record) method are given the frame itself
+    and nothing is decoded for them. Process routes get a pickled copy.
+"""
+
+
+@dataclass
+class SharedFrame(DumpRecord):
+    # the decoded message, set by the first worker decoding it
+    decoded: object = field(default=None, repr=False, compare=False)
+
+
+@dataclass
+class Route:
+    name: str
+    message_handler: object = None
+    # raw-frame filter, like ZMQHandler's message_filter
+    message_filter: Optional[Callable[[bytes, bytes], bool]] = None
+    # topics routed to this handler, None for every topic
+    topics: Optional[FrozenSet[bytes]] = None
+    mode: str = "thread"
+    handler_factory: Optional[Callable[[int], object]] = None
+    queue_size: int = 10000
+    overload: OverloadPolicy = OverloadPolicy.BLOCK
+    spill_path: Optional[str] = None
+    concurrency: int = 1
+
+    def wants(self, topic: bytes) -> bool:
+        return self.topics is None or topic in self.topics
@@ -1,5 +1,15 @@
+import atexit
 import os
+import struct
+import threading
+from functools import partial
+from typing import Optional
 
+from analyzer.prevout_cache import PrevoutCache
+from analyzer.sharded_analyzer import ShardedMempoolAnalyzer, node_client
+from encoding.dump_archive import DumpArchiveWriter, GroupCommitter
+from encoding.dump_format import BinaryDumpWriter, DumpRecord, datetime_to_ns
+from networking.zmq_handler.zmq_objects import BlockHash, RawBlock, RawTransaction, SequenceNumber, TransactionHash
 from rebid_analysis import MempoolAnalyzer
 
 class PrintHandler():
@@ -11,16 +21,100 @@ class PrintHandler():
 
 
 class WriteToFileHandler():
-    def __init__(self, filename: str):
+    # Appends to a previous capture. A background thread flushes at most every
+    # flush_interval seconds rather than once per message, so the last lines
+    # reach the file even when no further message arrives, and close() flushes
+    # the rest at exit, like GroupCommitter
+    def __init__(self, filename: str, flush_interval: float = 1.0):
         self.filename = filename
         # check if file exists and if not create it
         if not os.path.exists(os.path.dirname(filename)):
             os.makedirs(os.path.dirname(filename))
-        self.file = open(filename, "w")
+        self.file = open(filename, "a")
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
 
     def handle(self, message):
-        self.file.write(str(message) + "\n")
-        self.file.flush()
+        with self.lock:
+            self.file.write(str(message) + "\n")
+            self.dirty = True
+
+    def flush(self):
+        with self.lock:
+            if self.dirty and not self.file.closed:
+                self.file.flush()
+                self.dirty = False
+
+    def close(self):
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        self.thread.join()
+        with self.lock:
+            self.file.close()
+
+    def _run(self):
+        while not self.closed.wait(self.flush_interval):
+            self.flush()
+
+
+class DumpHandler():
+    # Records the stream, a subclass writes each record in handle_record
+    def handle(self, message):
+        self.handle_record(self.to_record(message))
+
+    # The received frame itself, from a ZMQHandler worker, see routes.py
+    def handle_record(self, record: DumpRecord):
+        raise NotImplementedError
+
+    def to_record(self, message) -> DumpRecord:
+        if isinstance(message, RawTransaction):
+            topic, body = b"rawtx", bytes.fromhex(message.raw_tx)
+        elif isinstance(message, TransactionHash):
+            topic, body = b"hashtx", bytes.fromhex(message.tx_hash)
+        elif isinstance(message, BlockHash):
+            topic, body = b"hashblock", bytes.fromhex(message.block_hash)
+        elif isinstance(message, RawBlock):
+            topic, body = b"rawblock", bytes.fromhex(message.raw_block)
+        elif isinstance(message, SequenceNumber):
+            body = bytes.fromhex(message.seq_hash) + message.label.value.encode()
+            if message.mempool_sequence is not None:
+                body += struct.pack("<Q", message.mempool_sequence)
+            topic = b"sequence"
+        else:
+            raise ValueError("Unknown message type: {}".format(type(message)))
+        return DumpRecord(topic, message.sequence, message.monotonic_ns, datetime_to_ns(message.timestamp), body)
+
+
+class BinaryDumpHandler(DumpHandler):
+    # The analysis writes the rawtx it recovers from its own thread, see
+    # MempoolAnalyzer.backfill_lost
+    def __init__(self, filename: str):
+        super().__init__()
+        self.writer = BinaryDumpWriter(filename)
+        self.lock = threading.Lock()
+
+    def handle_record(self, record: DumpRecord):
+        with self.lock:
+            self.writer.write(record)
+
+
+class ArchiveDumpHandler(DumpHandler):
+    # Records go to a rotating, compressed archive directory, committed by a
+    # background thread, see encoding/dump_archive.py. A segment ends with
+    # each block
+    def __init__(self, directory: str, commit_interval: float = 1.0, rotate_bytes: int = 256 << 20):
+        super().__init__()
+        self.committer = GroupCommitter(DumpArchiveWriter(directory, rotate_bytes), commit_interval=commit_interval)
+        atexit.register(self.committer.close)
+
+    def handle_record(self, record: DumpRecord):
+        self.committer.write(record, rotate_after=record.topic == b"hashblock")
 
 
 class MultiHandler():
@@ -32,8 +126,30 @@ class MultiHandler():
             handler.handle(message)
 
 class RebidHandler():
-    def __init__(self, root_directory) -> None:
-        self.handler = MempoolAnalyzer(root_directory) 
+    # snapshot_path and catch_up_path only apply to a single process: the
+    # state is restored from the snapshot, then the records of the binary dump
+    # at catch_up_path received since are replayed. The rawtx the stream loses
+    # are backfilled from the node's mempool, see MempoolAnalyzer.handle_gap,
+    # and written to dump_handler, the handler recording the stream, if any.
+    # prevout_cache replaces data/prevout_cache.sqlite, single process only
+    def __init__(self, root_directory, client=None, shards: int = 1, snapshot_path: Optional[str] = None, snapshot_interval: float = 60,
+                 catch_up_path: Optional[str] = None, prevout_cache: Optional[PrevoutCache] = None, dump_handler: Optional[DumpHandler] = None) -> None:
+        if shards > 1:
+            self.handler = ShardedMempoolAnalyzer(
+                root_directory, shards, partial(node_client, root_directory), client=client,
+                cache_path=os.path.join(root_directory, "data/prevout_cache.sqlite"), backfill=True, dump_handler=dump_handler,
+            )
+        else:
+            self.handler = MempoolAnalyzer(root_directory, client=client, prevout_cache=prevout_cache, snapshot_path=snapshot_path,
+                                           snapshot_interval=snapshot_interval, backfill=True, dump_handler=dump_handler)
+            if catch_up_path is not None:
+                self.handler.catch_up(catch_up_path)
 
     def handle(self, message):
         self.handler.handle(message) 
+
+    def handle_gap(self, record: DumpRecord):
+        self.handler.handle_gap(record)
+
+    def accepts(self, topic: bytes, body: bytes) -> bool:
+        return self.handler.accepts_message(topic, body)
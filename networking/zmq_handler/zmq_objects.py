@@ -1,6 +1,7 @@
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields
 from abc import ABC, abstractmethod
 from datetime import datetime
+import time
 
 from enum import Enum
 
@@ -27,8 +28,9 @@ class ZMQMessage(ABC):
     def __str__(self):
         # Generate a nice string representation of the data class
         class_name = self.__class__.__name__
-        fields = ", ".join(f"{k}={v}" for k, v in vars(self).items())
-        return f"{class_name}({fields})"
+        # fields declared with repr=False are kept out of the text dump format
+        values = ", ".join(f"{f.name}={getattr(self, f.name)}" for f in fields(self) if f.repr)
+        return f"{class_name}({values})"
 
     @abstractmethod
     def message_type(self):
@@ -41,6 +43,7 @@ class TransactionHash(ZMQMessage):
     sequence: int
     tx_hash: str
     timestamp: datetime = field(default_factory=datetime.now)
+    monotonic_ns: int = field(default_factory=time.monotonic_ns, repr=False)
     
     def message_type(self):
         return "Transaction Hash"
@@ -53,6 +56,7 @@ class BlockHash(ZMQMessage):
     sequence: int
     block_hash: str
     timestamp: datetime = field(default_factory=datetime.now)
+    monotonic_ns: int = field(default_factory=time.monotonic_ns, repr=False)
 
     def message_type(self):
         return "Block Hash"
@@ -65,6 +69,9 @@ class RawTransaction(ZMQMessage):
     sequence: int
     raw_tx: str
     timestamp: datetime = field(default_factory=datetime.now)
+    monotonic_ns: int = field(default_factory=time.monotonic_ns, repr=False)
+    # the undecoded ZMQ body, so consumers can scan it without going through hex
+    raw_body: bytes = field(default=b"", repr=False)
 
     def message_type(self):
         return "Raw Transaction"
@@ -77,6 +84,7 @@ class RawBlock(ZMQMessage):
     sequence: int
     raw_block: str
     timestamp: datetime = field(default_factory=datetime.now)
+    monotonic_ns: int = field(default_factory=time.monotonic_ns, repr=False)
 
     def message_type(self):
         return "Raw Block"
@@ -91,6 +99,7 @@ class SequenceNumber(ZMQMessage):
     label: str
     mempool_sequence: int
     timestamp: datetime = field(default_factory=datetime.now)
+    monotonic_ns: int = field(default_factory=time.monotonic_ns, repr=False)
 
     def message_type(self):
         return "Sequence Number"
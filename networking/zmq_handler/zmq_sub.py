@@ -1,5 +1,16 @@
+import inspect
+import multiprocessing
 import struct
-from typing import List
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+from encoding.dump_format import DumpRecord
+from networking.metrics import METRICS, Counter, Histogram
+from networking.zmq_handler.fan_in import FanIn, SourceStats
+from networking.zmq_handler.frame_queue import FrameQueue, OverloadPolicy
+from networking.zmq_handler.routes import Route, SharedFrame
 from networking.zmq_handler.zmq_objects import BlockHash, TransactionHash, RawBlock, RawTransaction, RawBlock, SequenceNumber, Label
 
 from networking.zmq_handler.zmq_handlers import PrintHandler, WriteToFileHandler, MultiHandler
@@ -15,10 +26,23 @@ from networking.zmq_handler.zmq_handlers import PrintHandler, WriteToFileHandler
                 -zmqpubhashblock=tcp://127.0.0.1:28332 \
                 -zmqpubsequence=tcp://127.0.0.1:28332
 
-    We use the asyncio library here.  `self.handle()` installs itself as a
-    future at the end of the function.  Since it never returns with the event
-    loop having an empty stack of futures, this creates an infinite loop.  An
-    alternative is to wrap the contents of `handle` inside `while True`.
+    We use the asyncio library here.  `self.receive()` loops on the socket and
+    does nothing but timestamp the frames and put them in a bounded
+    FrameQueue (see frame_queue.py for the overload policies), so slow
+    handlers never delay the recorded receive times.  Frames are decoded and
+    handled by workers, threads or child processes, each draining its own
+    queue in order.  With several workers, `partition(topic, body)` picks the
+    worker of a frame, None sending it to every worker, so frames of the same
+    group keep their order.  With `routes` (see routes.py), every handler has
+    its own queue, overload policy, topics and worker instead, and the frame
+    goes to each route that wants it.  With several `endpoints`, a socket
+    subscribes to each node and FanIn (see fan_in.py) passes on the first
+    copy of every message only.  With a single endpoint, the sequence numbers
+    of each topic are followed and a frame after a gap carries the number of
+    messages lost (DumpRecord.lost): before it is filtered and handled, the
+    handler's handle_gap(record) is called, if it has one.  Gaps of one of
+    several nodes are only counted, the other nodes usually delivered those
+    messages.
 
     A blocking example using python 2.7 can be obtained from the git history:
     https://github.com/bitcoin/bitcoin/blob/37a7fe9e440b83e2364d5498931253937abe9294/contrib/zmq/zmq_sub.py
@@ -36,57 +60,309 @@ if (sys.version_info.major, sys.version_info.minor) < (3, 5):
 
 port = 28332
 
+# stage latencies, see networking/metrics.py
+RECEIVE = METRICS.histogram("stage_seconds", stage="receive")
+# recorded by every FrameWorker
+QUEUE_WAIT = METRICS.shared_histogram("stage_seconds", stage="queue_wait")
+DECODE = METRICS.shared_histogram("stage_seconds", stage="decode")
+
+
+def decode_frame(record: DumpRecord) -> object:
+    sequence, body = record.sequence, record.body
+    # receive time, not decode time
+    times = dict(timestamp=record.timestamp, monotonic_ns=record.monotonic_ns)
+    # Decode the message based on the topic
+    if record.topic == b"hashblock":
+        return BlockHash(sequence=sequence, block_hash=body.hex(), **times)
+    elif record.topic == b"hashtx":
+        return TransactionHash(sequence=sequence, tx_hash=body.hex(), **times)
+    elif record.topic == b"rawblock":
+        # Assuming the header is 80 bytes
+        return RawBlock(sequence, body[:80].hex(), **times)
+    elif record.topic == b"rawtx":
+        return RawTransaction(sequence, body.hex(), raw_body=body, **times)
+    elif record.topic == b"sequence":
+        hash = body[:32].hex()
+        label = chr(body[32])
+        label_enum = Label.from_char(label)
+        mempool_sequence = None if len(
+            body) != 32+1+8 else struct.unpack("<Q", body[32+1:])[0]
+        return SequenceNumber(sequence, hash, label_enum, mempool_sequence, **times)
+    else:
+        raise ValueError("Unknown topic")
+
+
+# Decoded once per frame, the routes sharing a SharedFrame reuse the message
+def frame_message(record: DumpRecord) -> object:
+    message = getattr(record, "decoded", None)
+    if message is None:
+        start = time.perf_counter_ns()
+        message = decode_frame(record)
+        DECODE.record(time.perf_counter_ns() - start)
+        if isinstance(record, SharedFrame):
+            record.decoded = message
+    return message
+
+
+# Tells the handler about the messages lost before the frame, even when the
+# filter drops the frame itself
+def note_gap(record: DumpRecord, message_handler):
+    handle_gap = getattr(message_handler, "handle_gap", None)
+    if handle_gap is not None:
+        handle_gap(record)
+
+
+# lag is the receive to handled time of the route, when the worker has one
+def handle_frame(record: DumpRecord, message_handler, message_filter, lag: Optional[Histogram] = None):
+    try:
+        start = time.monotonic_ns()
+        QUEUE_WAIT.record(start - record.monotonic_ns)
+        if record.lost:
+            note_gap(record, message_handler)
+        if message_filter is None or message_filter(record.topic, record.body):
+            handle_record = getattr(message_handler, "handle_record", None)
+            if handle_record is not None:
+                handle_record(record)
+            else:
+                message_handler.handle(frame_message(record))
+        if lag is not None:
+            lag.record(time.monotonic_ns() - record.monotonic_ns)
+    except Exception:
+        # a failing message must not stop the worker
+        traceback.print_exc()
+
+
+async def handle_frame_async(record: DumpRecord, message_handler, message_filter, lag: Optional[Histogram] = None):
+    try:
+        QUEUE_WAIT.record(time.monotonic_ns() - record.monotonic_ns)
+        if record.lost:
+            note_gap(record, message_handler)
+        if message_filter is None or message_filter(record.topic, record.body):
+            result = message_handler.handle(frame_message(record))
+            if inspect.isawaitable(result):
+                await result
+        if lag is not None:
+            lag.record(time.monotonic_ns() - record.monotonic_ns)
+    except Exception:
+        traceback.print_exc()
+
+
+def run_process_worker(frames: multiprocessing.Queue, handler_factory: Callable[[int], object], index: int):
+    message_handler = handler_factory(index)
+    message_filter = getattr(message_handler, "accepts", None)
+    for fields in iter(frames.get, None):
+        handle_frame(DumpRecord(*fields), message_handler, message_filter)
+
+
+class FrameWorker():
+    """Drains one FrameQueue in order, on a thread, in a child process, or
+    on an asyncio loop of its own thread.
+
+    In a child process the handler is built there by handler_factory(index),
+    and a feeder thread forwards the queued frames to it. On a loop, up to
+    concurrency handle() calls are awaited at once, in order when it is 1.
+    A named worker records its receive to handled time as handler_lag_seconds,
+    up to the hand-over to the child for a process.
+    """
+
+    def __init__(self, index: int, queue: FrameQueue, message_handler=None, message_filter=None, handler_factory=None, mode: str = "thread",
+                 name: Optional[str] = None, concurrency: int = 1):
+        self.index = index
+        self.queue = queue
+        self.process = None
+        self.concurrency = max(1, concurrency)
+        self.lag = METRICS.histogram("handler_lag_seconds", handler=name) if name is not None else None
+        if mode == "process":
+            context = multiprocessing.get_context("spawn")
+            # small, the backlog is kept in the FrameQueue where the overload policy applies
+            self.frames = context.Queue(maxsize=256)
+            self.process = context.Process(target=run_process_worker, args=(self.frames, handler_factory, index), daemon=True)
+            self.thread = threading.Thread(target=self.feed, daemon=True)
+        else:
+            if handler_factory is not None:
+                message_handler = handler_factory(index)
+                message_filter = getattr(message_handler, "accepts", None)
+            self.message_handler = message_handler
+            self.message_filter = message_filter
+            self.thread = threading.Thread(target=self.run_loop if mode == "async" else self.run, daemon=True)
+
+    def start(self):
+        if self.process is not None:
+            self.process.start()
+        self.thread.start()
+
+    def run(self):
+        for record in iter(self.queue.get, None):
+            handle_frame(record, self.message_handler, self.message_filter, self.lag)
+
+    def run_loop(self):
+        asyncio.run(self.run_async())
+
+    async def run_async(self):
+        loop = asyncio.get_running_loop()
+        # the queue blocks, it is waited on off the loop
+        with ThreadPoolExecutor(1) as executor:
+            in_flight = set()
+            while True:
+                record = await loop.run_in_executor(executor, self.queue.get)
+                if record is None:
+                    break
+                if len(in_flight) >= self.concurrency:
+                    _, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                in_flight.add(loop.create_task(handle_frame_async(record, self.message_handler, self.message_filter, self.lag)))
+            if in_flight:
+                await asyncio.wait(in_flight)
+
+    def feed(self):
+        for record in iter(self.queue.get, None):
+            self.frames.put((record.topic, record.sequence, record.monotonic_ns, record.wall_ns, record.body, record.source, record.lost))
+            if self.lag is not None:
+                self.lag.record(time.monotonic_ns() - record.monotonic_ns)
+        self.frames.put(None)
+
+    def join(self):
+        self.thread.join()
+        if self.process is not None:
+            self.process.join()
+
 
 class ZMQHandler():
-    def __init__(self, message_handler=PrintHandler(), sub_topic: List[str] = []):
-        self.message_handler = message_handler
+    # message_filter(topic, body) runs on the raw frames before decoding, a
+    # False return drops the message.
+    # With several workers or worker_mode="process", handler_factory(index)
+    # builds one handler per worker instead of message_handler, and that
+    # handler's accepts(topic, body), if it has one, is used as its filter.
+    # routes replaces all of these with one queue and worker per Route.
+    # endpoints are the nodes to subscribe to, deduplicated by FanIn when
+    # there are several, which remembers the last dedup_capacity messages of
+    # each topic.
+    def __init__(
+        self,
+        message_handler=PrintHandler(),
+        sub_topic: List[str] = [],
+        message_filter: Optional[Callable[[bytes, bytes], bool]] = None,
+        queue_size: int = 10000,
+        overload: OverloadPolicy = OverloadPolicy.BLOCK,
+        spill_path: Optional[str] = None,
+        workers: int = 1,
+        worker_mode: str = "thread",
+        handler_factory: Optional[Callable[[int], object]] = None,
+        partition: Optional[Callable[[bytes, bytes], Optional[int]]] = None,
+        routes: Optional[List[Route]] = None,
+        endpoints: Optional[List[str]] = None,
+        dedup_capacity: int = 100_000,
+    ):
+        if routes is not None and (workers > 1 or partition is not None):
+            raise ValueError("routes replace the workers and the partition function")
+        if (workers > 1 or worker_mode == "process") and handler_factory is None:
+            raise ValueError("several or process workers need a handler_factory")
+        if workers > 1 and partition is None:
+            raise ValueError("several workers need a partition function")
+        self.partition = partition
         self.loop = asyncio.get_event_loop()
         self.zmqContext = zmq.asyncio.Context()
         self.sequence = 0
-        self.zmqSubSocket = self.zmqContext.socket(zmq.SUB)
-        self.zmqSubSocket.setsockopt(zmq.RCVHWM, 0)
-        [self.zmqSubSocket.setsockopt_string(zmq.SUBSCRIBE, topic) for topic in (sub_topic if sub_topic else ["hashblock", "hashtx", "rawblock", "rawtx", "sequence"])]
-        self.zmqSubSocket.connect("tcp://127.0.0.1:%i" % port)
-
-    async def handle(self):
-        topic, body, seq = await self.zmqSubSocket.recv_multipart()
-        decoded_message = self.decode_message(topic, body, seq)
-
-        # Process the decoded message
-        self.message_handler.handle(decoded_message)
-
-        # Schedule the next receive
-        asyncio.ensure_future(self.handle())
-
-    def decode_message(self, topic: bytes, body: bytes, seq: bytes) -> object:
-        # Convert the sequence bytes to an integer
-        sequence = -1  # Default to -1 if sequence cannot be unpacked
-        if len(seq) == 4:
-            sequence = struct.unpack('<I', seq)[0]
-        # Decode the message based on the topic
-        if topic == b"hashblock":
-            return BlockHash(sequence=sequence, block_hash=body.hex())
-        elif topic == b"hashtx":
-            return TransactionHash(sequence=sequence, tx_hash=body.hex())
-        elif topic == b"rawblock":
-            # Assuming the header is 80 bytes
-            return RawBlock(sequence, body[:80].hex())
-        elif topic == b"rawtx":
-            return RawTransaction(sequence, body.hex())
-        elif topic == b"sequence":
-            hash = body[:32].hex()
-            label = chr(body[32])
-            label_enum = Label.from_char(label)
-            mempool_sequence = None if len(
-                body) != 32+1+8 else struct.unpack("<Q", body[32+1:])[0]
-            return SequenceNumber(sequence, hash, label_enum, mempool_sequence)
+        self.endpoints = endpoints if endpoints else ["tcp://127.0.0.1:%i" % port]
+        # one socket per node, the frames of a socket are known to come from its node
+        self.sockets = []
+        for endpoint in self.endpoints:
+            socket = self.zmqContext.socket(zmq.SUB)
+            socket.setsockopt(zmq.RCVHWM, queue_size)
+            [socket.setsockopt_string(zmq.SUBSCRIBE, topic) for topic in (sub_topic if sub_topic else ["hashblock", "hashtx", "rawblock", "rawtx", "sequence"])]
+            socket.connect(endpoint)
+            self.sockets.append(socket)
+        self.fan_in = FanIn(self.endpoints, dedup_capacity) if len(self.endpoints) > 1 else None
+        # sequence continuity of the single endpoint, FanIn follows each of several
+        self.continuity = SourceStats(self.endpoints[0]) if self.fan_in is None else None
+        if self.continuity is not None:
+            METRICS.gauge("zmq_source_gaps", lambda: self.continuity.gaps, source=self.endpoints[0])
+        self.routes = routes
+        if routes is not None:
+            self.queues = [FrameQueue(route.queue_size, route.overload, route.spill_path) for route in routes]
+            self.workers = [
+                FrameWorker(index, queue, route.message_handler, route.message_filter, route.handler_factory, route.mode, route.name, route.concurrency)
+                for index, (route, queue) in enumerate(zip(routes, self.queues))
+            ]
+            for route, queue in zip(routes, self.queues):
+                METRICS.gauge("handler_queue_depth", lambda queue=queue: queue.depth, handler=route.name)
+                METRICS.gauge("handler_backlog_seconds", lambda queue=queue: queue.backlog_ns() / 1e9, handler=route.name)
+                METRICS.gauge("handler_dropped", lambda queue=queue: queue.dropped, handler=route.name)
+                METRICS.gauge("handler_spilled", lambda queue=queue: queue.spilled, handler=route.name)
+        else:
+            self.queues = [
+                FrameQueue(queue_size, overload, spill_path if workers == 1 or spill_path is None else "{}.{}".format(spill_path, index))
+                for index in range(workers)
+            ]
+            self.workers = [
+                FrameWorker(index, queue, message_handler, message_filter, handler_factory, worker_mode)
+                for index, queue in enumerate(self.queues)
+            ]
+        # topic -> messages received counter
+        self.received: Dict[bytes, Counter] = {}
+        METRICS.gauge("queue_depth", lambda: self.queue_depth)
+        METRICS.gauge("queue_dropped", lambda: sum(queue.dropped for queue in self.queues))
+        METRICS.gauge("queue_spilled", lambda: sum(queue.spilled for queue in self.queues))
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(queue.depth for queue in self.queues)
+
+    def stats(self) -> List[dict]:
+        return [queue.stats() for queue in self.queues]
+
+    async def receive(self, source: int = 0):
+        socket = self.sockets[source]
+        while True:
+            topic, body, seq = await socket.recv_multipart()
+            # Convert the sequence bytes to an integer, -1 if it cannot be unpacked
+            sequence = struct.unpack('<I', seq)[0] if len(seq) == 4 else -1
+            counter = self.received.get(topic)
+            if counter is None:
+                counter = self.received[topic] = METRICS.counter("zmq_messages_total", topic=topic.decode(errors="replace"))
+            counter.inc()
+            record = self.frame(topic, sequence, body, source)
+            if self.fan_in is not None:
+                if not self.fan_in.accept(source, topic, sequence, body, record.monotonic_ns):
+                    continue
+            elif sequence >= 0:
+                record.lost = self.continuity.note(topic, sequence)
+            for queue in self.enqueue(record):
+                # block policy: wait for room off the event loop
+                await self.loop.run_in_executor(None, queue.put, record)
+            RECEIVE.record(time.monotonic_ns() - record.monotonic_ns)
+
+    def frame(self, topic: bytes, sequence: int, body: bytes, source: int = 0) -> DumpRecord:
+        if self.routes is not None:
+            return SharedFrame(topic, sequence, time.monotonic_ns(), time.time_ns(), body, source)
+        return DumpRecord(topic, sequence, time.monotonic_ns(), time.time_ns(), body, source)
+
+    # Puts the frame into the queues it goes to, returns the full ones of
+    # the block policy, which the caller waits on
+    def enqueue(self, record: DumpRecord) -> List[FrameQueue]:
+        if self.routes is not None:
+            queues = [queue for route, queue in zip(self.routes, self.queues) if route.wants(record.topic)]
         else:
-            raise ValueError("Unknown topic")
+            worker = self.partition(record.topic, record.body) if self.partition is not None else 0
+            queues = self.queues if worker is None else (self.queues[worker],)
+        return [queue for queue in queues if not queue.put(record, block=False)]
 
     def start(self):
+        for worker in self.workers:
+            worker.start()
         self.loop.add_signal_handler(signal.SIGINT, self.stop)
-        self.loop.create_task(self.handle())
+        for source in range(len(self.sockets)):
+            self.loop.create_task(self.receive(source))
         self.loop.run_forever()
+        # drain what was received before stopping
+        for queue in self.queues:
+            queue.close()
+        for worker in self.workers:
+            worker.join()
+        for index, queue in enumerate(self.queues):
+            print("{}: {}".format(self.routes[index].name if self.routes is not None else "worker {}".format(index), queue.stats()))
+            queue.release()
+        for source in self.fan_in.stats() if self.fan_in is not None else [self.continuity.stats()]:
+            print("source {}".format(source))
 
     def stop(self):
         self.loop.stop()
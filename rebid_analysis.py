@@ -1,76 +1,416 @@
+import argparse
+import atexit
+from array import array
+from collections import Counter, deque
 import csv
 import hashlib
-from typing import Dict, List, Optional, Union
+from typing import Deque, Dict, List, Optional, Set, Tuple, Union
 import os 
-from encoding.decode import BlockHash, RawTransaction, TransactionHash, decode
-from networking.zmq_handler.zmq_objects import BlockHash as ZmqBlockHash, RawTransaction as ZmqRawTransaction, TransactionHash as ZmqTransactionHash
+import time
+from analyzer.conflict_index import ConflictIndex
+from analyzer.inscriptions import Inscription, classify
+from analyzer.mempool_backfill import MempoolBackfill
+from analyzer.mempool_state import MempoolState
+from analyzer.prevout_cache import PrevoutCache, outpoint_key
+from analyzer.prevout_resolver import PrevoutResolver
+from analyzer.rbf_prefilter import RbfPrefilter
+from analyzer.rpc_fixtures import ReplayProxy, RpcFixtureStore
+from analyzer.snapshot import SnapshotWriter, capture, restore
+from encoding.decode import BlockHash, RawTransaction, SequenceHash, TransactionHash, decode
+from encoding.dump_archive import is_record_dump, open_records
+from encoding.dump_format import DumpRecord, datetime_to_ns
+from encoding.rebid_store import CSV_HEADER, RebidStoreWriter, fee_rate
+from encoding.tx_scanner import ScannedTransaction, scan_outputs, scan_transaction, virtual_size
+from networking.metrics import METRICS, MetricsReporter
+from networking.rpc_client import PooledProxy
+from networking.zmq_handler.zmq_objects import BlockHash as ZmqBlockHash, Label, RawTransaction as ZmqRawTransaction, SequenceNumber as ZmqSequenceNumber, TransactionHash as ZmqTransactionHash
 
-from dataclasses import dataclass, field
 
-from bitcoin.core import CTransaction, CTxIn,  CTxOut, lx, b2x, Hash
-from bitcoin.rpc import Proxy 
+from bitcoin.core import CBlock, CTransaction, CTxIn,  CTxOut, lx, b2lx, b2x, Hash
+from bitcoin.rpc import JSONRPCError, Proxy 
+
+# Transactions flow through the analyzer scanned, see encoding/tx_scanner.py
+AnyTransaction = Union[CTransaction, ScannedTransaction]
+
+# blocks that can be rolled back by a reorg
+MAX_REORG_DEPTH = 6
+
+# stage latencies, see networking/metrics.py
+# dump records and lines decoded on replay, the live frames are decoded by ZMQHandler
+REPLAY_DECODE = METRICS.histogram("stage_seconds", stage="replay_decode")
+DESERIALIZE = METRICS.histogram("stage_seconds", stage="deserialize")
+RESOLVE_PREVOUTS = METRICS.histogram("stage_seconds", stage="resolve_prevouts")
+PROCESS_TRANSACTION = METRICS.histogram("stage_seconds", stage="process_transaction")
+BLOCK_FLUSH = METRICS.histogram("stage_seconds", stage="block_flush")
+SNAPSHOT = METRICS.histogram("stage_seconds", stage="snapshot")
+BACKFILL = METRICS.histogram("stage_seconds", stage="backfill")
+RECOVERED = METRICS.counter("zmq_recovered_total")
+
+ZMQ_TOPICS = {ZmqRawTransaction: "rawtx", ZmqTransactionHash: "hashtx", ZmqBlockHash: "hashblock", ZmqSequenceNumber: "sequence"}
+
 
-@dataclass
 class TransactionData:
-    txs: List[CTransaction]
-    gas_fees: List[int] = field(default_factory=list)  # Assuming gas fees are represented as integers
-    timestamps: List[int] = field(default_factory=list)  # Assuming timestamps are Unix timestamps
+    """Rebid history of one conflict group, stored column-wise.
 
-    def add_update(self, tx: CTransaction,  gas_fee: int, timestamp):
-        self.txs.append(tx)
+    Fees, timestamps and virtual sizes live in typed arrays (8 bytes per rebid
+    instead of a list slot plus a boxed int/float each) and only the txid and
+    raw bytes of the latest replacement are kept, rather than every CTransaction.
+    """
+    __slots__ = ("gas_fees", "timestamps", "vsizes", "key", "last_block", "latest_txid", "latest_raw", "inscription")
+
+    def __init__(self, key: str = "", last_block: int = 0):
+        self.gas_fees = array('q')
+        self.timestamps = array('d')  # Unix timestamps
+        self.vsizes = array('I')  # vbytes, gas_fee / vsize is the fee rate of the bid
+        self.key = key  # internalTransactionId, from the inputs of the transaction that opened the group
+        self.last_block = last_block  # block during which the group was last updated
+        self.latest_txid = b""
+        self.latest_raw = b""
+        self.inscription: Optional[Inscription] = None  # first one found in the group's bids, see analyzer/inscriptions.py
+
+    def add_update(self, tx: AnyTransaction, gas_fee: int, timestamp: float):
         self.gas_fees.append(gas_fee)
         self.timestamps.append(timestamp)
+        self.vsizes.append(virtual_size(tx))
+        self.latest_txid = tx.GetTxid()
+        # copied, a scanned transaction may point into a mapped dump
+        self.latest_raw = bytes(tx.raw) if isinstance(tx, ScannedTransaction) else tx.serialize()
 
+    # Full transaction of the latest replacement, deserialized on demand
+    @property
+    def latest_tx(self) -> CTransaction:
+        return CTransaction.deserialize(self.latest_raw)
 
-@dataclass
-class TxMetaData:
-    txHash: str
-    size: int
-    vsize: int
-    weight: int
-    blockhash: str
-    confirmations: int
-    time: int
-    blocktime: int
-    tx: CTransaction
+    # Interleaves the history of a conflicting group, by arrival time
+    def merge(self, other: "TransactionData"):
+        if other.timestamps and (not self.timestamps or other.timestamps[-1] > self.timestamps[-1]):
+            self.latest_txid, self.latest_raw = other.latest_txid, other.latest_raw
+        entries = sorted(
+            zip(self.timestamps + other.timestamps, self.gas_fees + other.gas_fees, self.vsizes + other.vsizes),
+            key=lambda entry: entry[0],
+        )
+        self.timestamps = array('d', [entry[0] for entry in entries])
+        self.gas_fees = array('q', [entry[1] for entry in entries])
+        self.vsizes = array('I', [entry[2] for entry in entries])
+        self.last_block = max(self.last_block, other.last_block)
+        if self.inscription is None:
+            self.inscription = other.inscription
 
 
 class MempoolAnalyzer:
-    def __init__(self, file_path):
-        self.client = Proxy(btc_conf_file=os.path.join(file_path, "networking/.env"))
+    # batch_window is the number of transactions whose missing prevouts are
+    # resolved together in one JSON-RPC batch before they are processed in order.
+    # Groups are written out when a block confirms them, or once they have not
+    # been updated for max_idle_blocks blocks.
+    # With a snapshot_path, the state is snapshotted every snapshot_interval
+    # seconds and restored from the last snapshot on startup, see analyzer/snapshot.py
+    # With backfill, the txids of the node's mempool are read on startup, so
+    # rawtx lost by the live stream can be recovered, see handle_gap. The
+    # recovered ones are written as records to dump_handler (handle_record),
+    # the dump of the stream, so replaying it handles them too
+    def __init__(self, file_path, client: Optional[Proxy] = None, batch_window: int = 1, prevout_cache: Optional[PrevoutCache] = None, max_idle_blocks: int = 3,
+                 snapshot_path: Optional[str] = None, snapshot_interval: float = 60, backfill: bool = False, dump_handler=None):
+        self.client = client if client is not None else PooledProxy(btc_conf_file=os.path.join(file_path, "networking/.env"))
+        self.resolver = PrevoutResolver(self.client)
+        self.batch_window = max(1, batch_window)
+        self.pending_transactions: List[Tuple[AnyTransaction, float]] = []
+        self.unknown_prevout_hashes: Set[str] = set()
+        self.max_idle_blocks = max_idle_blocks
+        self.conflict_index = ConflictIndex()
+        self.rbf_filter = RbfPrefilter(self.conflict_index)
         self.input_file_path = os.path.join(file_path, "data/mempool_drop.txt")
-        self.output_file_path = os.path.join(file_path, "data/rebid_output.csv")
-        self.current_block: int = self.client.getblockcount()
-        self.transactions = {}
-        self.value_per_prevout_cache: Dict[str, int] = {}
-        self.tx_meta_data_per_hash: Dict[str, TxMetaData] = {}
+        # a .csv path keeps the legacy csv output, see write_rows
+        self.output_file_path = os.path.join(file_path, "data/rebid_output.rebid")
+        self.output_store: Optional[RebidStoreWriter] = None
+        # from the snapshot when one is restored, else from the node, see below
+        self.current_block: int = 0
+        self.transactions: Dict[int, TransactionData] = {}
+        # survives blocks, see reset_cache
+        self.prevout_cache = prevout_cache if prevout_cache is not None else PrevoutCache(spill_path=os.path.join(file_path, "data/prevout_cache.sqlite"))
+        atexit.register(self.prevout_cache.close)
+        self.parent_transactions: Dict[str, ScannedTransaction] = {}
         self.unkown_tx_counter = 0
-    
+        # inputs priced from the prevout cache vs those needing an RPC, per block
+        self.inputs_local = 0
+        self.inputs_fetched = 0
+        # bids per BRC-20 ticker, per block
+        self.ticker_bids: Counter = Counter()
+        self.mempool = MempoolState(self.client)
+        self.mempool_backfill = MempoolBackfill(self.mempool, self.resolver)
+        # ZMQ messages lost per topic, and rawtx recovered from the mempool, per block
+        self.lost_messages: Counter = Counter()
+        self.recovered_messages = 0
+        self.dump_handler = dump_handler
+        self.recovered_records = 0
+        self.lost_counters: Dict[str, object] = {}
+        # (hash, height) of the last blocks connected, and the groups each one finalized
+        self.recent_blocks: Deque[Tuple[str, int]] = deque(maxlen=MAX_REORG_DEPTH)
+        self.retired_groups: Deque[List[Tuple[TransactionData, List[bytes]]]] = deque(maxlen=MAX_REORG_DEPTH)
+        # ZMQ sequence of the last message per topic, and the latest receive time (ns, to the microsecond)
+        self.last_sequences: Dict[str, int] = {}
+        self.last_wall_ns = 0
+        # receive time of the last message handled, recovered records follow it
+        self.last_monotonic_ns = 0
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_writer: Optional[SnapshotWriter] = None
+        self.next_snapshot = time.monotonic() + snapshot_interval
+        self.restored = snapshot_path is not None and os.path.exists(snapshot_path) and self.restore_snapshot()
+        if not self.restored:
+            self.current_block = self.client.getblockcount()
+        if backfill:
+            self.mempool_backfill.sync()
+        if snapshot_path is not None and snapshot_interval > 0:
+            self.snapshot_writer = SnapshotWriter(snapshot_path)
+            atexit.register(self.snapshot_writer.close)
+        self.register_gauges()
+
+    # Read on every scrape, see networking/metrics.py
+    def register_gauges(self):
+        METRICS.gauge("tracked_groups", lambda: len(self.transactions))
+        METRICS.gauge("prevout_cache_hit_ratio", lambda: self.prevout_cache.stats()["hit_ratio"])
+        METRICS.gauge("prevout_cache_entries", lambda: len(self.prevout_cache))
+        METRICS.gauge("mempool_size", lambda: len(self.mempool))
+        METRICS.gauge("mempool_sequence_gaps", lambda: self.mempool.gaps)
+        METRICS.gauge("block_height", lambda: self.current_block)
     
     def handle(self, message):
+        wall_ns = datetime_to_ns(message.timestamp)
+        if self.mempool_backfill.pending:
+            self.backfill_pending(wall_ns)
+        self.note_message(ZMQ_TOPICS.get(type(message), "other"), message.sequence, wall_ns)
+        self.last_monotonic_ns = message.monotonic_ns
+        self.dispatch(message)
+        if self.snapshot_writer is not None and time.monotonic() >= self.next_snapshot:
+            self.take_snapshot()
+
+    def dispatch(self, message):
         if self.is_zmq_raw_transaction(message):
-            transaction = RawTransaction(message.sequence, message.raw_tx, message.timestamp)
-            self.process_transaction(transaction.deserialize(), transaction.timestamp.timestamp())
+            transaction = RawTransaction(message.sequence, message.raw_body or message.raw_tx, message.timestamp)
+            start = time.perf_counter_ns()
+            scanned = transaction.scan()
+            DESERIALIZE.record(time.perf_counter_ns() - start)
+            if self.mempool_backfill.recovered_txids and self.mempool_backfill.take_recovered(scanned.GetTxid()):
+                return
+            self.seed_outputs(scanned)
+            self.queue_transaction(scanned, transaction.timestamp.timestamp())
         elif self.is_zmq_hash_block(message):
-            self.update_block_number()
-            self.dump_block_transactions()
+            self.connect_block(message.block_hash)
+        elif isinstance(message, ZmqSequenceNumber):
+            self.handle_sequence(message.label, message.seq_hash, message.mempool_sequence)
+
+    # Messages lost right before `record`, see ZMQHandler. The rawtx lost are
+    # fetched from the node's mempool, see analyzer/mempool_backfill.py, and
+    # handled before the record, as if received with it
+    def handle_gap(self, record: DumpRecord):
+        topic = record.topic.decode()
+        self.lost_messages[topic] += record.lost
+        counter = self.lost_counters.get(topic)
+        if counter is None:
+            counter = self.lost_counters[topic] = METRICS.counter("zmq_lost_total", topic=topic)
+        counter.inc(record.lost)
+        if record.topic != b"rawtx":
+            # blocks and mempool sequences resync by themselves
+            return
+        # in the mempool already, handled right after
+        self.mempool.seen(scan_transaction(record.body).GetTxid()[::-1])
+        self.mempool_backfill.pending += record.lost
+        if self.mempool_backfill.due():
+            self.backfill_lost(record.wall_ns)
+
+    # Backfills the rawtx lost since the last backfill, when it was too recent
+    # to run at their gap
+    def backfill_pending(self, wall_ns: int):
+        if self.mempool_backfill.due():
+            self.backfill_lost(wall_ns)
+
+    def backfill_lost(self, wall_ns: int):
+        start = time.perf_counter_ns()
+        lost = self.mempool_backfill.pending
+        try:
+            recovered = self.mempool_backfill.backfill()
+        except (JSONRPCError, OSError) as err:
+            print(f"could not backfill {lost} lost rawtx: {err}")
+            return
+        BACKFILL.record(time.perf_counter_ns() - start)
+        for transaction in recovered:
+            self.queue_recovered(transaction, wall_ns)
+            if self.dump_handler is not None:
+                self.dump_handler.handle_record(DumpRecord(b"recovered", self.recovered_records, self.last_monotonic_ns, wall_ns, transaction.raw))
+                self.recovered_records += 1
+        RECOVERED.inc(len(recovered))
+
+    def queue_recovered(self, transaction: AnyTransaction, wall_ns: int):
+        self.seed_outputs(transaction)
+        if self.rbf_filter.accepts(transaction.raw):
+            self.queue_transaction(transaction, wall_ns / 1e9)
+        self.recovered_messages += 1
+
+    # Replays a recovered record, see encoding/dump_format.py; the frame of
+    # the transaction, if it arrived later, is skipped as it was live
+    def replay_recovered(self, record: DumpRecord):
+        transaction = scan_transaction(record.body)
+        self.mempool_backfill.add_recovered(transaction.GetTxid())
+        self.queue_recovered(transaction, record.wall_ns)
+
+    # Records of the reader from `start` in dump order, each recovered one
+    # right after the frame it was handled after, by the monotonic_ns it
+    # carries. With first_sequences, records are noted as received and the
+    # first sequence per topic is kept there
+    def replay_records(self, reader, start: int = 0, first_sequences: Optional[Dict[str, int]] = None) -> int:
+        recovered: Dict[int, List[DumpRecord]] = {}
+        for i in range(start, len(reader)):
+            record = reader[i]
+            if record.topic == b"recovered":
+                recovered.setdefault(record.monotonic_ns, []).append(record)
+        for record in recovered.pop(0, ()):
+            self.replay_recovered(record)
+        replayed = 0
+        for i in range(start, len(reader)):
+            record = reader[i]
+            if record.topic == b"recovered":
+                continue
+            if first_sequences is not None:
+                topic = record.topic.decode()
+                first_sequences.setdefault(topic, record.sequence)
+                self.note_message(topic, record.sequence, record.wall_ns // 1000 * 1000)
+            self.process_line(record)
+            replayed += 1
+            if recovered:
+                for recovered_record in recovered.pop(record.monotonic_ns, ()):
+                    self.replay_recovered(recovered_record)
+        return replayed
+
+    def note_message(self, topic: str, sequence: int, wall_ns: int):
+        self.last_sequences[topic] = sequence
+        self.last_wall_ns = max(self.last_wall_ns, wall_ns)
+
+    # Hands a snapshot of the state to the background writer
+    def take_snapshot(self):
+        self.flush_pending_transactions()
+        start = time.perf_counter_ns()
+        self.snapshot_writer.submit(capture(self))
+        SNAPSHOT.record(time.perf_counter_ns() - start)
+        self.next_snapshot = time.monotonic() + self.snapshot_interval
+
+    def restore_snapshot(self) -> bool:
+        try:
+            header = restore(self, self.snapshot_path, TransactionData)
+        except (OSError, ValueError, KeyError) as err:
+            print(f"could not restore {self.snapshot_path}, starting empty: {err}")
+            self.transactions.clear()
+            self.conflict_index.clear()
+            return False
+        age = (time.time_ns() - header["created_ns"]) / 1e9
+        print(f"restored {len(self.transactions)} groups and {len(self.prevout_cache)} prevouts at block {self.current_block} from a snapshot taken {age:.0f}s ago")
+        return True
+
+    # Replays the records of a binary dump or an archive received after the
+    # restored snapshot, the dump being written ahead of the analyzer
+    # (main.py --record-dump or --archive). Only the last segments of an
+    # archive are read. Returns the number of records replayed
+    def catch_up(self, dump_path: str) -> int:
+        if not self.restored or not is_record_dump(dump_path):
+            return 0
+        try:
+            return self.replay_since_snapshot(dump_path)
+        except (OSError, ValueError) as err:
+            # the state restored stays, the records not replayed are lost
+            print(f"could not catch up on {dump_path}: {err}")
+            return 0
+
+    def replay_since_snapshot(self, dump_path: str) -> int:
+        restored_sequences = dict(self.last_sequences)
+        first_sequences: Dict[str, int] = {}
+        with open_records(dump_path, after_wall_ns=self.last_wall_ns) as reader:
+            # records are in receive order, the gap is at the end; receive
+            # times are compared to the microsecond, as messages carry them.
+            # Recovered records are written late, the ones handled before the
+            # snapshot follow no replayed frame and are left out
+            start = len(reader)
+            while start > 0 and (reader[start - 1].topic == b"recovered" or reader[start - 1].wall_ns // 1000 * 1000 > self.last_wall_ns):
+                start -= 1
+            replayed = self.replay_records(reader, start, first_sequences)
+            # pending transactions still point into the mapped dump
+            self.flush_pending_transactions()
+        # published while neither the analyzer nor the dump was running; a
+        # restarted node starts its sequences over, nothing is counted then
+        lost = {topic: max(0, sequence - restored_sequences[topic] - 1) for topic, sequence in first_sequences.items() if topic in restored_sequences}
+        print(f"caught up on {replayed} records from {dump_path}, lost per topic: {lost}")
+        return replayed
+
+    # Pre-decode filter for the ZMQ pipeline, see analyzer/rbf_prefilter.py.
+    # Dropped transactions still seed the prevout cache, handle() seeds the others
+    def accepts_message(self, topic: bytes, body: bytes) -> bool:
+        if self.mempool_backfill.pending:
+            # before the frame, dropped or not
+            self.backfill_pending(self.last_wall_ns)
+        if topic == b"rawtx":
+            if self.rbf_filter.accepts(body):
+                return True
+            self.seed_raw(body)
+            return False
+        return True
+
+    # Every transaction seen may be the unconfirmed parent of a later rebid,
+    # which getrawtransaction may not serve: its outputs go to the prevout
+    # cache so spending it needs no RPC
+    def seed_outputs(self, transaction: AnyTransaction):
+        self.seed(transaction.GetTxid(), [output.nValue for output in transaction.vout])
+
+    # Dropped transactions are seeded straight from their raw bytes, see
+    # encoding/tx_scanner.py scan_outputs
+    def seed_raw(self, raw_tx: bytes):
+        self.seed(*scan_outputs(raw_tx))
+
+    def seed(self, txid: bytes, values: List[int]):
+        self.prevout_cache.put_outputs(txid, values)
+        if self.mempool.synced:
+            self.mempool.seen(txid[::-1])
+
+    # Confirmed, so not indexed as mempool transactions
+    def seed_block(self, block: CBlock):
+        for tx in block.vtx:
+            self.prevout_cache.put_outputs(tx.GetTxid(), [output.nValue for output in tx.vout])
 
     #Assumes that the lines are ordered by arrival time
-    def process_file(self):
-        with open(self.input_file_path, 'r') as file:
-            for line in file:
-                self.process_line(line.strip())
+    #Reads the binary dump format, dump archives and the legacy text dumps
+    def process_file(self) -> int:
+        processed = 0
+        if is_record_dump(self.input_file_path):
+            with open_records(self.input_file_path) as reader:
+                processed = self.replay_records(reader)
+                # pending transactions still point into the mapped dump
+                self.flush_pending_transactions()
+        else:
+            with open(self.input_file_path, 'r') as file:
+                for line in file:
+                    self.process_line(line.strip())
+                    processed += 1
+        self.flush_pending_transactions()
+        return processed
 
-    def process_line(self, line):
+    def process_line(self, line: Union[str, DumpRecord]):
+        start = time.perf_counter_ns()
         decoded = decode(line)
+        REPLAY_DECODE.record(time.perf_counter_ns() - start)
         # Check if it's a raw transaction
         if self.is_raw_transaction(decoded):
-            self.process_transaction(decoded.deserialize(), decoded.timestamp.timestamp())
+            raw_tx = decoded.raw_bytes()
+            start = time.perf_counter_ns()
+            transaction = scan_transaction(raw_tx)
+            DESERIALIZE.record(time.perf_counter_ns() - start)
+            if self.mempool_backfill.recovered_txids and self.mempool_backfill.take_recovered(transaction.GetTxid()):
+                return
+            self.seed_outputs(transaction)
+            if self.rbf_filter.accepts(raw_tx):
+                self.queue_transaction(transaction, decoded.timestamp.timestamp())
         elif self.is_hash_transaction(decoded):
             pass
         elif self.is_hash_block(decoded):
-            self.update_block_number()
-            self.dump_block_transactions()
+            self.connect_block(decoded.block_hash)
+        elif isinstance(decoded, SequenceHash):
+            self.handle_sequence(Label.from_char(decoded.label), decoded.tx_hash, decoded.mempool_sequence)
 
     def is_zmq_raw_transaction(self, transaction):
         # Implement logic to check if the transaction is a raw transaction
@@ -92,25 +432,117 @@ class MempoolAnalyzer:
     def is_hash_block(self, block):
         return isinstance(block, BlockHash) 
    
-    def process_transaction(self, transaction: CTransaction, timestamp: int):
-        key = self.get_key_from_inputs(transaction.vin)
+    def queue_transaction(self, transaction: AnyTransaction, timestamp: float):
+        if self.can_update_gas_fee(transaction.vin):
+            self.conflict_index.watch(outpoint_key(input.prevout.hash, input.prevout.n) for input in transaction.vin)
+        self.pending_transactions.append((transaction, timestamp))
+        if len(self.pending_transactions) >= self.batch_window:
+            self.flush_pending_transactions()
+
+    def flush_pending_transactions(self):
+        if not self.pending_transactions:
+            return
+        pending, self.pending_transactions = self.pending_transactions, []
+        # Only transactions that process_transaction will price need their
+        # prevouts; queue_transaction watched the outpoints of those that may
+        # open a group earlier in the window
+        to_resolve: List[AnyTransaction] = [
+            transaction for transaction, _ in pending
+            if self.can_update_gas_fee(transaction.vin)
+            or any(outpoint_key(input.prevout.hash, input.prevout.n) in self.conflict_index for input in transaction.vin)
+        ]
+        start = time.perf_counter_ns()
+        try:
+            self.resolve_prevouts(to_resolve)
+        except JSONRPCError as err:
+            # a rejected batch: the transactions whose parents are cached are
+            # still priced, the others are dropped one by one
+            print(f"could not resolve the prevouts of {len(to_resolve)} transactions: {err}")
+        RESOLVE_PREVOUTS.record(time.perf_counter_ns() - start)
+        for transaction, timestamp in pending:
+            start = time.perf_counter_ns()
+            self.process_transaction(transaction, timestamp)
+            PROCESS_TRANSACTION.record(time.perf_counter_ns() - start)
+        self.unknown_prevout_hashes = set()
+
+    # Fetches every parent transaction that is neither cached nor known to be
+    # missing with a single batched RPC round-trip
+    def resolve_prevouts(self, transactions: List[AnyTransaction]):
+        missing: List[bytes] = []
+        for transaction in transactions:
+            for input in transaction.vin:
+                if self.prevout_cache.get(outpoint_key(input.prevout.hash, input.prevout.n)) is not None:
+                    self.inputs_local += 1
+                    continue
+                self.inputs_fetched += 1
+                prevout_hash = input.prevout.hash.hex()
+                if prevout_hash in self.parent_transactions or prevout_hash in self.unknown_prevout_hashes:
+                    continue
+                missing.append(input.prevout.hash)
+        if not missing:
+            return
+        for tx_hash, parent in self.resolver.fetch(missing).items():
+            if parent is None:
+                self.unknown_prevout_hashes.add(tx_hash.hex())
+            else:
+                self.parent_transactions[tx_hash.hex()] = parent
+                self.prevout_cache.put_outputs(tx_hash, (output.nValue for output in parent.vout))
 
-        if key not in self.transactions:
+    def process_transaction(self, transaction: AnyTransaction, timestamp: int):
+        outpoints = [outpoint_key(input.prevout.hash, input.prevout.n) for input in transaction.vin]
+        groups = self.conflict_index.groups_of(outpoints)
+
+        if not groups:
             if self.can_update_gas_fee(transaction.vin):
                 input_value = self.extract_input_value(transaction)
                 if input_value == 0:
                     return
                 else:
                     gas_fee = input_value - self.get_gas_fees_from_outputs(transaction.vout)
-                    self.transactions[key] = TransactionData(txs=[transaction], gas_fees=[gas_fee], timestamps=[timestamp])
+                    group = self.conflict_index.add(outpoints)
+                    tx_data = TransactionData(key=self.get_key_from_inputs(transaction.vin), last_block=self.current_block)
+                    tx_data.add_update(transaction, gas_fee, timestamp)
+                    self.tag_inscription(tx_data, transaction)
+                    self.transactions[group] = tx_data
         else:
             input_value = self.extract_input_value(transaction)
             if input_value == 0:
                 return
             else:
+                # a transaction spending outpoints of several groups replaces
+                # all of them, once it is recorded
+                group = self.merge_groups(groups) if len(groups) > 1 else groups[0]
                 gas_fee = input_value - self.get_gas_fees_from_outputs(transaction.vout)
-                self.transactions[key].add_update(transaction, gas_fee, timestamp)
-    
+                # replacements may add inputs, e.g. a funding input to raise the fee
+                self.conflict_index.extend(group, outpoints)
+                tx_data = self.transactions[group]
+                tx_data.add_update(transaction, gas_fee, timestamp)
+                tx_data.last_block = self.current_block
+                self.tag_inscription(tx_data, transaction)
+
+    # Groups are tagged with the first inscription among their bids, rebids of
+    # a reveal carry the same envelope
+    def tag_inscription(self, tx_data: TransactionData, transaction: AnyTransaction):
+        if tx_data.inscription is None:
+            tx_data.inscription = classify(transaction)
+        if tx_data.inscription is not None and tx_data.inscription.is_brc20:
+            self.ticker_bids[tx_data.inscription.tick] += 1
+
+    # BRC-20 tickers with the most bids in the current block
+    def hot_tickers(self, n: int = 5) -> List[Tuple[str, int]]:
+        return self.ticker_bids.most_common(n)
+
+    # The merged group keeps the bids of the one opened first, under the id
+    # ConflictIndex.union picks (the group with the most outpoints)
+    def merge_groups(self, groups: List[int]) -> int:
+        group_data = sorted((self.transactions.pop(group) for group in groups), key=lambda tx_data: tx_data.timestamps[0])
+        merged = group_data[0]
+        for other in group_data[1:]:
+            merged.merge(other)
+        root = self.conflict_index.union(groups)
+        self.transactions[root] = merged
+        return root
+
     def get_key_from_inputs(self, inputs: CTxIn):
         concatenated_hashes = ''.join([input.prevout.hash.hex() + str(input.prevout.n) for input in inputs])
         return hashlib.sha256(concatenated_hashes.encode()).hexdigest()
@@ -136,43 +568,36 @@ class MempoolAnalyzer:
             return False
     
     #Please note this assume inputs are fixed.
-    def extract_input_value(self, transaction: CTransaction) -> int:
+    #Prevouts are expected to be resolved already, see flush_pending_transactions
+    def extract_input_value(self, transaction: AnyTransaction) -> int:
         input_sum_value: int = 0
         for input in transaction.vin:
             input: CTxIn
-            key = self.get_key_from_input(input.prevout.hash, input.prevout.n)
-            if not key in self.value_per_prevout_cache:
-                if not input.prevout.hash.hex() in self.tx_meta_data_per_hash:
-                    tx_meta_data = self.get_tx_meta_data_from_hash(input.prevout.hash)
-                    if tx_meta_data is None:
-                        return 0
-                    else:
-                        self.tx_meta_data_per_hash[input.prevout.hash.hex()] = tx_meta_data
-                self.value_per_prevout_cache[key] = self.tx_meta_data_per_hash[input.prevout.hash.hex()].tx.vout[input.prevout.n].nValue 
-            input_sum_value += self.value_per_prevout_cache[key]   
+            key = outpoint_key(input.prevout.hash, input.prevout.n)
+            value = self.prevout_cache.peek(key)
+            if value is None:
+                if not input.prevout.hash.hex() in self.parent_transactions:
+                    self.unkown_tx_counter += 1
+                    return 0
+                value = self.parent_transactions[input.prevout.hash.hex()].vout[input.prevout.n].nValue
+                self.prevout_cache.put(key, value)
+            input_sum_value += value
         return input_sum_value
     
-    def get_tx_meta_data_from_hash(self, tx_hash: Union[str, bytes]) -> Optional[TxMetaData]:
+    # Compact getrawtransaction, scanned locally, see PrevoutResolver
+    def get_parent_transaction(self, tx_hash: Union[str, bytes]) -> Optional[ScannedTransaction]:
         try:
-            if isinstance(tx_hash, str): 
-                tx_data = self.client.getrawtransaction(lx(tx_hash), True)
-            elif isinstance(tx_hash, bytes):
-                tx_data = self.client.getrawtransaction(tx_hash, True)
+            raw_hex = self.client.call("getrawtransaction", tx_hash if isinstance(tx_hash, str) else b2lx(tx_hash), 0)
         #missing lots of transaction, for these we'll get an IndexError
-        except IndexError:
+        except (IndexError, JSONRPCError):
             self.unkown_tx_counter += 1
             return None
-        #sometimes block related fields are missing, and blockhash is none, to investigate
-        tx_data["txHash"] = tx_data.pop("hash")
-        try:
-            tx_meta_data = TxMetaData(**tx_data)
-            return tx_meta_data
-        except TypeError:
-            tx_data["confirmations"] = 0
-            tx_data["time"] = 0
-            tx_data["blocktime"] = 0
-            tx_meta_data = TxMetaData(**tx_data)
-            return tx_meta_data
+        return scan_transaction(bytes.fromhex(raw_hex))
+
+    @property
+    def local_ratio(self) -> float:
+        resolved = self.inputs_local + self.inputs_fetched
+        return self.inputs_local / resolved if resolved else 0.0
 
     def get_gas_fees_from_outputs(self, outputs: tuple[CTxOut]) -> int:
         return sum(output.nValue for output in outputs)
@@ -189,9 +614,54 @@ class MempoolAnalyzer:
     def get_transactions(self):
         return self.transactions
  
-    def dump_block_transactions(self):
+    # Writes the finalized groups (all of them when None) and drops them
+    def dump_block_transactions(self, finalized: Optional[Set[int]] = None):
+        if finalized is None:
+            finalized = set(self.transactions)
+        rows: List[list] = []
+        for group, tx_data in self.transactions.items():
+            if group in finalized:
+                rows.extend(self.group_rows(tx_data))
+        self.write_rows(rows)
+        print(f"flushing block into output{self.current_block}") 
+        print(f"amount of missed tx due to lack of memory: {self.unkown_tx_counter}") 
+        print(f"prevout cache: {self.prevout_cache.stats()}")
+        print(f"inputs served locally: {self.inputs_local}/{self.inputs_local + self.inputs_fetched} ({self.local_ratio:.1%})")
+        print(f"rbf pre-filter dropped {self.rbf_filter.dropped}/{self.rbf_filter.seen} rawtx ({self.rbf_filter.hit_rate:.1%})")
+        print(f"groups written: {len(finalized)}, still tracked: {len(self.transactions) - len(finalized)}")
+        print(f"mempool state: {self.mempool.stats()}")
+        print(f"zmq messages lost: {dict(self.lost_messages)}, rawtx recovered from the mempool: {self.recovered_messages}")
+        print(f"hot tickers: {self.hot_tickers()}")
+        self.reset_cache(finalized)
+
+    def group_rows(self, tx_data: TransactionData) -> List[list]:
+        if len(tx_data.gas_fees) <= 2:
+            return []
+        final_txid = b2lx(tx_data.latest_txid)
+        inscription = tx_data.inscription
+        tags = [inscription.content_type, inscription.op, inscription.tick] if inscription is not None else ["", "", ""]
+        # Assuming you have a method to determine the blockId and sender
+        return [[final_txid, tx_data.key, gas_fee, timestamp, self.current_block, vsize, *tags] for gas_fee, timestamp, vsize in zip(tx_data.gas_fees, tx_data.timestamps, tx_data.vsizes)]
+
+    # One row group per block in the columnar store (encoding/rebid_store.py),
+    # written in the background, or appended to a csv for a .csv output path
+    def write_rows(self, rows: List[list]):
+        if not self.output_file_path.endswith(".csv"):
+            if self.output_store is None or self.output_store.path != self.output_file_path:
+                if self.output_store is not None:
+                    self.output_store.close()
+                self.output_store = RebidStoreWriter(self.output_file_path)
+                atexit.register(self.output_store.close)
+            self.output_store.append_block(self.current_block, rows)
+            return
         # Check if the file exists to determine if we need to write headers
-        file_exists = os.path.isfile(self.output_file_path)
+        file_exists = os.path.isfile(self.output_file_path) and os.path.getsize(self.output_file_path) > 0
+        # csv files started before the vsize and feeRate or the inscription
+        # columns keep their layout: rows get as many columns as their header
+        n_columns = len(CSV_HEADER)
+        if file_exists:
+            with open(self.output_file_path, newline='') as file:
+                n_columns = len(next(csv.reader(file), CSV_HEADER))
         
         with open(self.output_file_path, mode='a', newline='') as file:  # 'a' opens the file in append mode
             writer = csv.writer(file)
@@ -200,33 +670,167 @@ class MempoolAnalyzer:
             if not file_exists:
                 #externalTransactionId matches what you'll find on blockexplorer
                 #internalTransactionId is generated only looking at inputs, despites generating a less strict hash than the standard procedure (and more likely to have collision)
-                writer.writerow(['externalTransactionId','internalTransactionId', 'gasFee', 'timestamp', 'blockId'])
-
-            for key, tx_data in self.transactions.items():
-                if len(tx_data.gas_fees) > 2:
-                    final_tx = tx_data.txs[-1]
-                    for gas_fee, timestamp in zip(tx_data.gas_fees, tx_data.timestamps):
-                        # Assuming you have a method to determine the blockId and sender
-                        writer.writerow([lx(final_tx.GetTxid().hex()).hex(), key, gas_fee, timestamp, self.current_block])
-        print(f"flushing block into csv{self.current_block}") 
-        print(f"amount of missed tx due to lack of memory: {self.unkown_tx_counter}") 
-        self.reset_cache()
+                writer.writerow(CSV_HEADER)
+            writer.writerows((row[:6] + [fee_rate(row[2], row[5])] + row[6:])[:n_columns] for row in rows)
     
-    def update_block_number(self):
-        latest_block = self.client.getblockcount()
-        if self.current_block + 1 == latest_block:
+    # Height of the connected block: one above the tip when it builds on it.
+    # A block building on an older block we connected replaces the ones after
+    # it, they are rolled back first. Otherwise (first block, missed blocks,
+    # block not fetched) the node's block count is used.
+    def update_block_number(self, block_hash: str, block: Optional[CBlock] = None):
+        previous = b2lx(block.hashPrevBlock) if block is not None else None
+        known = [connected_hash for connected_hash, _ in self.recent_blocks]
+        if previous is not None and previous in known:
+            while self.recent_blocks[-1][0] != previous:
+                self.disconnect_block(self.recent_blocks[-1][0])
             self.current_block += 1
         else:
-            raise ValueError("Block update not sequential, not handling that case for now")
-    
-    def reset_cache(self):
-        self.transactions = {}
-        self.value_per_prevout_cache: Dict[str, int] = {}
-        self.tx_meta_data_per_hash: Dict[str, TxMetaData] = {}
+            latest_block = self.client.getblockcount()
+            if latest_block != self.current_block + 1:
+                print(f"block {block_hash} at height {latest_block} does not follow block {self.current_block}, continuing from it")
+            self.current_block = latest_block
+        self.recent_blocks.append((block_hash, self.current_block))
+
+    def connect_block(self, block_hash: str):
+        if any(connected_hash == block_hash for connected_hash, _ in self.recent_blocks):
+            # announced by both hashblock and the sequence topic
+            return
+        self.flush_pending_transactions()
+        self.mempool_backfill.block_connected()
+        block = self.get_block(block_hash)
+        self.update_block_number(block_hash, block)
+        if block is None:
+            self.finish_block(None)
+            return
+        self.mempool.block_connected(tx.GetTxid()[::-1] for tx in block.vtx)
+        # before finish_block evicts what the block spent, outputs spent within it included
+        self.seed_block(block)
+        self.finish_block(self.get_spent_outpoints(block))
+
+    def finish_block(self, spent: Optional[List[bytes]]):
+        start = time.perf_counter_ns()
+        self.dump_block_transactions(self.finalize_block(spent))
+        BLOCK_FLUSH.record(time.perf_counter_ns() - start)
+
+    # Rolls back the tip: the groups its connection finalized are tracked
+    # again, and written once another block confirms them. Their rows for the
+    # disconnected block stay in the output, see RebidStoreReader.read(canonical=True).
+    # The disconnected transactions come back through the sequence topic.
+    def disconnect_block(self, block_hash: str) -> bool:
+        if not self.recent_blocks or self.recent_blocks[-1][0] != block_hash:
+            print(f"cannot disconnect block {block_hash}, it is not the tip we connected")
+            return False
+        self.flush_pending_transactions()
+        _, height = self.recent_blocks.pop()
+        self.current_block = height - 1
+        self.restore_retired_groups()
+        print(f"disconnected block {block_hash}, back to block {self.current_block}")
+        return True
+
+    # Tracks again the groups finalized by the last connected block
+    def restore_retired_groups(self) -> List[int]:
+        groups = []
+        if self.retired_groups:
+            for tx_data, outpoints in self.retired_groups.pop():
+                group = self.conflict_index.add(outpoints)
+                self.transactions[group] = tx_data
+                groups.append(group)
+        return groups
+
+    def handle_sequence(self, label: Label, hash: str, mempool_sequence: Optional[int]):
+        if label == Label.BLOCK_CONNECTED:
+            self.connect_block(hash)
+        elif label == Label.BLOCK_DISCONNECTED:
+            self.disconnect_block(hash)
+        elif label == Label.TX_ADDED_MEMPOOL:
+            self.mempool.added(bytes.fromhex(hash), mempool_sequence)
+        elif label == Label.TX_REMOVED_NONBLOCK:
+            txid = bytes.fromhex(hash)
+            self.mempool.removed(txid, mempool_sequence)
+            # replaced or evicted, its outputs can no longer be spent
+            self.prevout_cache.evict_outputs(txid[::-1])
+
+    # Groups to write out for the block spending `spent`, None for all of them
+    def finalize_block(self, spent: Optional[List[bytes]]) -> Optional[Set[int]]:
+        if spent is None:
+            # without the block we cannot tell what confirmed, flush everything
+            return None
+        # Outpoints spent by a connected block can never be spent again, the
+        # outputs of transactions leaving the mempool unconfirmed are evicted
+        # with their removal, see handle_sequence
+        self.prevout_cache.evict_spent(spent)
+        self.prevout_cache.checkpoint()
+        return self.get_finalized_groups(spent)
+
+    def get_block(self, block_hash: str) -> Optional[CBlock]:
+        try:
+            return self.client.getblock(lx(block_hash))
+        except (IndexError, JSONRPCError, ValueError) as err:
+            print(f"could not fetch block {block_hash}: {err}")
+            return None
+
+    def get_spent_outpoints(self, block: CBlock) -> List[bytes]:
+        return [outpoint_key(input.prevout.hash, input.prevout.n) for tx in block.vtx[1:] for input in tx.vin]
+
+    # Groups confirmed by the block, plus those that went quiet (evicted or
+    # replaced out of band) for max_idle_blocks
+    def get_finalized_groups(self, spent: List[bytes]) -> Set[int]:
+        finalized = set(self.conflict_index.groups_of(spent))
+        for group, tx_data in self.transactions.items():
+            if self.current_block - tx_data.last_block >= self.max_idle_blocks:
+                finalized.add(group)
+        return finalized
+
+    # prevout_cache is deliberately kept: re-fetching the same parents right
+    # after every block is what made RPC load spike when rebids are most active
+    def reset_cache(self, finalized: Optional[Set[int]] = None):
+        if finalized is None:
+            finalized = set(self.transactions)
+        # kept for a few blocks, in case a reorg disconnects the block
+        retired = []
+        for group in [group for group in self.transactions if group in finalized]:
+            retired.append((self.transactions.pop(group), list(self.conflict_index.group_outpoints[group])))
+            self.conflict_index.prune(group)
+        self.retired_groups.append(retired)
+        self.conflict_index.clear_watched()
+        self.rbf_filter.reset_counters()
+        self.parent_transactions: Dict[str, ScannedTransaction] = {}
         self.unkown_tx_counter = 0
+        self.inputs_local = 0
+        self.inputs_fetched = 0
+        self.ticker_bids.clear()
+        self.lost_messages.clear()
+        self.recovered_messages = 0
 
 if __name__ == "__main__":
     current_dir = os.path.dirname(os.path.abspath(__file__))
-    analyzer = MempoolAnalyzer(current_dir)
-    analyzer.process_file()
+    parser = argparse.ArgumentParser(description="Replay a mempool dump through the rebid analysis")
+    parser.add_argument("dump", nargs="?", help="text or binary dump, or dump archive directory, defaults to data/mempool_drop.txt")
+    parser.add_argument("--replay", metavar="FIXTURES", help="serve RPC answers recorded by main.py --record-rpc instead of querying a node")
+    parser.add_argument("--output", help="rebid store to append to, defaults to data/rebid_output.rebid; a .csv path appends csv rows instead")
+    parser.add_argument("--shards", type=int, default=1, help="analyze in this many worker processes, see analyzer/sharded_analyzer.py")
+    args = parser.parse_args()
+
+    # a fresh cache keeps replays deterministic, the on-disk one depends on previous runs
+    client, prevout_cache = None, None
+    if args.replay:
+        client, prevout_cache = ReplayProxy(RpcFixtureStore(args.replay)), PrevoutCache()
+    if args.shards > 1:
+        from functools import partial
+        from analyzer.sharded_analyzer import ShardedMempoolAnalyzer, node_client, replay_client
+        client_factory = partial(replay_client, args.replay) if args.replay else partial(node_client, current_dir)
+        cache_path = None if args.replay else os.path.join(current_dir, "data/prevout_cache.sqlite")
+        analyzer = ShardedMempoolAnalyzer(current_dir, args.shards, client_factory, client=client, cache_path=cache_path)
+    else:
+        analyzer = MempoolAnalyzer(current_dir, client=client, prevout_cache=prevout_cache)
+    if args.dump:
+        analyzer.input_file_path = args.dump
+    if args.output:
+        analyzer.output_file_path = args.output
+    reporter = MetricsReporter(METRICS)
+    start = time.perf_counter()
+    processed = analyzer.process_file()
+    elapsed = time.perf_counter() - start
+    print(f"replayed {processed} records in {elapsed:.2f}s ({processed / elapsed if elapsed else 0:.0f} records/s)")
+    print(reporter.line())
 
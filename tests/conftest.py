@@ -0,0 +1,14 @@
+import asyncio
+
+import pytest
+
+
+# ZMQHandler runs on the thread's event loop and leaves it stopped with its
+# receive tasks pending, every test gets a loop of its own
+@pytest.fixture
+def event_loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    asyncio.set_event_loop(None)
+    loop.close()
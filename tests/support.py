@@ -0,0 +1,34 @@
+import threading
+import time
+from typing import Callable
+
+from networking.zmq_handler.zmq_sub import ZMQHandler
+
+"""
+    Helpers for the tests driving ZMQHandler against the local stand-ins of
+    bitcoind (networking/fake_rpc_server.py, networking/fake_zmq_publisher.py).
+"""
+
+
+# Runs zmq_handler with publish() on another thread, and stops it once done()
+# holds; start() then drains what was queued. Errors of publish() are raised here
+def run_zmq_handler(zmq_handler: ZMQHandler, publish: Callable[[], None], done: Callable[[], bool], timeout: float = 60):
+    errors = []
+
+    def feed():
+        try:
+            publish()
+            deadline = time.monotonic() + timeout
+            while not done() and time.monotonic() < deadline:
+                time.sleep(0.02)
+        except BaseException as err:
+            errors.append(err)
+        finally:
+            zmq_handler.loop.call_soon_threadsafe(zmq_handler.stop)
+
+    thread = threading.Thread(target=feed, daemon=True)
+    thread.start()
+    zmq_handler.start()
+    thread.join()
+    if errors:
+        raise errors[0]
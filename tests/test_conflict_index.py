@@ -0,0 +1,62 @@
+import os
+
+from analyzer.conflict_index import ConflictIndex
+
+
+def outpoints(n):
+    return [os.urandom(36) for _ in range(n)]
+
+
+def test_replacement_adding_or_dropping_an_input_finds_its_group():
+    index = ConflictIndex()
+    a, b, c = outpoints(3)
+    group = index.add([a, b])
+    # a replacement with one more input, then one spending only the new one
+    assert index.groups_of([a, b, c]) == [group]
+    index.extend(group, [c])
+    assert index.groups_of([c]) == [group]
+    assert index.groups_of(outpoints(2)) == []
+
+
+def test_union_keeps_the_largest_group_as_root():
+    index = ConflictIndex()
+    small, large = outpoints(1), outpoints(3)
+    first, second = index.add(small), index.add(large)
+    root = index.union([first, second])
+    assert root == second
+    assert index.groups_of(small + large) == [root]
+    assert index.group_outpoints[root] == set(small + large)
+    assert first not in index.group_outpoints
+
+
+def test_union_of_merged_groups_resolves_every_absorbed_id():
+    index = ConflictIndex()
+    keys = outpoints(4)
+    groups = [index.add([key]) for key in keys]
+    left, right = index.union(groups[:2]), index.union(groups[2:])
+    root = index.union([left, right])
+    assert [index.find(group) for group in groups] == [root] * 4
+    assert index.groups_of(keys) == [root]
+
+
+def test_prune_drops_the_merged_group_and_its_absorbed_ids():
+    index = ConflictIndex()
+    keys, kept = outpoints(3), outpoints(1)
+    groups = [index.add([key]) for key in keys]
+    other = index.add(kept)
+    root = index.union(groups)
+    index.prune(groups[0])
+    assert index.groups_of(keys) == []
+    assert all(group not in index.parent for group in groups)
+    assert root not in index.absorbed
+    assert len(index) == 1
+    assert index.groups_of(kept) == [other]
+
+
+def test_watched_outpoints_are_contained_until_cleared():
+    index = ConflictIndex()
+    key = os.urandom(36)
+    index.watch([key])
+    assert key in index and index.groups_of([key]) == []
+    index.clear_watched()
+    assert key not in index
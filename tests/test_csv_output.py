@@ -0,0 +1,45 @@
+from bitcoin.rpc import Proxy
+
+from analyzer.prevout_cache import PrevoutCache
+from encoding.rebid_store import CSV_HEADER
+from networking.fake_rpc_server import FakeBitcoinRpcServer
+from rebid_analysis import MempoolAnalyzer
+
+# as MempoolAnalyzer.group_rows builds them
+ROW = ["aa" * 32, "bb" * 32, 1000, 1.5, 100, 110, "text/plain", "", ""]
+
+
+def write_csv(tmp_path, name: str, content: str = None) -> list:
+    (tmp_path / "data").mkdir(exist_ok=True)
+    path = tmp_path / name
+    if content is not None:
+        path.write_text(content)
+    with FakeBitcoinRpcServer(block_count=100) as server:
+        analyzer = MempoolAnalyzer(str(tmp_path), client=Proxy(service_url=server.url), prevout_cache=PrevoutCache())
+    analyzer.output_file_path = str(path)
+    analyzer.write_rows([ROW])
+    return [line.split(",") for line in path.read_text().splitlines()]
+
+
+def test_new_csv_gets_every_column(tmp_path):
+    header, row = write_csv(tmp_path, "new.csv")
+    assert header == CSV_HEADER
+    assert row == ["aa" * 32, "bb" * 32, "1000", "1.5", "100", "110", "9.091", "text/plain", "", ""]
+
+
+def test_empty_csv_gets_a_header(tmp_path):
+    header, row = write_csv(tmp_path, "empty.csv", "")
+    assert header == CSV_HEADER
+    assert len(row) == len(CSV_HEADER)
+
+
+# csvs started with an older header, whatever its column names, keep its column count
+def test_legacy_csv_keeps_its_layout(tmp_path):
+    legacy = "externaltransactionId,internalTransactionId,gasFee,timestamp,blockId\n"
+    header, row = write_csv(tmp_path, "legacy.csv", legacy)
+    assert header == legacy.strip().split(",")
+    assert row == ["aa" * 32, "bb" * 32, "1000", "1.5", "100"]
+
+    with_rates = ",".join(CSV_HEADER[:7]) + "\n"
+    _, row = write_csv(tmp_path, "rates.csv", with_rates)
+    assert row == ["aa" * 32, "bb" * 32, "1000", "1.5", "100", "110", "9.091"]
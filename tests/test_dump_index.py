@@ -0,0 +1,22 @@
+import random
+
+from bitcoin.core import b2lx
+
+from benchmarks.synthetic import make_mempool_mix
+from encoding.dump_format import BinaryDumpWriter, DumpRecord
+from encoding.dump_index import DumpLookupIndex, raw_transactions
+
+
+def test_recovered_records_are_indexed_like_live_ones(tmp_path):
+    path = str(tmp_path / "dump.bin")
+    _, transactions = make_mempool_mix(random.Random(0), 4, rbf_fraction=0.5)
+    writer = BinaryDumpWriter(path)
+    for i, tx in enumerate(transactions[:3]):
+        writer.write(DumpRecord(b"rawtx", i, i, i, tx.serialize()))
+    # fetched from the mempool after a gap, see MempoolAnalyzer.backfill_lost
+    writer.write(DumpRecord(b"recovered", 0, 2, 3, transactions[3].serialize()))
+    writer.close()
+
+    index = DumpLookupIndex.open(path)
+    assert [index.lookup(b2lx(tx.GetTxid())) for tx in transactions] == [[0], [1], [2], [3]]
+    assert [number for number, _ in raw_transactions(path)] == [0, 1, 2, 3]
@@ -0,0 +1,99 @@
+import os
+import random
+import struct
+
+from bitcoin.core import CTransaction, CTxInWitness, CTxWitness
+from bitcoin.core.script import CScriptWitness
+
+from benchmarks.synthetic import make_spend
+from networking.fake_zmq_publisher import FakeZmqPublisher
+from networking.zmq_handler.fan_in import FanIn
+from networking.zmq_handler.routes import Route
+from networking.zmq_handler.zmq_sub import ZMQHandler
+from tests.support import run_zmq_handler
+
+
+class Collect():
+    def __init__(self):
+        self.records = []
+
+    def handle_record(self, record):
+        self.records.append(record)
+
+
+def test_first_copy_wins():
+    fan_in = FanIn(["a", "b"])
+    tx, other = os.urandom(200), os.urandom(200)
+    assert fan_in.accept(1, b"rawtx", 0, tx, 1_000)
+    assert not fan_in.accept(0, b"rawtx", 0, tx, 4_000)
+    assert fan_in.accept(0, b"rawtx", 1, other, 5_000)
+    assert not fan_in.accept(1, b"rawtx", 1, other, 6_000)
+    assert [(source["first"], source["duplicates"]) for source in fan_in.stats()] == [(1, 1), (1, 1)]
+    assert fan_in.sources[0].delay.max == 3_000
+
+
+def test_witness_malleated_copy_is_a_duplicate():
+    rng = random.Random(1)
+    tx = make_spend(rng, [(os.urandom(32), 0), (os.urandom(32), 1)], 50_000)
+    # same inputs and outputs, other signatures: same txid, other bytes
+    malleated = CTransaction(tx.vin, tx.vout, tx.nLockTime, tx.nVersion,
+                             CTxWitness([CTxInWitness(CScriptWitness([os.urandom(72), os.urandom(33)])) for _ in tx.vin]))
+    assert malleated.GetTxid() == tx.GetTxid() and malleated.serialize() != tx.serialize()
+    fan_in = FanIn(["a", "b"])
+    assert fan_in.accept(0, b"rawtx", 0, tx.serialize(), 1_000)
+    assert not fan_in.accept(1, b"rawtx", 0, malleated.serialize(), 2_000)
+    assert [source["duplicates"] for source in fan_in.stats()] == [0, 1]
+
+
+def test_sequence_topic_is_taken_from_the_first_node_only():
+    fan_in = FanIn(["a", "b"])
+    event = os.urandom(32) + b"A" + struct.pack("<Q", 1)
+    assert not fan_in.accept(1, b"sequence", 0, event, 0)
+    assert fan_in.accept(0, b"sequence", 0, event, 0)
+    # never deduplicated, the mempool sequences are per node
+    assert fan_in.accept(0, b"sequence", 1, event, 0)
+
+
+def test_gaps_are_counted_per_source_and_topic():
+    fan_in = FanIn(["a", "b"])
+    for sequence in (0, 1, 4, 5):
+        fan_in.accept(0, b"rawtx", sequence, os.urandom(100), 0)
+    for sequence in (0, 1, 2):
+        fan_in.accept(0, b"hashblock", sequence, os.urandom(32), 0)
+    for sequence in (7, 9, 0):
+        # a smaller sequence is a restarted node
+        fan_in.accept(1, b"rawtx", sequence, os.urandom(100), 0)
+    assert [source["gaps"] for source in fan_in.stats()] == [2, 1]
+
+
+# Two fake nodes relay the same transactions, the second one losing some on
+# the way: every transaction is handled once and each node's gaps are its own
+def test_two_nodes_are_deduplicated(event_loop):
+    rng = random.Random(0)
+    schedule = [(0, b"rawtx", os.urandom(rng.randrange(150, 400))) for _ in range(500)]
+    # a gap is seen with the next frame, the last one is kept
+    lost = set(rng.sample(range(len(schedule) - 1), 25))
+    publishers = [FakeZmqPublisher("tcp://127.0.0.1:*", sndhwm=0) for _ in range(2)]
+    collect = Collect()
+    zmq_handler = ZMQHandler(sub_topic=["rawtx"], routes=[Route("collect", collect)], endpoints=[publisher.endpoint for publisher in publishers])
+
+    def publish():
+        for publisher in publishers:
+            publisher.wait_subscribed([b"rawtx"])
+        publishers[1].publish(schedule, speed=0, lose=lost)
+        publishers[0].publish(schedule, speed=0)
+
+    try:
+        run_zmq_handler(zmq_handler, publish, lambda: sum(source.received for source in zmq_handler.fan_in.sources) == 2 * len(schedule) - len(lost))
+    finally:
+        for publisher in publishers:
+            publisher.close()
+
+    assert sorted(bytes(record.body) for record in collect.records) == sorted(body for _, _, body in schedule)
+    first, second = zmq_handler.fan_in.stats()
+    assert (first["gaps"], second["gaps"]) == (0, len(lost))
+    assert first["first"] + second["first"] == len(schedule)
+    assert first["duplicates"] + second["duplicates"] == len(schedule) - len(lost)
+    # what the second node lost came from the first
+    received = {bytes(record.body): record.source for record in collect.records}
+    assert all(received[schedule[position][2]] == 0 for position in lost)
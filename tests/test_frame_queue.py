@@ -0,0 +1,15 @@
+import os
+
+from encoding.dump_format import DumpRecord
+from networking.zmq_handler.frame_queue import FrameQueue, OverloadPolicy
+
+
+def test_spilled_frames_keep_their_source_and_losses(tmp_path):
+    queue = FrameQueue(2, OverloadPolicy.SPILL, str(tmp_path / "spill.bin"))
+    records = [DumpRecord(b"rawtx", i, i, i, os.urandom(50), source=i % 3, lost=i % 2) for i in range(6)]
+    for record in records:
+        queue.put(record)
+    assert queue.spilled == 4
+    queue.close()
+    popped = list(iter(queue.get, None))
+    assert [(r.sequence, r.source, r.lost, bytes(r.body)) for r in popped] == [(r.sequence, r.source, r.lost, r.body) for r in records]
@@ -0,0 +1,23 @@
+import threading
+
+from networking.metrics import Metrics
+
+
+def test_shared_histogram_keeps_every_thread_count():
+    metrics = Metrics()
+    histogram = metrics.shared_histogram("stage_seconds", stage="queue_wait")
+
+    def record():
+        for value in range(20_000):
+            histogram.record(value)
+
+    threads = [threading.Thread(target=record) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert histogram.count == 80_000
+    assert 'ordinarb_stage_seconds_count{stage="queue_wait"} 80000' in metrics.exposition()
+    drained = metrics.drain()
+    assert drained["histograms"][("stage_seconds", (("stage", "queue_wait"),))][1] == 80_000
+    assert histogram.count == 0
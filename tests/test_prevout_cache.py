@@ -0,0 +1,68 @@
+import os
+
+from analyzer.prevout_cache import ENTRY_SIZE, PrevoutCache, outpoint_key
+
+
+def txids(n):
+    return [os.urandom(32) for _ in range(n)]
+
+
+def test_evicted_entries_are_read_back_from_the_spill(tmp_path):
+    cache = PrevoutCache(memory_budget=10 * ENTRY_SIZE, spill_path=str(tmp_path / "prevouts.sqlite"))
+    hashes = txids(30)
+    for value, tx_hash in enumerate(hashes, 1):
+        cache.put_outputs(tx_hash, [value])
+    assert len(cache) <= 10 and cache.spills >= 20
+    assert cache.get(outpoint_key(hashes[0], 0)) == 1
+    assert cache.disk_hits == 1 and cache.hits == 1
+
+
+def test_spent_outpoints_miss_in_memory_and_on_disk(tmp_path):
+    cache = PrevoutCache(memory_budget=10 * ENTRY_SIZE, spill_path=str(tmp_path / "prevouts.sqlite"))
+    hashes = txids(30)
+    for value, tx_hash in enumerate(hashes, 1):
+        cache.put_outputs(tx_hash, [value])
+    # the first is spilled, the last still in memory
+    spent = [outpoint_key(hashes[0], 0), outpoint_key(hashes[-1], 0)]
+    cache.evict_spent(spent)
+    assert [cache.get(key) for key in spent] == [None, None]
+    assert cache.misses == 2
+    assert cache.get(outpoint_key(hashes[1], 0)) == 2
+
+
+def test_unconfirmed_outputs_are_evicted_from_memory_and_disk(tmp_path):
+    cache = PrevoutCache(memory_budget=10 * ENTRY_SIZE, spill_path=str(tmp_path / "prevouts.sqlite"))
+    evicted, others = txids(1)[0], txids(20)
+    cache.put_outputs(evicted, [1, 2, 3])
+    for tx_hash in others:
+        cache.put_outputs(tx_hash, [5])
+    cache.evict_outputs(evicted)
+    assert all(cache.peek(outpoint_key(evicted, n)) is None for n in range(3))
+
+
+def test_restart_is_warm_from_the_spill_file(tmp_path):
+    path = str(tmp_path / "prevouts.sqlite")
+    cache = PrevoutCache(spill_path=path)
+    hashes = txids(5)
+    for value, tx_hash in enumerate(hashes, 1):
+        cache.put_outputs(tx_hash, [value, value * 10])
+    cache.evict_spent([outpoint_key(hashes[0], 1)])
+    cache.close()
+
+    reopened = PrevoutCache(spill_path=path)
+    assert len(reopened) == 0
+    assert reopened.get(outpoint_key(hashes[2], 1)) == 30
+    assert reopened.get(outpoint_key(hashes[0], 0)) == 1
+    assert reopened.get(outpoint_key(hashes[0], 1)) is None
+    assert reopened.disk_hits == 2
+    reopened.close()
+
+
+def test_checkpoint_trims_the_spill_file(tmp_path):
+    cache = PrevoutCache(spill_path=str(tmp_path / "prevouts.sqlite"), max_spill_entries=100)
+    for tx_hash in txids(150):
+        cache.put_outputs(tx_hash, [1])
+    cache.checkpoint()
+    assert cache.trimmed == 60
+    assert cache.db.execute("SELECT COUNT(*) FROM prevouts").fetchone()[0] == 90
+    cache.close()
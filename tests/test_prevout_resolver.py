@@ -0,0 +1,120 @@
+import random
+
+import pytest
+from bitcoin.core import b2lx
+from bitcoin.rpc import Proxy
+
+from analyzer.prevout_cache import PrevoutCache
+from analyzer.prevout_resolver import PrevoutResolver
+from benchmarks.synthetic import make_consolidations, make_parent
+from networking.fake_rpc_server import FakeBitcoinRpcServer
+from rebid_analysis import MempoolAnalyzer
+
+
+@pytest.fixture
+def server():
+    with FakeBitcoinRpcServer(block_count=100) as server:
+        yield server
+
+
+def test_fetch_sends_one_batch(server):
+    rng = random.Random(0)
+    parents = [make_parent(rng, 2) for _ in range(20)]
+    for parent in parents:
+        server.add_transaction(parent)
+    unknown = b"\x01" * 32
+    resolver = PrevoutResolver(Proxy(service_url=server.url))
+
+    fetched = resolver.fetch([parent.GetTxid() for parent in parents] + [parents[0].GetTxid(), unknown])
+
+    assert server.http_requests == 1
+    # duplicates are asked once
+    assert server.rpc_calls == 21
+    assert fetched[unknown] is None
+    for parent in parents:
+        assert fetched[parent.GetTxid()].GetTxid() == parent.GetTxid()
+        assert [output.nValue for output in fetched[parent.GetTxid()].vout] == [output.nValue for output in parent.vout]
+
+
+def test_fetch_chunks_by_max_batch_size(server):
+    rng = random.Random(1)
+    parents = [make_parent(rng, 1) for _ in range(5)]
+    for parent in parents:
+        server.add_transaction(parent)
+    resolver = PrevoutResolver(Proxy(service_url=server.url), max_batch_size=2)
+
+    assert len(resolver.fetch(parent.GetTxid() for parent in parents)) == 5
+    assert server.http_requests == resolver.rpc_round_trips == 3
+
+
+def test_window_resolves_every_parent_in_one_round_trip(server, tmp_path):
+    (tmp_path / "data").mkdir()
+    parents, spends = make_consolidations(random.Random(2), n_transactions=10, n_inputs=5)
+    for parent in parents:
+        server.add_transaction(parent)
+    analyzer = MempoolAnalyzer(str(tmp_path), client=Proxy(service_url=server.url), batch_window=len(spends), prevout_cache=PrevoutCache())
+    server.reset_counters()
+
+    for spend in spends:
+        analyzer.seed_outputs(spend)
+        analyzer.queue_transaction(spend, 0.0)
+
+    assert server.http_requests == 1
+    assert server.rpc_calls == len(parents)
+    assert len(analyzer.transactions) == len(spends)
+    assert analyzer.unkown_tx_counter == 0
+
+
+def test_failed_lookup_is_retried_once(server):
+    rng = random.Random(3)
+    parents = [make_parent(rng, 1) for _ in range(4)]
+    for parent in parents:
+        server.add_transaction(parent)
+    server.failing[b2lx(parents[1].GetTxid())] = 1
+    resolver = PrevoutResolver(Proxy(service_url=server.url))
+
+    fetched = resolver.fetch(parent.GetTxid() for parent in parents)
+
+    assert all(fetched[parent.GetTxid()] is not None for parent in parents)
+    # the retry asks for the failed lookup only
+    assert resolver.rpc_round_trips == 2 and resolver.rpc_calls == 5
+    assert resolver.failures == 0
+
+
+def test_failing_lookup_drops_only_its_transaction(server, tmp_path):
+    (tmp_path / "data").mkdir()
+    parents, spends = make_consolidations(random.Random(4), n_transactions=10, n_inputs=3)
+    for parent in parents:
+        server.add_transaction(parent)
+    server.failing[b2lx(parents[4].GetTxid())] = 2
+    analyzer = MempoolAnalyzer(str(tmp_path), client=Proxy(service_url=server.url), batch_window=len(spends), prevout_cache=PrevoutCache())
+
+    for spend in spends:
+        analyzer.queue_transaction(spend, 0.0)
+
+    assert analyzer.resolver.failures == 1
+    # parents[4] is an input of the second consolidation
+    assert len(analyzer.transactions) == len(spends) - 1
+    assert analyzer.unkown_tx_counter == 1
+
+
+def test_unknown_prevout_drops_only_its_transaction(server, tmp_path):
+    (tmp_path / "data").mkdir()
+    parents, spends = make_consolidations(random.Random(5), n_transactions=10, n_inputs=3)
+    # never added: the node answers RPC_INVALID_ADDRESS_OR_KEY for it
+    unknown = parents.pop(7)
+    for parent in parents:
+        server.add_transaction(parent)
+    analyzer = MempoolAnalyzer(str(tmp_path), client=Proxy(service_url=server.url), batch_window=len(spends), prevout_cache=PrevoutCache())
+    server.reset_counters()
+
+    for spend in spends:
+        analyzer.queue_transaction(spend, 0.0)
+
+    assert server.http_requests == 1
+    assert analyzer.resolver.failures == 0
+    assert analyzer.unkown_tx_counter == 1
+    # parents 6 to 8 are the inputs of the third consolidation
+    recorded = {bytes(tx_data.latest_txid) for tx_data in analyzer.transactions.values()}
+    assert recorded == {spend.GetTxid() for spend in spends} - {spends[2].GetTxid()}
+    assert unknown.GetTxid() in {txin.prevout.hash for txin in spends[2].vin}
@@ -0,0 +1,92 @@
+import random
+
+from bitcoin.core import CTransaction
+
+from analyzer.prevout_cache import PrevoutCache
+from analyzer.rpc_fixtures import RecordingProxy, ReplayProxy, RpcFixtureStore
+from benchmarks.synthetic import make_rbf_storm
+from networking.fake_rpc_server import FakeBitcoinRpcServer
+from networking.fake_zmq_publisher import FakeZmqPublisher
+from networking.zmq_handler.routes import Route
+from networking.zmq_handler.zmq_handlers import BinaryDumpHandler, RebidHandler
+from networking.zmq_handler.zmq_sub import ZMQHandler
+from rebid_analysis import MempoolAnalyzer
+from tests.support import run_zmq_handler
+
+TOPICS = [b"rawtx", b"hashblock"]
+
+
+# Records a session as main.py --record-rpc does, the stream published by a
+# fake node that enters every rawtx in its mempool, and never publishes the
+# frames at the positions in `lose`. Returns the live csv and the handlers
+def record_session(tmp_path, lose=()):
+    (tmp_path / "data").mkdir()
+    dump_path, fixtures_path = str(tmp_path / "dump.bin"), str(tmp_path / "fixtures.sqlite")
+    parents, schedule, blocks = make_rbf_storm(random.Random(0), n_groups=60, bumps=4, duration=6, bump_interval=0.5,
+                                               background_rate=50, block_interval=1)
+    with FakeBitcoinRpcServer(block_count=100) as server:
+        for parent in parents:
+            server.add_transaction(parent)
+        store = RpcFixtureStore(fixtures_path)
+        dump_handler = BinaryDumpHandler(dump_path)
+        rebid_handler = RebidHandler(str(tmp_path), client=RecordingProxy(store, service_url=server.url), prevout_cache=PrevoutCache(),
+                                     dump_handler=dump_handler)
+        rebid_handler.handler.output_file_path = str(tmp_path / "live.csv")
+        # a backfill at every gap
+        rebid_handler.handler.mempool_backfill.min_interval = 0
+        routes = [
+            Route("dump", dump_handler),
+            Route("rebid", rebid_handler, message_filter=rebid_handler.accepts, topics=frozenset(TOPICS)),
+        ]
+        # unbounded, nothing is lost but the frames never published
+        publisher = FakeZmqPublisher("tcp://127.0.0.1:*", sndhwm=0)
+        zmq_handler = ZMQHandler(sub_topic=[topic.decode() for topic in TOPICS], routes=routes, endpoints=[publisher.endpoint])
+
+        def before_send(topic: bytes, body: bytes):
+            if topic == b"hashblock":
+                server.add_block(blocks[body])
+            else:
+                server.add_transaction(CTransaction.deserialize(body), in_mempool=True)
+
+        def publish():
+            publisher.wait_subscribed(TOPICS)
+            publisher.publish(schedule, speed=0, before_send=before_send, lose=lose)
+
+        try:
+            run_zmq_handler(zmq_handler, publish, lambda: all(queue.received == len(schedule) - len(lose) for queue in zmq_handler.queues))
+        finally:
+            publisher.close()
+        dump_handler.writer.close()
+        store.close()
+    return (tmp_path / "live.csv").read_text(), zmq_handler, rebid_handler.handler, len(schedule)
+
+
+def replay_session(tmp_path) -> MempoolAnalyzer:
+    analyzer = MempoolAnalyzer(str(tmp_path), client=ReplayProxy(RpcFixtureStore(str(tmp_path / "fixtures.sqlite"))), prevout_cache=PrevoutCache())
+    analyzer.input_file_path = str(tmp_path / "dump.bin")
+    analyzer.output_file_path = str(tmp_path / "replay.csv")
+    return analyzer
+
+
+# A recorded session is replayed offline from its dump and fixtures into the same csv
+def test_replay_reproduces_recorded_session(tmp_path, event_loop):
+    live, zmq_handler, _, published = record_session(tmp_path)
+    assert zmq_handler.continuity.gaps == 0
+    assert live.count("\n") > 1
+
+    assert replay_session(tmp_path).process_file() == published
+    assert (tmp_path / "replay.csv").read_text() == live
+
+
+# The rawtx backfilled after gaps are recorded, and replayed where they were handled
+def test_replay_reproduces_backfilled_session(tmp_path, event_loop):
+    rng = random.Random(1)
+    lose = set(rng.sample(range(100, 400), 40))
+    live, zmq_handler, live_analyzer, published = record_session(tmp_path, lose)
+    assert zmq_handler.continuity.gaps > 0
+    assert live_analyzer.mempool_backfill.recovered > 0
+    assert live_analyzer.recovered_records == live_analyzer.mempool_backfill.recovered
+
+    analyzer = replay_session(tmp_path)
+    assert analyzer.process_file() == published - len(lose)
+    assert (tmp_path / "replay.csv").read_text() == live
@@ -0,0 +1,102 @@
+import random
+
+import pytest
+from bitcoin.core import CBlock, CMutableTxIn, CMutableTxOut, CTransaction, b2lx
+from bitcoin.rpc import Proxy
+
+from analyzer.prevout_cache import PrevoutCache, outpoint_key
+from benchmarks.synthetic import make_consolidations
+from networking.fake_rpc_server import FakeBitcoinRpcServer
+from networking.zmq_handler.zmq_objects import Label
+from rebid_analysis import MempoolAnalyzer
+
+
+@pytest.fixture
+def server():
+    with FakeBitcoinRpcServer(block_count=10) as server:
+        yield server
+
+
+def make_block(previous, *transactions, coinbase_value=1):
+    coinbase = CTransaction([CMutableTxIn()], [CMutableTxOut(coinbase_value)])
+    return CBlock(hashPrevBlock=previous.GetHash() if previous is not None else b"\x00" * 32, vtx=[coinbase, *transactions])
+
+
+def connect(server, analyzer, block):
+    server.add_block(block)
+    analyzer.handle_sequence(Label.BLOCK_CONNECTED, b2lx(block.GetHash()), None)
+
+
+# 3 groups of 4 bids; the second block confirms the last bid of the first group
+@pytest.fixture
+def session(server, tmp_path):
+    (tmp_path / "data").mkdir()
+    parents, spends = make_consolidations(random.Random(1), 3, 2, 4)
+    for parent in parents:
+        server.add_transaction(parent)
+    analyzer = MempoolAnalyzer(str(tmp_path), client=Proxy(service_url=server.url), prevout_cache=PrevoutCache())
+    analyzer.output_file_path = str(tmp_path / "rebid_output.csv")
+    for i, spend in enumerate(spends):
+        analyzer.queue_transaction(spend, float(i))
+    first = make_block(None)
+    connect(server, analyzer, first)
+    return analyzer, spends, first
+
+
+def spent_outpoints(transaction):
+    return [outpoint_key(txin.prevout.hash, txin.prevout.n) for txin in transaction.vin]
+
+
+def test_disconnecting_a_block_restores_its_groups(server, session):
+    analyzer, spends, first = session
+    assert len(analyzer.transactions) == 3
+    tracked = dict(analyzer.transactions)
+    second = make_block(first, spends[3])
+    connect(server, analyzer, second)
+    assert len(analyzer.transactions) == 2
+    assert analyzer.conflict_index.groups_of(spent_outpoints(spends[3])) == []
+
+    server.disconnect_block(second)
+    analyzer.handle_sequence(Label.BLOCK_DISCONNECTED, b2lx(second.GetHash()), None)
+
+    assert analyzer.current_block == 11
+    assert sorted(map(id, analyzer.transactions.values())) == sorted(map(id, tracked.values()))
+    [group] = analyzer.conflict_index.groups_of(spent_outpoints(spends[3]))
+    restored = analyzer.transactions[group]
+    assert len(restored.gas_fees) == 4
+    # a bid spending its outpoints lands in the restored group again
+    analyzer.queue_transaction(spends[2], 99.0)
+    assert len(analyzer.transactions) == 3 and len(restored.gas_fees) == 5
+
+
+def test_competing_block_rolls_back_the_tip(server, session):
+    analyzer, spends, first = session
+    second = make_block(first, spends[3])
+    connect(server, analyzer, second)
+    server.disconnect_block(second)
+    # a block on the same parent replaces the tip without a disconnect message
+    connect(server, analyzer, make_block(first, spends[7], coinbase_value=2))
+
+    assert analyzer.current_block == 12
+    assert analyzer.conflict_index.groups_of(spent_outpoints(spends[3]))
+    assert analyzer.conflict_index.groups_of(spent_outpoints(spends[7])) == []
+    assert len(analyzer.transactions) == 2
+
+
+def test_mempool_resync_applies_the_difference(server, session):
+    analyzer, spends, first = session
+    for spend in spends[:2]:
+        server.add_transaction(spend, in_mempool=True)
+    # the first event syncs the index from getrawmempool
+    analyzer.handle_sequence(Label.TX_ADDED_MEMPOOL, b2lx(spends[2].GetTxid()), 1)
+    assert analyzer.mempool.synced and len(analyzer.mempool) == 2
+
+    second = make_block(first, spends[0])
+    connect(server, analyzer, second)
+    assert b2lx(spends[0].GetTxid()) not in {txid.hex() for txid in analyzer.mempool.txids}
+    server.disconnect_block(second)
+    server.remove_from_mempool(b2lx(spends[1].GetTxid()))
+    # a skipped mempool sequence resyncs: the disconnected bid is back, the removed one gone
+    analyzer.handle_sequence(Label.TX_ADDED_MEMPOOL, b2lx(spends[5].GetTxid()), server.mempool_sequence + 5)
+    assert {txid.hex() for txid in analyzer.mempool.txids} == {b2lx(spends[0].GetTxid())}
+    assert analyzer.mempool.gaps == 1 and analyzer.mempool.resyncs == 2
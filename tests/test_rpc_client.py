@@ -0,0 +1,63 @@
+import random
+import threading
+
+import pytest
+from bitcoin.core import b2lx
+from bitcoin.rpc import JSONRPCError
+
+from benchmarks.synthetic import make_parent
+from networking.fake_rpc_server import FakeBitcoinRpcServer
+from networking.rpc_client import RPC_HTTP_ERROR, PooledProxy
+
+
+def test_identical_calls_in_flight_are_coalesced():
+    parent = make_parent(random.Random(0), 2)
+    with FakeBitcoinRpcServer(latency=0.2) as server:
+        server.add_transaction(parent)
+        proxy = PooledProxy(service_url=server.url)
+        coalesced = proxy.rpc.coalesced
+        answers = []
+        barrier = threading.Barrier(10)
+
+        def fetch():
+            barrier.wait()
+            answers.append(proxy.call("getrawtransaction", b2lx(parent.GetTxid()), 0))
+
+        threads = [threading.Thread(target=fetch) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert answers == [parent.serialize().hex()] * 10
+        assert server.rpc_calls == 1
+        assert proxy.rpc.coalesced - coalesced == 9
+
+
+def test_keep_alive_connection_is_reused():
+    with FakeBitcoinRpcServer(block_count=7) as server:
+        proxy = PooledProxy(service_url=server.url)
+        assert [proxy.getblockcount() for _ in range(20)] == [7] * 20
+        assert server.connections == 1
+
+
+def test_overloaded_answer_is_retried():
+    with FakeBitcoinRpcServer(block_count=7) as server:
+        proxy = PooledProxy(service_url=server.url, retries=2, backoff=0.01)
+        retried = proxy.rpc.retried
+        server.overloaded = 2
+        assert proxy.getblockcount() == 7
+        assert server.rejected == 2
+        assert proxy.rpc.retried - retried == 2
+
+
+def test_overloaded_answer_fails_once_retries_are_spent():
+    with FakeBitcoinRpcServer(block_count=7) as server:
+        proxy = PooledProxy(service_url=server.url, retries=1, backoff=0.01)
+        server.overloaded = 2
+        with pytest.raises(JSONRPCError) as err:
+            proxy.getblockcount()
+        assert err.value.error["code"] == RPC_HTTP_ERROR
+        assert "503" in err.value.error["message"]
+        # the node is back
+        assert proxy.getblockcount() == 7